@@ -0,0 +1,218 @@
+# astcache.py
+#
+# On-disk cache of parsed programs, in the spirit of __pycache__.  The
+# Statements tree of foo.wb is stored in __wbcache__/foo.wb.ast next to it,
+# tagged with a hash of the source and of the tokenizer/parser/format
+# versions.  A stale or missing entry is simply rebuilt.
+#
+# The encoding is a string table plus a postfix program over it, held in an
+# array of 32-bit words.  Each word is (argument << 2 | kind):
+#
+#     STR i    push strings[i]
+#     NONE     push None
+#     LIST k   pop k values, push them as a list
+#     NODE c   pop as many values as node class c has fields, push c(*values)
+#
+# so decoding is a single loop with no recursion and no pickle.
+import hashlib
+import os
+import struct
+from array import array
+
+from cparser import PARSER_VERSION, parse_source
+from model import *
+from tokenizer import TOKENIZER_VERSION
+
+# Bump if a class in model.node_classes changes its fields
+FORMAT_VERSION = 2
+
+_field_names = [[f.name for f in node_fields(cls)] for cls in node_classes]
+
+NODE, STR, LIST, NONE = range(4)
+
+_MAGIC = b"WBAS"
+_HEADER = struct.Struct("<4s32sII")
+
+
+def encode_tree(node: Node) -> bytes:
+    """Encode a tree of model nodes (the key is left blank)."""
+    return _pack(b"\0" * 32, node)
+
+
+def decode_tree(data: bytes) -> Node:
+    """Decode the output of encode_tree()."""
+    return _unpack(data)[1]
+
+
+def _pack(key, node):
+    words = array("I")
+    strings = []
+    string_index = {}
+
+    def encode(value):
+        if value is None:
+            words.append(NONE)
+        elif isinstance(value, str):
+            index = string_index.get(value)
+            if index is None:
+                index = string_index[value] = len(strings)
+                strings.append(value)
+            words.append(index << 2 | STR)
+        elif isinstance(value, list):
+            for item in value:
+                encode(item)
+            words.append(len(value) << 2 | LIST)
+        else:
+            code = node_codes[type(value)]
+            for name in _field_names[code]:
+                encode(getattr(value, name))
+            words.append(code << 2 | NODE)
+
+    encode(node)
+    lengths = array("I", map(len, strings))
+    return b"".join(
+        [
+            _HEADER.pack(_MAGIC, key, len(strings), len(words)),
+            lengths.tobytes(),
+            words.tobytes(),
+            "".join(strings).encode(),
+        ]
+    )
+
+
+def _unpack(data):
+    """Return (key, tree) for an encoded tree."""
+    magic, key, nstrings, nwords = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError("Not an encoded Wabbit tree")
+    offset = _HEADER.size
+    lengths = array("I")
+    lengths.frombytes(data[offset : offset + 4 * nstrings])
+    offset += 4 * nstrings
+    words = array("I")
+    words.frombytes(data[offset : offset + 4 * nwords])
+    text = data[offset + 4 * nwords :].decode()
+    strings = []
+    start = 0
+    for length in lengths:
+        strings.append(text[start : start + length])
+        start += length
+
+    classes = [(cls, len(names)) for cls, names in zip(node_classes, _field_names)]
+    stack = []
+    push = stack.append
+    for word in words:
+        kind = word & 3
+        arg = word >> 2
+        if kind == STR:
+            push(strings[arg])
+        elif kind == NODE:
+            cls, nfields = classes[arg]
+            if nfields:
+                values = stack[-nfields:]
+                del stack[-nfields:]
+                push(cls(*values))
+            else:
+                push(cls())
+        elif kind == LIST:
+            if arg:
+                values = stack[-arg:]
+                del stack[-arg:]
+                push(values)
+            else:
+                push([])
+        else:
+            push(None)
+    (tree,) = stack
+    return key, tree
+
+
+def source_key(source: str) -> bytes:
+    digest = hashlib.sha256(
+        f"{TOKENIZER_VERSION}.{PARSER_VERSION}.{FORMAT_VERSION}\0".encode()
+    )
+    digest.update(source.encode())
+    return digest.digest()
+
+
+def cache_path(filename, cache_dir=None):
+    directory, base = os.path.split(filename)
+    if cache_dir is None:
+        cache_dir = os.path.join(directory, "__wbcache__")
+    return os.path.join(cache_dir, base + ".ast")
+
+
+def parse_file_cached(filename, cache_dir=None) -> Statements:
+    """
+    Parse a Wabbit file, loading the tree from the cache when the source
+    hasn't changed since it was stored and storing it otherwise.
+    """
+    with open(filename) as file:
+        source = file.read()
+    key = source_key(source)
+    path = cache_path(filename, cache_dir)
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except OSError:
+        data = b""
+    if len(data) >= _HEADER.size and _HEADER.unpack_from(data)[:2] == (_MAGIC, key):
+        # The key matches, so only a damaged file fails to decode.  That is
+        # a miss like any other.
+        try:
+            return _unpack(data)[1]
+        except Exception:
+            pass
+    tree = parse_source(source)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "wb") as file:
+        file.write(_pack(key, tree))
+    os.replace(temp, path)
+    return tree
+
+
+def test_roundtrip():
+    import tempfile
+
+    programs = os.path.join(os.path.dirname(__file__), "..", "tests", "Programs")
+    sources = [
+        "print 1 + 2 * -3;",
+        "var x int; const c = 'a'; print x; print c;",
+        "func f(a int, b float) int { if a < 2 { return a; } else { return f(a - 1, b); } }",
+        "while true { break; }",
+        "",
+    ]
+    for filename in sorted(os.listdir(programs)):
+        with open(os.path.join(programs, filename)) as file:
+            source = file.read()
+        try:
+            parse_source(source)
+        except SyntaxError:
+            continue
+        sources.append(source)
+    for source in sources:
+        tree = parse_source(source)
+        assert decode_tree(encode_tree(tree)) == tree, source
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "test.wb")
+        with open(filename, "w") as file:
+            file.write(sources[2])
+        tree = parse_file_cached(filename)
+        path = cache_path(filename)
+        assert os.path.exists(path)
+        assert parse_file_cached(filename) == tree
+
+        # A damaged entry is rebuilt
+        with open(path, "r+b") as file:
+            file.seek(-8, os.SEEK_END)
+            file.write(b"\xff" * 8)
+        assert parse_file_cached(filename) == tree
+        with open(path, "rb") as file:
+            assert _unpack(file.read())[1] == tree
+
+        # So is one for other source
+        with open(filename, "w") as file:
+            file.write(sources[0])
+        assert parse_file_cached(filename) == parse_source(sources[0])
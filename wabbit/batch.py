@@ -0,0 +1,176 @@
+# batch.py
+#
+# Tokenize many Wabbit files at once.  Files are spread over a process
+# pool and the token stream of each file is cached on disk, keyed by a
+# hash of the file contents and the tokenizer version, so unchanged files
+# are never lexed twice.
+#
+#     python batch.py [-j workers] [--cache dir] file_or_directory ...
+import glob
+import hashlib
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from tokenizer import TOKENIZER_VERSION, TokenBuffer, tokenize_buffer
+
+DEFAULT_CACHE_DIR = ".wabbit_cache"
+
+# Cache file layout: magic, token count, the item size of each of the four
+# TokenBuffer columns, then the columns.  Everything is little-endian; a
+# file whose item sizes differ from this platform's arrays is a miss.
+_MAGIC = b"WBT2"
+_HEADER = struct.Struct("<4sI4B")
+
+
+def _columns(buffer):
+    return (buffer.codes, buffer.starts, buffer.ends, buffer.lines)
+
+
+def source_key(source: str) -> str:
+    """Cache key for a source text under the current tokenizer."""
+    digest = hashlib.sha256(f"{TOKENIZER_VERSION}\0".encode())
+    digest.update(source.encode())
+    return digest.hexdigest()
+
+
+def load_tokens(path, source) -> TokenBuffer | None:
+    """Read a cached TokenBuffer for source, or None if there is none."""
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < _HEADER.size:
+        return None
+    magic, count, *itemsizes = _HEADER.unpack_from(data)
+    buffer = TokenBuffer(source)
+    columns = _columns(buffer)
+    if (
+        magic != _MAGIC
+        or itemsizes != [c.itemsize for c in columns]
+        or len(data) != _HEADER.size + count * sum(itemsizes)
+    ):
+        # Truncated or foreign file; treat as a miss and overwrite it
+        return None
+    offset = _HEADER.size
+    for column in columns:
+        size = count * column.itemsize
+        column.frombytes(data[offset : offset + size])
+        if sys.byteorder == "big":
+            column.byteswap()
+        offset += size
+    return buffer
+
+
+def save_tokens(path, buffer: TokenBuffer):
+    """Write buffer to path, atomically so concurrent workers never see half a file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f"{path}.{os.getpid()}.tmp"
+    columns = _columns(buffer)
+    with open(temp, "wb") as file:
+        file.write(_HEADER.pack(_MAGIC, len(buffer), *(c.itemsize for c in columns)))
+        for column in columns:
+            if sys.byteorder == "big":
+                column = column[:]
+                column.byteswap()
+            file.write(column.tobytes())
+    os.replace(temp, path)
+
+
+def tokenize_cached(filename, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Tokenize one file through the cache.
+
+    Returns (tokens, hit, seconds) where hit tells whether the tokens came
+    from the cache.
+    """
+    start = time.perf_counter()
+    with open(filename) as file:
+        source = file.read()
+    path = os.path.join(cache_dir, source_key(source) + ".tok")
+    tokens = load_tokens(path, source)
+    hit = tokens is not None
+    if not hit:
+        tokens = tokenize_buffer(source)
+        save_tokens(path, tokens)
+    return tokens, hit, time.perf_counter() - start
+
+
+@dataclass
+class FileResult:
+    filename: str
+    tokens: TokenBuffer
+    hit: bool
+    seconds: float
+
+
+@dataclass
+class BatchResult:
+    files: list[FileResult] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def hit_rate(self):
+        if not self.files:
+            return 0.0
+        return sum(f.hit for f in self.files) / len(self.files)
+
+    def report(self):
+        lines = []
+        for f in sorted(self.files, key=lambda f: f.seconds, reverse=True):
+            status = "hit " if f.hit else "miss"
+            lines.append(
+                f"{f.seconds * 1000:9.3f} ms  {status}  {len(f.tokens):8d} tokens  {f.filename}"
+            )
+        lines.append(
+            f"{len(self.files)} files in {self.seconds:.3f}s, "
+            f"cache hit rate {self.hit_rate:.0%}"
+        )
+        return "\n".join(lines)
+
+
+def expand(paths):
+    """Expand directories in paths to the .wb files they contain."""
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(sorted(glob.glob(os.path.join(path, "**", "*.wb"), recursive=True)))
+        else:
+            filenames.append(path)
+    return filenames
+
+
+def tokenize_files(paths, cache_dir=DEFAULT_CACHE_DIR, workers=None) -> BatchResult:
+    """
+    Tokenize every file in paths (directories are searched for .wb files)
+    over a pool of worker processes.  workers=1 runs in this process.
+    """
+    filenames = expand(paths)
+    result = BatchResult()
+    start = time.perf_counter()
+    if workers == 1:
+        outcomes = (tokenize_cached(name, cache_dir) for name in filenames)
+        result.files = [FileResult(name, *out) for name, out in zip(filenames, outcomes)]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            outcomes = pool.map(
+                tokenize_cached, filenames, [cache_dir] * len(filenames), chunksize=16
+            )
+            result.files = [FileResult(name, *out) for name, out in zip(filenames, outcomes)]
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tokenize Wabbit files in parallel")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--cache", default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+    print(tokenize_files(args.paths, args.cache, args.workers).report())
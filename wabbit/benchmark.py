@@ -0,0 +1,1113 @@
+# benchmark.py
+#
+# Timing harness for the different engines in the compiler.  Run as
+#
+#     python benchmark.py [name ...]
+#
+# with no arguments to run every benchmark.
+import collections
+import contextlib
+import dataclasses
+import gc
+import glob
+import io
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from astcache import parse_file_cached
+from cparser import expression, parse_expression, parse_file, parse_memoized, parse_source
+from flatast import flatten, format_flat
+from format import format_wabbit
+from hashcons import Interner
+from incremental import ParsedSource
+from output import BufferedSink, CaptureSink, NullSink, StreamSink
+from profiler import Profile, Profiling
+from budget import Budget, BudgetExceeded
+import interpret
+from purity import ResultCache
+from pysource import PythonProgram
+from resolve import resolve
+from run import engines
+import model
+from tokenizer import retokenize, tokenize, tokenize_buffer, tokenize_regex
+from visitor import NodeVisitor
+
+PROGRAMS = os.path.join(os.path.dirname(__file__), "..", "tests", "Programs")
+PARSER_TESTS = os.path.join(os.path.dirname(__file__), "..", "tests", "Parser")
+
+
+def program_files():
+    return sorted(glob.glob(os.path.join(PROGRAMS, "*.wb")))
+
+
+def generated_source(copies=200):
+    """Concatenate every program in tests/Programs `copies` times."""
+    chunks = []
+    for filename in program_files():
+        with open(filename) as file:
+            chunks.append(file.read())
+    return "\n".join(chunks) * copies
+
+
+def best_of(func, *args, repeat=3):
+    """Return (best time, result) of calling func(*args) `repeat` times.
+
+    The garbage collector is paused while timing, as timeit does, so that
+    collections triggered by earlier allocations don't land in the numbers.
+    """
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def traced_size(func, *args):
+    """Return (bytes still allocated by func(*args), result)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func(*args)
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return size, result
+
+
+def bench_tokenize():
+    source = generated_source()
+    print(f"tokenize: {source.count(chr(10))} lines, {len(source)} chars")
+    loop_time, loop_tokens = best_of(tokenize, source)
+    regex_time, regex_tokens = best_of(tokenize_regex, source)
+    assert loop_tokens == regex_tokens
+    ntok = len(loop_tokens)
+    print(f"  loop   {loop_time:8.3f}s  {ntok / loop_time:12,.0f} tokens/s")
+    print(f"  regex  {regex_time:8.3f}s  {ntok / regex_time:12,.0f} tokens/s")
+    print(f"  speedup {loop_time / regex_time:.2f}x")
+
+
+def bench_token_memory():
+    source = generated_source(20)
+    list_size, tokens = traced_size(tokenize, source)
+    ntok = len(tokens)
+    del tokens
+    buffer_size, buffer = traced_size(tokenize_buffer, source)
+    buffer_time, _ = best_of(tokenize_buffer, source)
+    print(f"token memory: {ntok} tokens")
+    print(f"  list[Token]  {list_size / ntok:8.1f} bytes/token")
+    print(f"  TokenBuffer  {buffer_size / ntok:8.1f} bytes/token")
+    print(f"  TokenBuffer built at {ntok / buffer_time:,.0f} tokens/s")
+
+
+def bench_retokenize(edits=200):
+    source = generated_source()
+    tokens = tokenize(source)
+    full_time, _ = best_of(tokenize_regex, source)
+    # Type one character at a time into the middle of the source
+    offset = source.index("\n", len(source) // 2)
+    start = time.perf_counter()
+    for n in range(edits):
+        source = retokenize(source, tokens, offset + n, 0, "x;"[n % 2])
+    edit_time = (time.perf_counter() - start) / edits
+    assert tokens == tokenize(source)
+    print(f"retokenize: {len(tokens)} tokens")
+    print(f"  full tokenize  {full_time * 1000:10.3f} ms")
+    print(f"  one edit       {edit_time * 1000:10.3f} ms")
+
+
+def nested_expression(depth):
+    """((((1 + x) * 2 + x) * 3 + x) ...) with depth levels of Grouping."""
+    source = "1"
+    for n in range(depth):
+        source = f"({source} + x) * {n}"
+    return source
+
+
+def bench_packrat(max_plain_depth=3):
+    print("packrat: parse time of nested Grouping/BinOp expressions")
+    print(f"  {'depth':>5} {'tokens':>7} {'plain':>10} {'memoized':>10} {'memo entries':>13}")
+    for depth in (1, 2, 3, 4, 6, 8, 10, 12):
+        tokens = tokenize(nested_expression(depth))
+        memo_time, (result, memo) = best_of(parse_memoized, expression, tokens)
+        assert result[1] == len(tokens)
+        if depth <= max_plain_depth:
+            plain_time, plain = best_of(expression, tokens, 0)
+            assert plain == result
+            plain_text = f"{plain_time * 1000:8.2f}ms"
+        else:
+            plain_text = "-"
+        print(
+            f"  {depth:5d} {len(tokens):7d} {plain_text:>10} "
+            f"{memo_time * 1000:8.2f}ms {len(memo.table):13d}"
+        )
+
+
+def parser_test_expressions():
+    """Token lists of every `print <expression>;` in tests/Parser/10-17."""
+    expressions = []
+    for number in range(10, 18):
+        (filename,) = glob.glob(os.path.join(PARSER_TESTS, f"{number}_*.wb"))
+        with open(filename) as file:
+            tokens = tokenize(file.read())
+        for n, tok in enumerate(tokens):
+            if tok.toktype == "PRINT":
+                end = n + 1
+                while tokens[end].toktype != "SEMI":
+                    end += 1
+                expressions.append(tokens[n + 1 : end])
+    return expressions
+
+
+def bench_expressions(repeat=200):
+    expressions = parser_test_expressions() * repeat
+
+    def run(parse):
+        return [parse(tokens) for tokens in expressions]
+
+    tiers_time, tiers = best_of(run, lambda tokens: parse_memoized(expression, tokens)[0])
+    pratt_time, pratt = best_of(run, lambda tokens: parse_expression(tokens, 0))
+    assert tiers == pratt
+    print(f"expressions: {len(expressions)} expressions from tests/Parser")
+    print(f"  tiered combinators (memoized) {tiers_time * 1000:8.1f} ms")
+    print(f"  precedence climbing           {pratt_time * 1000:8.1f} ms")
+
+
+# Programs in tests/Programs that the parser is known to reject
+UNPARSEABLE_PROGRAMS = {"03_intvar.wb", "17_compound.wb"}
+
+
+def parseable_programs():
+    """
+    The programs in tests/Programs that the parser accepts.  A syntax
+    error in any but UNPARSEABLE_PROGRAMS is raised.
+    """
+    filenames = []
+    for filename in program_files():
+        try:
+            parse_file(filename)
+        except SyntaxError:
+            if os.path.basename(filename) in UNPARSEABLE_PROGRAMS:
+                continue
+            raise
+        filenames.append(filename)
+    return filenames
+
+
+def parseable_source(copies=50):
+    """Like generated_source(), with only the programs that parse."""
+    chunks = []
+    for filename in parseable_programs():
+        with open(filename) as file:
+            chunks.append(file.read())
+    return "\n".join(chunks) * copies
+
+
+def bench_astcache(repeat=20):
+    filenames = parseable_programs()
+    with tempfile.TemporaryDirectory() as cache_dir:
+
+        def cold():
+            return [parse_file(name) for _ in range(repeat) for name in filenames]
+
+        def warm():
+            return [
+                parse_file_cached(name, cache_dir)
+                for _ in range(repeat)
+                for name in filenames
+            ]
+
+        for name in filenames:
+            parse_file_cached(name, cache_dir)
+        cold_time, cold_trees = best_of(cold)
+        warm_time, warm_trees = best_of(warm)
+    assert cold_trees == warm_trees
+    count = len(filenames) * repeat
+    print(f"astcache: {len(filenames)} programs from tests/Programs x {repeat}")
+    print(f"  cold parse  {cold_time / count * 1e6:8.1f} us/file")
+    print(f"  warm load   {warm_time / count * 1e6:8.1f} us/file")
+    print(f"  speedup {cold_time / warm_time:.2f}x")
+
+
+def bench_reparse(functions=2000):
+    source = "".join(
+        f"func f{n}(x int) int {{\n    var y = x * {n};\n    return y + 1;\n}}\n"
+        for n in range(functions)
+    )
+    full_time, _ = best_of(parse_source, source)
+    parsed = ParsedSource(source)
+    # Edit the constant in the middle function, one keystroke at a time
+    offset = source.index(f"x * {functions // 2};") + 4
+    start = time.perf_counter()
+    for digit in "123456789":
+        reparse = parsed.edit(offset, 1, digit)
+        assert len(reparse.added) == 1
+    edit_time = (time.perf_counter() - start) / 9
+    assert parsed.tree == parse_source(parsed.source)
+    print(f"reparse: {functions} functions")
+    print(f"  full parse   {full_time * 1000:10.3f} ms")
+    print(f"  one edit     {edit_time * 1000:10.3f} ms")
+
+
+def node_variant(classes, **options):
+    """Copies of model classes, as dataclasses with the given options."""
+    return {
+        cls.__name__: dataclasses.make_dataclass(
+            cls.__name__,
+            [(f.name, f.type) for f in model.node_fields(cls)],
+            **options,
+        )
+        for cls in classes
+    }
+
+
+def build_tree(classes, statements):
+    """A Statements tree of `statements` print statements of 10 nodes each."""
+    Statements, PrintStatement, BinOp, Unary, Op, Name, Integer = (
+        classes[name]
+        for name in ("Statements", "PrintStatement", "BinOp", "Unary", "Op", "Name", "Integer")
+    )
+    return Statements(
+        [
+            PrintStatement(
+                BinOp(
+                    Op("+"),
+                    Name("x"),
+                    BinOp(Op("*"), Integer("2"), Unary(Op("-"), Name("y"))),
+                )
+            )
+            for _ in range(statements)
+        ]
+    )
+
+
+def bench_node_memory(statements=100_000):
+    used = [
+        model.Statements,
+        model.PrintStatement,
+        model.BinOp,
+        model.Unary,
+        model.Op,
+        model.Name,
+        model.Integer,
+    ]
+    variants = {
+        "dict": node_variant(used),
+        "slots (model.py)": {cls.__name__: cls for cls in used},
+        "slots, frozen": node_variant(used, slots=True, frozen=True),
+    }
+    nodes = statements * 10 + 1
+    print(f"node memory: {nodes} nodes")
+    for label, classes in variants.items():
+        size, tree = traced_size(build_tree, classes, statements)
+        del tree
+        build_time, _ = best_of(build_tree, classes, statements)
+        print(
+            f"  {label:18} {size / nodes:6.1f} bytes/node"
+            f"  {build_time / nodes * 1e9:6.0f} ns/node to build"
+        )
+
+
+def deep_chain(depth):
+    """print 0 + x + x + ... as a BinOp chain `depth` levels deep."""
+    tree = model.Integer("0")
+    for _ in range(depth):
+        tree = model.BinOp(model.Op("+"), tree, model.Name("x"))
+    return model.Statements([model.PrintStatement(tree)])
+
+
+def bench_flatast(copies=50, depth=100_000):
+    tree_size, tree = traced_size(parse_source, parseable_source(copies))
+    flat_size, flat = traced_size(flatten, tree)
+    assert flat.to_tree() == tree
+    rows = len(flat)
+    flatten_time, _ = best_of(flatten, tree)
+    unflatten_time, _ = best_of(flat.to_tree)
+    walk_time, _ = best_of(lambda: sum(1 for _ in flat.walk()))
+    tree_format_time, text = best_of(format_wabbit, tree)
+    flat_format_time, flat_text = best_of(format_flat, flat)
+    assert text == flat_text
+    print(f"flatast: {rows} rows from tests/Programs x {copies}")
+    print(f"  tree memory  {tree_size / rows:8.1f} bytes/row")
+    print(f"  flat memory  {flat_size / rows:8.1f} bytes/row")
+    print(f"  flatten      {flatten_time / rows * 1e9:8.0f} ns/row")
+    print(f"  to_tree      {unflatten_time / rows * 1e9:8.0f} ns/row")
+    print(f"  walk         {walk_time / rows * 1e9:8.0f} ns/row")
+    print(f"  format_wabbit {tree_format_time * 1000:7.1f} ms, format_flat {flat_format_time * 1000:7.1f} ms")
+
+    chain = deep_chain(depth)
+    try:
+        format_wabbit(chain)
+        recursive = "ok"
+    except RecursionError:
+        recursive = "RecursionError"
+    chain_time, chain_text = best_of(lambda: format_flat(flatten(chain)), repeat=1)
+    assert chain_text.count("+") == depth
+    print(f"  BinOp chain of depth {depth}: format_wabbit {recursive}, "
+          f"flatten + format_flat {chain_time * 1000:.0f} ms")
+
+
+def bench_hashcons(copies=50):
+    source = parseable_source(copies)
+    interner = Interner()
+    plain_size, plain = traced_size(parse_source, source)
+    shared_size, shared = traced_size(lambda: interner.intern(parse_source(source)))
+    intern_time, _ = best_of(interner.intern, plain)
+    other_plain = parse_source(source)
+    other_shared = interner.intern(other_plain)
+    plain_eq_time, equal = best_of(lambda: plain == other_plain)
+    assert equal
+    shared_eq_time, equal = best_of(lambda: shared == other_shared)
+    assert equal
+    per_file = Interner()
+    for filename in parseable_programs():
+        per_file.intern(parse_file(filename))
+    print(f"hashcons: tests/Programs x {copies}")
+    print(f"  each program once: {per_file.report()}")
+    print(f"  all copies:        {interner.report()}")
+    print(f"  plain tree   {plain_size / 1024:10.1f} KiB")
+    print(f"  interned     {shared_size / 1024:10.1f} KiB")
+    print(f"  intern()     {intern_time * 1000:10.1f} ms")
+    print(f"  == on two parses: plain {plain_eq_time * 1e6:.1f} us, "
+          f"interned {shared_eq_time * 1e6:.1f} us")
+
+
+# Expression and statement classes in the order the isinstance chains of
+# interpret.py tested them before it became a NodeVisitor
+_chain_order = [
+    model.Integer, model.Float, model.Bool, model.Char, model.Unary, model.BinOp,
+    model.Grouping, model.Op, model.FunctionCall, model.Name,
+    model.Assignment, model.PrintStatement, model.VarDeclaration,
+    model.ConstDeclaration, model.IfStatement, model.WhileStatement,
+    model.BreakStatement, model.ContinueStatement, model.FuncDeclaration,
+    model.ReturnStatement, model.ExpressionStatement, model.Statements,
+]
+
+
+def isinstance_chain(node):
+    for cls in _chain_order:
+        if isinstance(node, cls):
+            return cls
+
+
+class NullVisitor(NodeVisitor):
+    def visit_Node(self, node):
+        return type(node)
+
+
+def sample_nodes():
+    """One node of each class in _chain_order."""
+    name = model.Name("x")
+    value = model.Integer("1")
+    body = model.Statements([])
+    return [
+        value, model.Float("1.0"), model.Bool("true"), model.Char("'a'"),
+        model.Unary(model.Op("-"), value), model.BinOp(model.Op("+"), name, value),
+        model.Grouping(value), model.Op("+"), model.FunctionCall(name, []), name,
+        model.Assignment(name, value), model.PrintStatement(value),
+        model.VarDeclaration(name, None, value), model.ConstDeclaration(name, None, value),
+        model.IfStatement(value, body, None), model.WhileStatement(value, body),
+        model.BreakStatement(), model.ContinueStatement(),
+        model.FuncDeclaration(name, [], model.Typename("int"), body),
+        model.ReturnStatement(value), model.ExpressionStatement(value), body,
+    ]
+
+
+def bench_dispatch(calls=100_000):
+    visit = NullVisitor().visit
+
+    def run(dispatch, node):
+        for _ in range(calls):
+            dispatch(node)
+
+    print("dispatch: cost of picking the code for a node, per call")
+    print(f"  {'node':20} {'isinstance chain':>16} {'NodeVisitor':>12}")
+    for node in sample_nodes():
+        assert isinstance_chain(node) is visit(node) is type(node)
+        chain_time, _ = best_of(run, isinstance_chain, node)
+        visit_time, _ = best_of(run, visit, node)
+        print(
+            f"  {type(node).__name__:20} {chain_time / calls * 1e9:13.0f} ns"
+            f" {visit_time / calls * 1e9:9.0f} ns"
+        )
+
+
+def program_source(name, **constants):
+    """
+    The source of tests/Programs/<name>.wb with some of its constants
+    changed, to scale a run up or down.
+    """
+    with open(os.path.join(PROGRAMS, f"{name}.wb")) as file:
+        source = file.read()
+    for constant, value in constants.items():
+        source, count = re.subn(
+            rf"const {constant} = [^;]*;", f"const {constant} = {value};", source
+        )
+        assert count == 1, constant
+    return source
+
+
+def captured_call(func, *args):
+    """Call func, returning what it printed."""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        func(*args)
+    return output.getvalue()
+
+
+def captured_run(engine, tree):
+    """Run tree on an engine, returning what it printed."""
+    sink = CaptureSink()
+    engines[engine](tree, out=sink)
+    return sink.getvalue()
+
+
+# Scaled-down versions of the long-running programs, so the tree walker
+# finishes in a few seconds
+ENGINE_PROGRAMS = {
+    "15_mandel": {"threshhold": 100},
+    "22_fib": {"LAST": 20},
+}
+
+
+# Programs that once ran differently on some engine
+AGREEMENT_PROGRAMS = {
+    "redeclared": """
+        func f(x int) int { return 1; }
+        var i = 0;
+        while i < 2 { print f(0); i = i + 1; }
+        func f(x int) int { return 2; }
+        print f(0);
+    """,
+    "redeclared callee": """
+        func f(x int) int { return 1; }
+        func g(x int) int { return f(x); }
+        print g(0);
+        func f(x int) int { return 2; }
+        print g(0);
+    """,
+    "INT_MIN": "print -2147483648; print -2147483648 / -1;",
+    "top-level break": "break;",
+    "top-level continue": "continue;",
+    "top-level return": "return 1;",
+    "break in a function": "func f(x int) int { break; } print 1; print f(1);",
+    "continue in a function": """
+        func f(x int) int { if x > 0 { continue; } return 2; }
+        print f(0);
+        print f(1);
+    """,
+    "too many arguments": "func f(x int) int { return x; } print f(1, 2);",
+    "too few arguments": "func f(x int) int { return x; } print f();",
+    "redeclared arity": """
+        func f(x int) int { return x; }
+        func f(x int, y int) int { return y; }
+        print f(1, 2);
+        print f(1);
+    """,
+    "uninitialized print": "var x int; print x; var c char; print c; var b bool; print b;",
+    "no return value": """
+        func f(x int) int { if x > 0 { return 1; } }
+        var y int = f(0);
+        print f(0);
+        print y;
+    """,
+    "global read before declaration": "func f() int { return y; } print f(); var y = 1;",
+    "not a function": "var x int = 1; print x(2);",
+    "callee not declared yet": "func f() int { return g(); } print f(); func g() int { return 2; }",
+}
+
+
+def check_engines():
+    """
+    Run tests/Programs, the long ones scaled down as for the benchmarks,
+    and some programs engines have disagreed on, on every engine in
+    run.py.  Each must print the same and fail the same way as the tree
+    walker.  Unless nodes are already frozen, all of it runs again in a
+    process with WABBIT_FROZEN_NODES=1.
+    """
+    scaled = dict(ENGINE_PROGRAMS, **{"23_mandel": {"threshhold": 100}})
+    programs = {}
+    for filename in parseable_programs():
+        name = os.path.splitext(os.path.basename(filename))[0]
+        with open(filename) as file:
+            programs[name] = file.read()
+        if name in scaled:
+            programs[name] = program_source(name, **scaled[name])
+    programs.update(AGREEMENT_PROGRAMS)
+    failures = 0
+    for name, source in programs.items():
+        tree = parse_source(source)
+        results = {}
+        for engine in engines:
+            sink = CaptureSink()
+            try:
+                engines[engine](tree, out=sink)
+                error = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            results[engine] = (sink.getvalue(), error)
+        expected = results["interpret"]
+        differ = [engine for engine, result in results.items() if result != expected]
+        if differ:
+            failures += 1
+            print(f"  {name}: {', '.join(differ)} differ from interpret")
+    frozen = " (frozen nodes)" if model.FROZEN_NODES else ""
+    print(
+        f"  {len(programs)} programs on {len(engines)} engines{frozen}, "
+        f"{failures} disagreeing"
+    )
+    assert not failures
+    if not model.FROZEN_NODES:
+        env = dict(os.environ, WABBIT_FROZEN_NODES="1")
+        subprocess.run([sys.executable, __file__, "engines"], env=env, check=True)
+
+
+def run_tests():
+    """The test_*() functions of the modules."""
+    import astcache
+    import cparser
+    import run
+    import tokenizer
+
+    tests = [
+        tokenizer.test_tokens,
+        cparser.test_parser,
+        astcache.test_roundtrip,
+        run.test_engines,
+    ]
+    for test in tests:
+        test()
+        print(f"  {test.__module__}.{test.__name__}: ok")
+
+
+def compare_engines(names, programs=ENGINE_PROGRAMS):
+    print(f"  {'program':10} " + " ".join(f"{name:>10}" for name in names))
+    for program, constants in programs.items():
+        tree = parse_source(program_source(program, **constants))
+        times = []
+        expected = None
+        for name in names:
+            elapsed, output = best_of(captured_run, name, tree)
+            assert expected is None or output == expected, name
+            expected = output
+            times.append(elapsed)
+        print(
+            f"  {program:10} "
+            + " ".join(f"{elapsed:9.3f}s" for elapsed in times)
+            + f"  speedup {times[0] / times[-1]:.1f}x"
+        )
+
+
+def bench_closures():
+    print("closures: tree walker against compiled closures")
+    compare_engines(["interpret", "closures"])
+
+
+class IterationCounter(interpret.Interpreter):
+    """Counts loop iterations and function calls while interpreting."""
+
+    def __init__(self):
+        super().__init__()
+        self.iterations = 0
+        self.calls = 0
+        self.loop_bodies = set()
+
+    def visit_WhileStatement(self, node, environ):
+        self.loop_bodies.add(id(node.body))
+        return super().visit_WhileStatement(node, environ)
+
+    def visit_Statements(self, node, environ):
+        if id(node) in self.loop_bodies:
+            self.iterations += 1
+        return super().visit_Statements(node, environ)
+
+    def visit_FunctionCall(self, node, environ):
+        self.iterations += 1
+        if node.name.text not in interpret.conversions:
+            self.calls += 1
+        return super().visit_FunctionCall(node, environ)
+
+
+def run_counter(tree):
+    resolution = resolve(tree)
+    counter = IterationCounter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        counter.visit(resolution.tree, interpret.WEnvironment(len(resolution.globals)))
+    return counter
+
+
+def count_iterations(tree):
+    return run_counter(tree).iterations
+
+
+@contextlib.contextmanager
+def counting_instances(classes):
+    """Count the instances of classes made inside the with block."""
+    counts = collections.Counter()
+    originals = {cls: cls.__init__ for cls in classes}
+
+    def counted(init, cls):
+        def __init__(self, *args):
+            counts[cls] += 1
+            init(self, *args)
+
+        return __init__
+
+    for cls, init in originals.items():
+        cls.__init__ = counted(init, cls)
+    try:
+        yield counts
+    finally:
+        for cls, init in originals.items():
+            cls.__init__ = init
+
+
+def bench_native():
+    """
+    Boxed against native values in the tree walker.  tracemalloc only sees
+    the memory live at any one time, which stays flat either way, so the
+    allocations themselves are counted on the WType constructors.
+    """
+    boxes = [interpret.WInt, interpret.WFloat, interpret.WBool, interpret.WChar, interpret.WVoid]
+    print("native: WType allocations per loop iteration or call")
+    print(f"  {'program':10} {'engine':10} {'time':>8} {'boxes/iter':>11} {'peak memory':>12}")
+    for program, constants in ENGINE_PROGRAMS.items():
+        tree = parse_source(program_source(program, **constants))
+        iterations = count_iterations(tree)
+        expected = None
+        for engine in ("interpret", "native"):
+            elapsed, output = best_of(captured_run, engine, tree)
+            assert expected is None or output == expected
+            expected = output
+            with counting_instances(boxes) as counts:
+                captured_run(engine, tree)
+            tracemalloc.start()
+            try:
+                captured_run(engine, tree)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            print(
+                f"  {program:10} {engine:10} {elapsed:7.3f}s "
+                f"{sum(counts.values()) / iterations:11.1f} {peak / 1024:9.1f} KiB"
+            )
+
+
+class Unwind(Exception):
+    def __init__(self, status):
+        self.status = status
+
+
+class ExceptionInterpreter(interpret.Interpreter):
+    """
+    The interpreter with break, continue and return raising exceptions, as
+    it did before statements reported how they completed.
+    """
+
+    def visit_BreakStatement(self, node, environ):
+        raise Unwind(interpret.BREAK)
+
+    def visit_ContinueStatement(self, node, environ):
+        raise Unwind(interpret.CONTINUE)
+
+    def visit_ReturnStatement(self, node, environ):
+        raise Unwind(interpret.WReturn(self.visit(node.value, environ)))
+
+    def visit_IfStatement(self, node, environ):
+        super().visit_IfStatement(node, environ)
+        return interpret.VOID
+
+    def visit_WhileStatement(self, node, environ):
+        while self.truth(self.visit(node.test, environ)):
+            try:
+                self.visit(node.body, environ)
+            except Unwind as e:
+                if e.status is interpret.BREAK:
+                    break
+                elif e.status is not interpret.CONTINUE:
+                    raise
+        return interpret.VOID
+
+    def visit_FunctionCall(self, node, environ):
+        try:
+            return super().visit_FunctionCall(node, environ)
+        except Unwind as e:
+            return e.status.value
+
+    def visit_Statements(self, node, environ):
+        for statement in node.statements:
+            self.visit(statement, environ)
+        return interpret.VOID
+
+
+def run_exceptions(tree):
+    resolution = resolve(tree)
+    environ = interpret.WEnvironment(len(resolution.globals))
+    return ExceptionInterpreter().visit(resolution.tree, environ)
+
+
+def bench_unwind():
+    """
+    Exceptions against completion statuses for break, continue and return.
+    16_brk is short, so it is run many times over.
+    """
+    programs = {
+        "22_fib": (program_source("22_fib", LAST=20), 1),
+        "16_brk": (program_source("16_brk"), 2000),
+    }
+    runs = {"exceptions": run_exceptions, "statuses": engines["interpret"]}
+
+    def repeated(run, tree, times):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            for _ in range(times):
+                run(tree)
+        return output.getvalue()
+
+    print(f"  {'program':10} {'runs':>5} " + " ".join(f"{name:>11}" for name in runs))
+    for program, (source, times) in programs.items():
+        tree = parse_source(source)
+        results = [best_of(repeated, run, tree, times) for run in runs.values()]
+        assert results[0][1] == results[1][1]
+        before, after = (elapsed for elapsed, _ in results)
+        print(
+            f"  {program:10} {times:5} {before:10.3f}s {after:10.3f}s"
+            f"  speedup {before / after:.2f}x"
+        )
+
+
+class FreshFrameInterpreter(interpret.Interpreter):
+    """
+    The interpreter with the call path it had before call sites were
+    cached: the function is looked up and a frame made on every call.
+    """
+
+    def visit_FunctionCall(self, node, environ):
+        if node.name.text in interpret.conversions:
+            return super().visit_FunctionCall(node, environ)
+        func = self.visit(node.name, environ)
+        args = [self.visit(arg, environ) for arg in node.arguments]
+        func_env = interpret.WEnvironment(func.frame_size, environ.globals)
+        for pname, arg in zip(func.parameters, args):
+            func_env.store(pname, arg)
+        status = self.visit(func.body, func_env)
+        if type(status) is interpret.WReturn:
+            return status.value
+
+
+def bench_calls():
+    """Function calls per second on fib, before and after the call fast path."""
+
+    def run(interpreter, tree):
+        resolution = resolve(tree)
+        environ = interpret.WEnvironment(len(resolution.globals))
+        return interpreter().visit(resolution.tree, environ)
+
+    tree = parse_source(program_source("22_fib", LAST=22))
+    calls = run_counter(tree).calls
+    print(f"  22_fib, {calls} calls")
+    interpreters = {
+        "fresh frames": FreshFrameInterpreter,
+        "fast path": interpret.Interpreter,
+        "fresh, native": type("Native", (FreshFrameInterpreter, interpret.NativeInterpreter), {}),
+        "fast, native": interpret.NativeInterpreter,
+    }
+    outputs = {captured_call(run, interpreter, tree) for interpreter in interpreters.values()}
+    assert len(outputs) == 1
+    # Alternated, and the medians compared, as in bench_profile()
+    rounds = [
+        [
+            best_of(captured_call, run, interpreter, tree, repeat=1)[0]
+            for interpreter in interpreters.values()
+        ]
+        for _ in range(9)
+    ]
+    times = [sorted(column)[len(column) // 2] for column in zip(*rounds)]
+    for name, elapsed in zip(interpreters, times):
+        print(f"  {name:14} {elapsed:7.3f}s {calls / elapsed:10,.0f} calls/s")
+    print(
+        f"  fast path speedup: boxed {times[0] / times[1]:.2f}x, "
+        f"native {times[2] / times[3]:.2f}x"
+    )
+
+
+def bench_memo():
+    """
+    fib with and without its results memoized.  Without, the time grows
+    with the number of calls, about 1.6x for each step of LAST; with, it
+    grows with LAST.  A cache too small to hold the results that the
+    recursion needs next is slower, but prints the same.
+    """
+    print(f"  {'LAST':>4} {'maxsize':>7} {'time':>8}  cache")
+    expected = {}
+    for last, maxsize in [(20, None), (25, None), (20, 1024), (25, 1024), (30, 1024), (25, 2)]:
+        tree = parse_source(program_source("22_fib", LAST=last))
+        memo = None if maxsize is None else ResultCache(maxsize)
+
+        def run():
+            return interpret.interpret_wabbit(tree, native=True, memo=memo)
+
+        elapsed, output = best_of(captured_call, run)
+        assert expected.setdefault(last, output) == output
+        report = "off" if memo is None else memo.report()
+        print(f"  {last:4} {maxsize or '-':>7} {elapsed:7.3f}s  {report}")
+
+
+DEEP_RECURSION = """
+func down(n int) int {
+    if n == 0 {
+        return 0;
+    }
+    return 1 + down(n - 1);
+}
+print down(DEPTH);
+"""
+
+
+def bench_machine():
+    """
+    The stack machine against the recursive tree walker: throughput on
+    the engine programs, then how deep a Wabbit recursion each survives
+    and how long a chain of + each can evaluate.
+    """
+    compare_engines(["interpret", "native", "machine"])
+    print(f"  {'depth':>7} " + " ".join(f"{name:>16}" for name in ("native", "machine")))
+    for depth in (100, 1000, 10_000, 50_000):
+        results = []
+        for engine in ("native", "machine"):
+            tree = parse_source(DEEP_RECURSION.replace("DEPTH", str(depth)))
+            try:
+                output = captured_run(engine, tree)
+                assert output.strip() == str(depth)
+                results.append("ok")
+            except RecursionError:
+                results.append("RecursionError")
+        print(f"  {depth:7} " + " ".join(f"{result:>16}" for result in results))
+    for length in (1000, 100_000):
+        tree = parse_source("print " + " + ".join(["1"] * length) + ";")
+        for engine in ("native", "machine"):
+            try:
+                elapsed, output = best_of(captured_run, engine, tree, repeat=1)
+                result = f"{elapsed:.3f}s"
+            except RecursionError:
+                result = "RecursionError"
+            print(f"  1 + 1 + ... ({length} terms) on {engine}: {result}")
+
+
+def bench_python():
+    """
+    Programs compiled to Python source against the tree walker and the
+    closures, compilation included; then, for each full-size program, the
+    time to generate and compile its source, and to compile it from the
+    cache.
+    """
+    compare_engines(["interpret", "native", "closures", "python"])
+    with tempfile.TemporaryDirectory() as cache_dir:
+        print(f"  {'program':20} {'generate':>9} {'cached':>9} {'lines':>6}")
+        for filename in parseable_programs():
+            tree = parse_file(filename)
+            generate, program = best_of(PythonProgram, tree)
+            PythonProgram(tree, cache_dir=cache_dir)
+            cached, _ = best_of(PythonProgram, tree, None, cache_dir)
+            print(
+                f"  {os.path.basename(filename):20} {generate * 1000:7.2f}ms "
+                f"{cached * 1000:7.2f}ms {program.source.count(chr(10)) + 1:6}"
+            )
+
+
+@contextlib.contextmanager
+def drained_pipe(unbuffered=False):
+    """A text stream into a pipe that a thread keeps reading."""
+    read_fd, write_fd = os.pipe()
+    received = []
+
+    def drain():
+        with open(read_fd, "rb") as pipe:
+            while data := pipe.read(65536):
+                received.append(len(data))
+
+    reader = threading.Thread(target=drain)
+    reader.start()
+    if unbuffered:
+        # As stdout is under python -u
+        stream = io.TextIOWrapper(open(write_fd, "wb", buffering=0), write_through=True)
+    else:
+        stream = open(write_fd, "w")
+    try:
+        yield stream
+    finally:
+        stream.close()
+        reader.join()
+
+
+PRINT_LOOP = """
+var n int = 0;
+while n < 100000 {
+    print '*';
+    n = n + 1;
+    if n - n / 80 * 80 == 0 {
+        print '\\n';
+    }
+}
+"""
+
+
+class PrintSink(StreamSink):
+    """Calls print() for every write, as the engines did before sinks."""
+
+    def write(self, text):
+        print(text, end="", file=self.stream)
+
+
+def bench_output():
+    """
+    Output sinks on a program that prints 100,000 characters one at a
+    time, into a pipe and into an unbuffered pipe (as stdout is under
+    python -u or when a pipe is line buffered).
+    """
+    tree = parse_source(PRINT_LOOP)
+    sinks = {
+        "print()": PrintSink,
+        "stream": StreamSink,
+        "lines": lambda stream: BufferedSink(stream, lines=True),
+        "buffered": BufferedSink,
+        "capture": lambda stream: CaptureSink(),
+        "null": lambda stream: NullSink(),
+    }
+    for engine in ("native", "machine"):
+        print(f"  {engine:8} {'sink':10} {'pipe':>8} {'pipe, -u':>9}")
+        for name, make in sinks.items():
+            times = []
+            for unbuffered in (False, True):
+                with drained_pipe(unbuffered) as stream:
+                    elapsed, _ = best_of(lambda: engines[engine](tree, out=make(stream)))
+                times.append(elapsed)
+            print(f"  {'':8} {name:10} {times[0]:7.3f}s {times[1]:8.3f}s")
+
+
+def bench_profile():
+    """
+    Profiling off costs nothing: the plain interpreter classes don't
+    contain the profiling code, so a run with profile=None takes the same
+    time as calling the interpreter directly, as before profiling existed.
+    A profiled run is shown for scale.
+    """
+    for cls in (interpret.Interpreter, interpret.NativeInterpreter):
+        assert Profiling not in cls.__mro__
+        assert cls.visit is NodeVisitor.visit
+    print("  Interpreter and NativeInterpreter dispatch through NodeVisitor.visit")
+
+    def direct(tree):
+        resolution = resolve(tree)
+        environ = interpret.WEnvironment(len(resolution.globals))
+        interpreter = interpret.NativeInterpreter(out=NullSink())
+        return interpreter.visit(resolution.tree, environ)
+
+    def disabled(tree):
+        return interpret.interpret_wabbit(tree, native=True, out=NullSink())
+
+    def enabled(tree):
+        profile = Profile()
+        return interpret.interpret_wabbit(tree, native=True, out=NullSink(), profile=profile)
+
+    print(f"  {'program':10} {'direct':>9} {'disabled':>9} {'enabled':>9}")
+    for program, constants in ENGINE_PROGRAMS.items():
+        tree = parse_source(program_source(program, **constants))
+        # Alternated, so that drift in the machine's speed hits both alike,
+        # and the medians compared: single runs vary by 10% or more here
+        rounds = [
+            [best_of(run, tree, repeat=1)[0] for run in (direct, disabled)]
+            for _ in range(9)
+        ]
+        times = [sorted(column)[len(column) // 2] for column in zip(*rounds)]
+        times.append(best_of(enabled, tree, repeat=1)[0])
+        print(
+            f"  {program:10} "
+            + " ".join(f"{elapsed:8.3f}s" for elapsed in times)
+            + f"  disabled/direct {times[1] / times[0]:.3f}"
+        )
+
+
+def bench_budget():
+    """
+    Enforcing a Budget costs a step count at every loop iteration and
+    call, and the clock is read every CHECK_INTERVAL steps.  15_mandel is
+    run with and without a budget it stays within; then a program that
+    never stops is stopped by its deadline.
+    """
+    budget = Budget(steps=10**9, seconds=3600.0, depth=1000, slots=10**6)
+
+    def unlimited(tree, native):
+        return interpret.interpret_wabbit(tree, native=native, out=NullSink())
+
+    def limited(tree, native):
+        return interpret.interpret_wabbit(tree, native=native, out=NullSink(), budget=budget)
+
+    tree = parse_source(program_source("15_mandel", threshhold=100))
+    print(f"  {'15_mandel':10} {'unlimited':>9} {'budget':>9}")
+    for native in (False, True):
+        # Alternated and the medians compared, as in bench_profile
+        rounds = [
+            [best_of(run, tree, native, repeat=1)[0] for run in (unlimited, limited)]
+            for _ in range(9)
+        ]
+        times = [sorted(column)[len(column) // 2] for column in zip(*rounds)]
+        print(
+            f"  {'native' if native else 'boxed':10} "
+            + " ".join(f"{elapsed:8.3f}s" for elapsed in times)
+            + f"  {100 * (times[1] / times[0] - 1):+.1f}%  {budget.stats.steps} steps"
+        )
+
+    forever = parse_source("var x int = 0; while true { x = x + 1; }")
+    try:
+        interpret.interpret_wabbit(forever, native=True, budget=Budget(seconds=0.5))
+    except BudgetExceeded as e:
+        print(f"  while true: stopped after {e.stats.elapsed:.3f}s, {e.stats.steps} steps")
+
+
+benchmarks = {
+    "tokenize": bench_tokenize,
+    "token_memory": bench_token_memory,
+    "retokenize": bench_retokenize,
+    "packrat": bench_packrat,
+    "expressions": bench_expressions,
+    "astcache": bench_astcache,
+    "reparse": bench_reparse,
+    "node_memory": bench_node_memory,
+    "flatast": bench_flatast,
+    "hashcons": bench_hashcons,
+    "dispatch": bench_dispatch,
+    "closures": bench_closures,
+    "native": bench_native,
+    "unwind": bench_unwind,
+    "calls": bench_calls,
+    "memo": bench_memo,
+    "machine": bench_machine,
+    "output": bench_output,
+    "profile": bench_profile,
+    "budget": bench_budget,
+    "python": bench_python,
+    "engines": check_engines,
+    "tests": run_tests,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            raise SystemExit(f"Unknown benchmark {name!r}; pick from {list(benchmarks)}")
+        benchmarks[name]()
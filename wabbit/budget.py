@@ -0,0 +1,73 @@
+# budget.py
+#
+# Limits on what a run of a Wabbit program may use, for running programs
+# that can't be trusted to stop.  Pass a Budget to interpret_wabbit() and
+# the program runs on a budgeted subclass of the interpreter (see
+# BudgetedInterpreter in interpret.py):
+#
+#     budget = Budget(steps=10_000_000, seconds=2.0, depth=200, slots=100_000)
+#     try:
+#         interpret_wabbit(tree, budget=budget)
+#     except BudgetExceeded as e:
+#         print(e.limit, e.stats)
+#
+#     steps    loop iterations and function calls.  A program that neither
+#              loops nor calls runs in time proportional to its length, so
+#              these are the places a run can go on for long.
+#     seconds  wall-clock time from the start of the run
+#     depth    function calls in progress at once
+#     slots    variables alive at once: the globals and the frames of the
+#              calls in progress
+#
+# Any limit left as None is not checked.  The clock is read only every
+# CHECK_INTERVAL steps, so a run can overshoot its deadline by that many
+# steps; counting one step is an addition and a comparison.
+#
+# budget.stats holds what the last run used, also when it stopped early.
+CHECK_INTERVAL = 1024
+
+
+class BudgetStats:
+    __slots__ = ("steps", "calls", "depth", "max_depth", "slots", "max_slots", "elapsed")
+
+    def __init__(self):
+        self.steps = 0
+        self.calls = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.slots = 0
+        self.max_slots = 0
+        self.elapsed = 0.0
+
+    def copy(self):
+        stats = BudgetStats()
+        for name in self.__slots__:
+            setattr(stats, name, getattr(self, name))
+        return stats
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"BudgetStats({fields})"
+
+
+class Budget:
+    def __init__(self, steps=None, seconds=None, depth=None, slots=None):
+        self.steps = steps
+        self.seconds = seconds
+        self.depth = depth
+        self.slots = slots
+        self.stats = BudgetStats()
+
+
+class BudgetExceeded(RuntimeError):
+    """
+    A run went over a limit of its Budget.  limit names it: 'steps',
+    'seconds', 'depth' or 'slots'.  stats is what the run had used when
+    it went over, with the calls then in progress.
+    """
+
+    def __init__(self, limit, allowed, stats):
+        super().__init__(f"{limit} budget of {allowed} exceeded: {stats}")
+        self.limit = limit
+        self.allowed = allowed
+        self.stats = stats
@@ -0,0 +1,389 @@
+# closures.py
+#
+# A second execution engine.  compile_wabbit() turns a tree into nested
+# Python closures, once; running the program then only calls them.  Each
+# closure takes the environment and has its children, its operator and
+# the types of its operands bound already, so nothing is dispatched on
+# node classes or operator symbols at run time.
+#
+# Values are plain Python ints, floats, bools and one-character strs
+# rather than WInt and friends.  Types are worked out at compile time from
+# literals, declarations and function return types; where a type is not
+# known the closure checks at run time instead.  Variables live in the
+# lists of slots handed out by resolve(), as in interpret.py: closures take
+# the frame of the running function (the globals in top-level code).
+#
+# Statement closures return None to carry on, BREAK or CONTINUE, or a
+# 1-tuple holding the value of a return statement.
+from interpret import (
+    BREAK,
+    CONTINUE,
+    WType,
+    WReturn,
+    WVoid,
+    arithmetic,
+    box,
+    check_completed,
+    conversions,
+    int_divide,
+    format_value,
+    is_chained,
+    relations,
+)
+from model import *
+from output import OutputSink, StreamSink
+from resolve import LocalName, resolve
+from visitor import NodeVisitor
+
+
+class CompiledFunction:
+    __slots__ = ("name", "body", "parameters", "padding")
+
+    def __init__(self, name, body, parameters, frame_size):
+        self.name = name
+        self.body = body
+        self.parameters = parameters
+        # Appended to the arguments to make up a frame
+        self.padding = [None] * (frame_size - parameters)
+
+
+# What a call site has checked before its first call
+_unchecked = object()
+
+
+def _check_callee(func, name, arguments):
+    """The checks of Interpreter._call_site(), with the same messages."""
+    if type(func) is not CompiledFunction:
+        raise RuntimeError(f'{name} is not a function')
+    if arguments != func.parameters:
+        raise RuntimeError(f'{name} takes {func.parameters} arguments, {arguments} given')
+
+
+def _divide(a, b):
+    if type(a) is int:
+        return int_divide(a, b)
+    return a / b
+
+
+def _binary_closure(symbol, left, right):
+    if symbol == '+':
+        return lambda env: left(env) + right(env)
+    elif symbol == '-':
+        return lambda env: left(env) - right(env)
+    elif symbol == '*':
+        return lambda env: left(env) * right(env)
+    elif symbol == '<':
+        return lambda env: left(env) < right(env)
+    elif symbol == '<=':
+        return lambda env: left(env) <= right(env)
+    elif symbol == '>':
+        return lambda env: left(env) > right(env)
+    elif symbol == '>=':
+        return lambda env: left(env) >= right(env)
+    elif symbol == '==':
+        return lambda env: left(env) == right(env)
+    elif symbol == '!=':
+        return lambda env: left(env) != right(env)
+    elif symbol == '&&':
+        return lambda env: left(env) and right(env)
+    elif symbol == '||':
+        return lambda env: left(env) or right(env)
+    raise RuntimeError(f'unsupported operator {symbol}')
+
+
+class Compiler(NodeVisitor):
+    """
+    Expressions compile to (closure, type), where type is a Wabbit type
+    name or None if unknown; statements compile to a closure.
+    """
+
+    def __init__(self, globals, out):
+        self.globals = globals
+        self.out = out
+        # Types of the variables in each slot, and return types of the
+        # functions in global slots
+        self.global_types = {}
+        self.local_types = {}
+        self.return_types = {}
+
+    def generic_visit(self, node):
+        raise RuntimeError(f"Can't compile node: {node}")
+
+    def types_for(self, name):
+        return self.local_types if type(name) is LocalName else self.global_types
+
+    def _store(self, name, value):
+        slot = name.slot
+        if type(name) is LocalName:
+            def statement(env):
+                env[slot] = value(env)
+        else:
+            globals_ = self.globals
+
+            def statement(env):
+                globals_[slot] = value(env)
+
+        return statement
+
+    # Expressions
+
+    def visit_Integer(self, node):
+        value = node.decoded
+        return (lambda env: value), 'int'
+
+    def visit_Float(self, node):
+        value = node.decoded
+        return (lambda env: value), 'float'
+
+    def visit_Bool(self, node):
+        value = node.decoded
+        return (lambda env: value), 'bool'
+
+    def visit_Char(self, node):
+        value = node.decoded
+        return (lambda env: value), 'char'
+
+    def visit_LocalName(self, node):
+        slot = node.slot
+        return (lambda env: env[slot]), self.local_types.get(slot)
+
+    def visit_GlobalName(self, node):
+        slot = node.slot
+        globals_ = self.globals
+        return (lambda env: globals_[slot]), self.global_types.get(slot)
+
+    def visit_Grouping(self, node):
+        return self.visit(node.value)
+
+    def visit_Unary(self, node):
+        operand, type = self.visit(node.operand)
+        symbol = node.op.symbol
+        if symbol == '-':
+            return (lambda env: -operand(env)), type
+        elif symbol == '+':
+            return operand, type
+        elif symbol == '!':
+            return (lambda env: not operand(env)), 'bool'
+        raise RuntimeError(f'unsupported unary operator {symbol} on node {node}')
+
+    def visit_BinOp(self, node):
+        symbol = node.op.symbol
+        if is_chained(node):
+            return self._chain(node), 'bool'
+        left, left_type = self.visit(node.lhs)
+        right, right_type = self.visit(node.rhs)
+        type = left_type or right_type
+        if symbol == '/':
+            if type == 'int':
+                return (lambda env: int_divide(left(env), right(env))), type
+            elif type == 'float':
+                return (lambda env: left(env) / right(env)), type
+            return (lambda env: _divide(left(env), right(env))), None
+        elif symbol in arithmetic:
+            return _binary_closure(symbol, left, right), type
+        return _binary_closure(symbol, left, right), 'bool'
+
+    def _chain(self, node):
+        # a < b < c: flatten to operands [a, b, c] and tests [<, <]
+        tests = []
+        operands = []
+        while is_chained(node):
+            tests.append(relations[node.op.symbol])
+            operands.append(self.visit(node.rhs)[0])
+            node = node.lhs
+        tests.append(relations[node.op.symbol])
+        operands.append(self.visit(node.rhs)[0])
+        first = self.visit(node.lhs)[0]
+        steps = list(zip(reversed(tests), reversed(operands)))
+
+        def chain(env):
+            left = first(env)
+            for test, operand in steps:
+                right = operand(env)
+                if not test(left, right):
+                    return False
+                left = right
+            return True
+
+        return chain
+
+    def visit_FunctionCall(self, node):
+        name = node.name.text
+        if name in conversions:
+            convert = conversions[name]
+            (arg,) = [self.visit(arg)[0] for arg in node.arguments]
+            return (lambda env: convert(arg(env))), name
+        function, _ = self.visit(node.name)
+        args = [self.visit(arg)[0] for arg in node.arguments]
+        # The function last checked at this call site; the check runs again
+        # only when the name holds a different one.  Not None, which is
+        # what the name holds before its declaration.
+        checked = _unchecked
+
+        def call(env):
+            nonlocal checked
+            func = function(env)
+            if func is not checked:
+                _check_callee(func, name, len(args))
+                checked = func
+            frame = [arg(env) for arg in args]
+            frame += func.padding
+            status = func.body(frame)
+            if type(status) is tuple:
+                return status[0]
+            # A break or continue with no loop around it
+            check_completed(status)
+
+        return call, self.return_types.get(node.name.slot)
+
+    # Statements
+
+    def visit_PrintStatement(self, node):
+        # Whatever the type, an uninitialized variable or a function that
+        # returned nothing is None, which prints nothing, as in format_value()
+        value, type = self.visit(node.value)
+        write = self.out.write
+        if type in ('int', 'float'):
+            def statement(env):
+                result = value(env)
+                if result is not None:
+                    write(f'{result}\n')
+        elif type == 'bool':
+            def statement(env):
+                result = value(env)
+                if result is not None:
+                    write('true\n' if result else 'false\n')
+        elif type == 'char':
+            def statement(env):
+                result = value(env)
+                if result is not None:
+                    write(result)
+        else:
+            def statement(env):
+                write(format_value(value(env)))
+        return statement
+
+    def _declare(self, node):
+        if node.value:
+            value, type = self.visit(node.value)
+        else:
+            value, type = (lambda env: None), None
+        if node.type:
+            type = node.type.text
+        self.types_for(node.name)[node.name.slot] = type
+        return self._store(node.name, value)
+
+    visit_VarDeclaration = visit_ConstDeclaration = _declare
+
+    def visit_Assignment(self, node):
+        value, _ = self.visit(node.rhs)
+        return self._store(node.lhs, value)
+
+    def visit_ExpressionStatement(self, node):
+        value, _ = self.visit(node.value)
+
+        def statement(env):
+            value(env)
+
+        return statement
+
+    def visit_IfStatement(self, node):
+        test, _ = self.visit(node.test)
+        consequence = self.visit(node.consequence)
+        if node.alternative is None:
+            def statement(env):
+                if test(env):
+                    return consequence(env)
+        else:
+            alternative = self.visit(node.alternative)
+
+            def statement(env):
+                if test(env):
+                    return consequence(env)
+                return alternative(env)
+
+        return statement
+
+    def visit_WhileStatement(self, node):
+        test, _ = self.visit(node.test)
+        body = self.visit(node.body)
+
+        def statement(env):
+            while test(env):
+                status = body(env)
+                if status is not None:
+                    if status is BREAK:
+                        break
+                    elif status is CONTINUE:
+                        continue
+                    return status
+
+        return statement
+
+    def visit_BreakStatement(self, node):
+        return lambda env: BREAK
+
+    def visit_ContinueStatement(self, node):
+        return lambda env: CONTINUE
+
+    def visit_ReturnStatement(self, node):
+        value, _ = self.visit(node.value)
+        return lambda env: (value(env),)
+
+    def visit_FuncDeclaration(self, node):
+        self.return_types[node.name.slot] = node.return_type.text
+        self.local_types = {p.name.slot: p.type.text for p in node.parameters}
+        body = self.visit(node.body)
+        function = CompiledFunction(
+            node.name.text, body, len(node.parameters), node.frame_size
+        )
+        return self._store(node.name, lambda env: function)
+
+    def visit_Statements(self, node):
+        statements = [self.visit(statement) for statement in node.statements]
+
+        def block(env):
+            for statement in statements:
+                status = statement(env)
+                if status is not None:
+                    return status
+
+        return block
+
+
+class CompiledProgram:
+    """
+    The closures for a tree.  run() executes them against a fresh set of
+    globals and returns what interpret_wabbit() would.  A CompiledProgram
+    runs one program at a time, printing to the sink it was compiled for.
+    """
+
+    def __init__(self, node: Node, out: OutputSink | None = None):
+        resolution = resolve(node)
+        self.globals = [None] * len(resolution.globals)
+        self.out = StreamSink() if out is None else out
+        self.compiler = Compiler(self.globals, self.out)
+        if isinstance(node, Expression):
+            self.code = self.compiler.visit(resolution.tree)[0]
+            self.expression = True
+        else:
+            self.code = self.compiler.visit(resolution.tree)
+            self.expression = False
+
+    def run(self) -> WType:
+        self.globals[:] = [None] * len(self.globals)
+        with self.out:
+            result = self.code(self.globals)
+        if self.expression:
+            return box(result)
+        check_completed(WReturn(result[0]) if type(result) is tuple else result)
+        return WVoid()
+
+
+def compile_wabbit(node: Node, out: OutputSink | None = None) -> CompiledProgram:
+    return CompiledProgram(node, out)
+
+
+def execute_wabbit(node: Node, out: OutputSink | None = None) -> WType:
+    """Like interpret_wabbit(), on closures."""
+    return compile_wabbit(node, out).run()
@@ -1,4 +1,80 @@
-from tokenizer import tokenize, Token
+from collections import OrderedDict
+
+from model import *
+from tokenizer import (
+    literals,
+    tokenize,
+    tokenize_buffer,
+    tokenize_regex,
+    Token,
+    TokenBuffer,
+    toktype_codes,
+)
+
+# Bump whenever the tree built for some source could change, so that cached
+# trees (see astcache.py) are invalidated.
+PARSER_VERSION = 1
+
+
+class Memo:
+    """
+    Packrat table for one parse: maps (parser id, token index) to the
+    parser's result at that index, failures included.
+
+    With maxsize set, the oldest entries are dropped once the table is
+    full, trading some re-parsing for bounded memory.
+    """
+
+    def __init__(self, maxsize=None):
+        self.table = {} if maxsize is None else OrderedDict()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+
+# The table of the parse currently running under parse_memoized(), if any
+_memo = None
+_missing = object()
+
+
+def memoized(parse):
+    """
+    Wrap a parser so that it records and reuses its results in the active
+    Memo.  Outside of parse_memoized() this only costs a global lookup.
+    """
+    key = id(parse)
+
+    def memo_parse(tokens, n):
+        memo = _memo
+        if memo is None:
+            return parse(tokens, n)
+        table = memo.table
+        result = table.get((key, n), _missing)
+        if result is not _missing:
+            memo.hits += 1
+            return result
+        memo.misses += 1
+        result = parse(tokens, n)
+        if memo.maxsize is not None and len(table) >= memo.maxsize:
+            table.popitem(last=False)
+        table[key, n] = result
+        return result
+
+    return memo_parse
+
+
+def parse_memoized(parser, tokens, n=0, maxsize=None):
+    """
+    Run parser on tokens starting at n with packrat memoization, so no
+    parser is ever run twice at the same index.  Returns (result, memo).
+    """
+    global _memo
+    saved = _memo
+    _memo = Memo(maxsize)
+    try:
+        return parser(tokens, n), _memo
+    finally:
+        _memo = saved
 
 
 def any_token(tokens, n):
@@ -10,19 +86,29 @@ def any_token(tokens, n):
 
 def eof(tokens, n):
     if n >= len(tokens):
-        return (Token("EOF", "EOF", 0), n)
+        return (Token("EOF", "EOF", 0, n), n)
     else:
         return None
 
 
 def expect(toktype):
+    code = toktype_codes.get(toktype)
+
+    @memoized
     def parse(tokens, n):
+        if type(tokens) is TokenBuffer:
+            # Compare type codes so a Token is only built on a match
+            if n < len(tokens) and tokens.codes[n] == code:
+                return tokens[n], n + 1
+            return None
         match = any_token(tokens, n)
         if match and match[0].toktype == toktype:
             return match
         else:
             return None
 
+    return parse
+
 
 def sequence(*parsers):
     """
@@ -30,6 +116,7 @@ def sequence(*parsers):
     parsers.
     """
 
+    @memoized
     def parse(tokens, n):
         # execute the parser in order, collect the results, and return.
         # But only if they all work
@@ -41,7 +128,7 @@ def sequence(*parsers):
                 return None
             result.append(match[0])
             index = match[1]
-            return result, index
+        return result, index
 
     return parse
 
@@ -53,6 +140,7 @@ def choice(*parsers):
     :return:
     """
 
+    @memoized
     def parse(tokens, n):
         for parser in parsers:
             match = parser(tokens, n)
@@ -64,6 +152,7 @@ def choice(*parsers):
 
 
 def optional(parser):
+    @memoized
     def parse(tokens, n):
         match = parser(tokens, n)
         if match:
@@ -72,3 +161,539 @@ def optional(parser):
             return None, n
 
     return parse
+
+
+def zero_or_more(parser):
+    """Apply parser as many times as it matches, collecting the results."""
+
+    @memoized
+    def parse(tokens, n):
+        result = []
+        while True:
+            match = parser(tokens, n)
+            if match is None:
+                return result, n
+            result.append(match[0])
+            n = match[1]
+
+    return parse
+
+
+def delimited(parser, toktype):
+    """Zero or more matches of parser separated by toktype tokens."""
+    rest = zero_or_more(transform(sequence(expect(toktype), parser), lambda r: r[1]))
+    return optional_list(
+        transform(sequence(parser, rest), lambda r: [r[0], *r[1]])
+    )
+
+
+def optional_list(parser):
+    """Like optional(), but an empty list instead of None when it doesn't match."""
+
+    @memoized
+    def parse(tokens, n):
+        match = parser(tokens, n)
+        if match:
+            return match
+        else:
+            return [], n
+
+    return parse
+
+
+def transform(parser, func):
+    """Apply func to the result of parser, e.g. to build a model node."""
+
+    @memoized
+    def parse(tokens, n):
+        match = parser(tokens, n)
+        if match is None:
+            return None
+        return func(match[0]), match[1]
+
+    return parse
+
+
+def forward(get_parser):
+    """Refer to a parser that is defined later, for recursive rules."""
+
+    def parse(tokens, n):
+        return get_parser()(tokens, n)
+
+    return parse
+
+
+class LocatedTokens:
+    """
+    The tokens of a parse that records lines: parse_tokens() passes these
+    to the parsers in place of the tokens, so that the table travels with
+    the parse.
+    """
+
+    __slots__ = ("tokens", "lines")
+
+    def __init__(self, tokens, lines):
+        self.tokens = tokens
+        self.lines = lines
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getitem__(self, n):
+        return self.tokens[n]
+
+
+def located(parser):
+    """
+    Record the line of the first token of every node parser builds, when
+    the tokens are LocatedTokens.
+    """
+
+    def parse(tokens, n):
+        match = parser(tokens, n)
+        if match is not None and type(tokens) is LocatedTokens:
+            tokens.lines[match[0]] = _lineno(tokens, n)
+        return match
+
+    return parse
+
+
+# Expression grammar, one rule per precedence tier.
+#
+#   expression := orterm
+#   orterm     := andterm ( "||" andterm )*
+#   andterm    := relterm ( "&&" relterm )*
+#   relterm    := sumterm ( ("<" | "<=" | ">" | ">=" | "==" | "!=") sumterm )*
+#   sumterm    := term ( ("+" | "-") term )*
+#   term       := unary ( ("*" | "/") unary )*
+#   unary      := ("+" | "-" | "!") factor | factor
+#   factor     := INTEGER | FLOAT | "true" | "false" | CHAR
+#                | NAME "(" [ expression ( "," expression )* ] ")"
+#                | NAME | "(" expression ")"
+#
+# Each tier is written as the PEG rule  tier := operand op tier | operand
+# and the operands are folded left afterwards, so a*b*c gives (a*b)*c.
+
+
+def _fold_left(items):
+    node = items[0]
+    for n in range(1, len(items), 2):
+        node = BinOp(Op(items[n].value), node, items[n + 1])
+    return node
+
+
+def binary_tier(operand, *toktypes):
+    """A left-associative tier of binary operators over operand."""
+    operator = choice(*(expect(toktype) for toktype in toktypes))
+    chain = choice(
+        transform(
+            sequence(operand, operator, forward(lambda: chain)),
+            lambda r: [r[0], r[1], *r[2]],
+        ),
+        transform(operand, lambda node: [node]),
+    )
+    return transform(chain, _fold_left)
+
+
+_literal_nodes = {
+    "INTEGER": Integer,
+    "FLOAT": Float,
+    "TRUE": Bool,
+    "FALSE": Bool,
+    "CHAR": Char,
+}
+
+
+def literal_node(tok):
+    """
+    The node for an INTEGER, FLOAT, TRUE, FALSE or CHAR token.  Its value
+    is decoded (and range checked) here, once.
+    """
+    try:
+        return _literal_nodes[tok.toktype](tok.value)
+    except ValueError as e:
+        raise SyntaxError(f"{tok.lineno}: {e}") from None
+
+
+def check_unnegated(node, tokens, n):
+    """
+    Reject INT_MAX + 1 as an operand not under a minus, the only place that
+    literal is in range.
+    """
+    if type(node) is Integer and node.decoded > INT_MAX:
+        raise SyntaxError(f"{_lineno(tokens, n)}: Integer {node.value} out of range")
+
+
+def unnegated(parser):
+    def parse(tokens, n):
+        match = parser(tokens, n)
+        if match is not None:
+            check_unnegated(match[0], tokens, n)
+        return match
+
+    return parse
+
+
+factor = choice(
+    transform(expect("INTEGER"), literal_node),
+    transform(expect("FLOAT"), literal_node),
+    transform(choice(expect("TRUE"), expect("FALSE")), literal_node),
+    transform(expect("CHAR"), literal_node),
+    transform(
+        sequence(
+            expect("NAME"),
+            expect("LPAREN"),
+            delimited(forward(lambda: expression), "COMMA"),
+            expect("RPAREN"),
+        ),
+        lambda r: FunctionCall(Name(r[0].value), r[2]),
+    ),
+    transform(expect("NAME"), lambda tok: Name(tok.value)),
+    transform(
+        sequence(expect("LPAREN"), forward(lambda: expression), expect("RPAREN")),
+        lambda r: Grouping(r[1]),
+    ),
+)
+unary = choice(
+    transform(
+        sequence(expect("MINUS"), factor),
+        lambda r: Unary(Op(r[0].value), r[1]),
+    ),
+    transform(
+        sequence(choice(expect("PLUS"), expect("LOGNOT")), unnegated(factor)),
+        lambda r: Unary(Op(r[0].value), r[1]),
+    ),
+    unnegated(factor),
+)
+term = binary_tier(unary, "MULTIPLY", "DIVIDE")
+sumterm = binary_tier(term, "PLUS", "MINUS")
+relterm = binary_tier(sumterm, "LT", "LE", "GT", "GE", "EQ", "NE")
+andterm = binary_tier(relterm, "LOGAND")
+orterm = binary_tier(andterm, "LOGOR")
+expression = orterm
+
+
+# Precedence climbing (Pratt) parser for the same expression grammar.
+# Rather than descending through one rule per tier, each binary operator
+# token is looked up in a binding-power table and the loop in
+# parse_expression() decides how far to extend the left operand.  A plain
+# operand is parsed with a single call.
+
+# Binary operators from lowest to highest precedence.  Higher numbers bind
+# tighter; all of them are left-associative.
+_precedence = [
+    ("||",),
+    ("&&",),
+    ("<", "<=", ">", ">=", "==", "!="),
+    ("+", "-"),
+    ("*", "/"),
+]
+binding_power = {
+    literals[symbol]: power
+    for power, symbols in enumerate(_precedence, start=1)
+    for symbol in symbols
+}
+prefix_operators = {literals[symbol] for symbol in ("+", "-", "!")}
+
+# A TokenBuffer is read a column at a time, so no Token is built for the
+# tokens the parser only looks at.
+def _toktype(tokens, n):
+    if type(tokens) is TokenBuffer:
+        return tokens.toktype_at(n)
+    return tokens[n].toktype
+
+
+def _value(tokens, n):
+    if type(tokens) is TokenBuffer:
+        return tokens.value_at(n)
+    return tokens[n].value
+
+
+def _lineno(tokens, n):
+    if type(tokens) is TokenBuffer:
+        return tokens.lineno_at(n)
+    return tokens[n].lineno
+
+
+def _operand(tokens, n):
+    """factor, optionally preceded by a prefix operator."""
+    if n >= len(tokens):
+        return None
+    if _toktype(tokens, n) in prefix_operators:
+        match = _factor(tokens, n + 1)
+        if match is None:
+            return None
+        op = _value(tokens, n)
+        if op != "-":
+            check_unnegated(match[0], tokens, n + 1)
+        return Unary(Op(op), match[0]), match[1]
+    match = _factor(tokens, n)
+    if match is not None:
+        check_unnegated(match[0], tokens, n)
+    return match
+
+
+def _factor(tokens, n):
+    if n >= len(tokens):
+        return None
+    toktype = _toktype(tokens, n)
+    if toktype in _literal_nodes:
+        return literal_node(tokens[n]), n + 1
+    if toktype == "NAME":
+        call = _arguments(tokens, n + 1)
+        if call is not None:
+            return FunctionCall(Name(_value(tokens, n)), call[0]), call[1]
+        return Name(_value(tokens, n)), n + 1
+    if toktype == "LPAREN":
+        match = parse_expression(tokens, n + 1)
+        if _peek(tokens, match, "RPAREN"):
+            return Grouping(match[0]), match[1] + 1
+    return None
+
+
+def _peek(tokens, match, toktype):
+    """Does a token of toktype follow the successful match?"""
+    return (
+        match is not None
+        and match[1] < len(tokens)
+        and _toktype(tokens, match[1]) == toktype
+    )
+
+
+def _arguments(tokens, n):
+    """"(" [ expression ( "," expression )* ] ")" """
+    if not _peek(tokens, (None, n), "LPAREN"):
+        return None
+    n += 1
+    arguments = []
+    match = parse_expression(tokens, n)
+    if match is not None:
+        arguments.append(match[0])
+        n = match[1]
+        while _peek(tokens, (None, n), "COMMA"):
+            match = parse_expression(tokens, n + 1)
+            if match is None:
+                break
+            arguments.append(match[0])
+            n = match[1]
+    if not _peek(tokens, (None, n), "RPAREN"):
+        return None
+    return arguments, n + 1
+
+
+def parse_expression(tokens, n, min_power=1):
+    """
+    Parse an expression at tokens[n] that only contains binary operators
+    binding at least as tightly as min_power.  Gives the same result as the
+    expression combinator.
+    """
+    match = _operand(tokens, n)
+    if match is None:
+        return None
+    lhs, n = match
+    while n < len(tokens):
+        power = binding_power.get(_toktype(tokens, n))
+        if power is None or power < min_power:
+            break
+        match = parse_expression(tokens, n + 1, power + 1)
+        if match is None:
+            # Leave a dangling operator for the caller, like the combinators do
+            break
+        lhs = BinOp(Op(_value(tokens, n)), lhs, match[0])
+        n = match[1]
+    return lhs, n
+
+
+# Statement grammar.  Expressions are parsed with parse_expression().
+#
+#   statements  := statement*
+#   statement   := "print" expression ";"
+#                | "const" NAME [ NAME ] "=" expression ";"
+#                | "var" NAME [ NAME ] [ "=" expression ] ";"
+#                | "if" expression block [ "else" block ]
+#                | "while" expression block
+#                | "break" ";" | "continue" ";" | "return" expression ";"
+#                | "func" NAME "(" [ NAME NAME ( "," NAME NAME )* ] ")" NAME block
+#                | NAME "=" expression ";"
+#                | expression ";"
+#   block       := "{" statements "}"
+
+name = transform(expect("NAME"), lambda tok: Name(tok.value))
+typename = transform(expect("NAME"), lambda tok: Typename(tok.value))
+block = transform(
+    sequence(expect("LBRACE"), forward(lambda: statements), expect("RBRACE")),
+    lambda r: r[1],
+)
+parameter = transform(sequence(name, typename), lambda r: Parameter(r[0], r[1]))
+
+statement = located(choice(
+    transform(
+        sequence(expect("PRINT"), parse_expression, expect("SEMI")),
+        lambda r: PrintStatement(r[1]),
+    ),
+    transform(
+        sequence(
+            expect("CONST"),
+            name,
+            optional(typename),
+            expect("ASSIGN"),
+            parse_expression,
+            expect("SEMI"),
+        ),
+        lambda r: ConstDeclaration(r[1], r[2], r[4]),
+    ),
+    transform(
+        sequence(
+            expect("VAR"),
+            name,
+            optional(typename),
+            optional(
+                transform(sequence(expect("ASSIGN"), parse_expression), lambda r: r[1])
+            ),
+            expect("SEMI"),
+        ),
+        lambda r: VarDeclaration(r[1], r[2], r[3]),
+    ),
+    transform(
+        sequence(
+            expect("IF"),
+            parse_expression,
+            block,
+            optional(transform(sequence(expect("ELSE"), block), lambda r: r[1])),
+        ),
+        lambda r: IfStatement(r[1], r[2], r[3]),
+    ),
+    transform(
+        sequence(expect("WHILE"), parse_expression, block),
+        lambda r: WhileStatement(r[1], r[2]),
+    ),
+    transform(
+        sequence(expect("BREAK"), expect("SEMI")), lambda r: BreakStatement()
+    ),
+    transform(
+        sequence(expect("CONTINUE"), expect("SEMI")), lambda r: ContinueStatement()
+    ),
+    transform(
+        sequence(expect("RETURN"), parse_expression, expect("SEMI")),
+        lambda r: ReturnStatement(r[1]),
+    ),
+    transform(
+        sequence(
+            expect("FUNC"),
+            name,
+            expect("LPAREN"),
+            delimited(parameter, "COMMA"),
+            expect("RPAREN"),
+            typename,
+            block,
+        ),
+        lambda r: FuncDeclaration(r[1], r[3], r[5], r[6]),
+    ),
+    transform(
+        sequence(name, expect("ASSIGN"), parse_expression, expect("SEMI")),
+        lambda r: Assignment(r[0], r[2]),
+    ),
+    transform(
+        sequence(parse_expression, expect("SEMI")),
+        lambda r: ExpressionStatement(r[0]),
+    ),
+))
+statements = transform(zero_or_more(statement), Statements)
+
+
+def parse_tokens(tokens, lines=None) -> Statements:
+    """
+    Parse a whole program, raising SyntaxError at the first token that
+    doesn't fit.  Given an IdentityCache as lines, records there the line
+    each statement starts on.
+    """
+    if lines is not None:
+        tokens = LocatedTokens(tokens, lines)
+    program, n = statements(tokens, 0)
+    if n < len(tokens):
+        tok = tokens[n]
+        raise SyntaxError(f"{tok.lineno}: Syntax error at {tok.value!r}")
+    return program
+
+
+def parse_source(source, lines=None) -> Statements:
+    return parse_tokens(tokenize_regex(source), lines)
+
+
+def parse_file(filename, lines=None) -> Statements:
+    with open(filename) as file:
+        return parse_source(file.read(), lines)
+
+
+def test_parser():
+    def both(source):
+        tokens = tokenize(source)
+        return parse_memoized(expression, tokens)[0], parse_expression(tokens, 0)
+
+    # The tiered combinators and precedence climbing build the same trees
+    for source in [
+        "1 + 2 * 3",
+        "(1 + 2) * 3",
+        "1 - 2 - 3",
+        "a < b == c < d",
+        "x || y && !z",
+        "-f(1, g(2)) / +3.5",
+        "'a' != c && true",
+    ]:
+        tiers, pratt = both(source)
+        assert tiers == pratt, source
+        assert pratt[1] == len(tokenize(source))
+
+    tiers, _ = both("1 + 2 * 3 - 4")
+    assert tiers[0] == BinOp(
+        Op("-"),
+        BinOp(Op("+"), Integer("1"), BinOp(Op("*"), Integer("2"), Integer("3"))),
+        Integer("4"),
+    )
+
+    # INT_MAX + 1 is only a literal under a minus
+    tiers, pratt = both("-2147483648")
+    assert tiers == pratt
+    assert tiers[0] == Unary(Op("-"), Integer("2147483648"))
+    for source in ["2147483648", "+2147483648", "1 - 2147483648", "-2147483649"]:
+        for parse in (
+            lambda tokens: parse_memoized(expression, tokens),
+            lambda tokens: parse_expression(tokens, 0),
+        ):
+            try:
+                parse(tokenize(source))
+            except SyntaxError:
+                pass
+            else:
+                raise AssertionError(f"{source} parsed")
+
+    # A dangling operator is left for the caller
+    tiers, pratt = both("1 +")
+    assert tiers == pratt == (Integer("1"), 1)
+
+    source = """
+        var x int = 2;
+        func f(a int) int { return a * x; }
+        while x < 10 { if x == 4 { break; } x = f(x); }
+        print f(x);
+    """
+    program = parse_source(source)
+    assert parse_tokens(tokenize_buffer(source)) == program
+    assert [type(statement) for statement in program.statements] == [
+        VarDeclaration,
+        FuncDeclaration,
+        WhileStatement,
+        PrintStatement,
+    ]
+    assert program.statements[0] == VarDeclaration(Name("x"), Typename("int"), Integer("2"))
+
+    for source in ["print 1", "var = 2;", "func f() { }", "x = ;"]:
+        try:
+            parse_source(source)
+        except SyntaxError:
+            pass
+        else:
+            raise AssertionError(f"{source!r} parsed")
+
+
+test_parser()
@@ -0,0 +1,235 @@
+# flatast.py
+#
+# A flat, array-backed form of the model tree.  Every node (and every list
+# held in a node field) is a row of a table stored column-wise:
+#
+#     kinds[r]      node class code from model.node_classes, or LIST
+#     literals[r]   index into strings of the node's str field, or -1
+#     first[r]      where the row's children start in the children column
+#     counts[r]     how many children it has
+#
+# children holds row numbers, with -1 for a field that is None.  Rows are
+# numbered in pre-order, so a child always comes after its parent and the
+# rows of a subtree are contiguous.
+#
+# None of the walkers below recurse, so passes written on top of them work
+# on BinOp chains far deeper than Python's recursion limit.
+from array import array
+
+from model import *
+
+LIST = len(node_classes)
+
+_field_names = [[f.name for f in node_fields(cls)] for cls in node_classes]
+# Position of the str field of each class, if it has one
+_literal_fields = [
+    next((n for n, f in enumerate(node_fields(cls)) if f.type is str), None)
+    for cls in node_classes
+]
+
+
+class FlatTree:
+    def __init__(self):
+        self.kinds = array("B")
+        self.literals = array("i")
+        self.first = array("I")
+        self.counts = array("I")
+        self.children = array("i")
+        self.strings = []
+        self._string_index = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def node_class(self, row):
+        """The model class of row, or list for a LIST row."""
+        kind = self.kinds[row]
+        return list if kind == LIST else node_classes[kind]
+
+    def literal(self, row):
+        index = self.literals[row]
+        return None if index < 0 else self.strings[index]
+
+    def children_of(self, row):
+        start = self.first[row]
+        return self.children[start : start + self.counts[row]]
+
+    def _add_row(self, kind, literal, count):
+        row = len(self.kinds)
+        self.kinds.append(kind)
+        if literal is None:
+            self.literals.append(-1)
+        else:
+            index = self._string_index.get(literal)
+            if index is None:
+                index = self._string_index[literal] = len(self.strings)
+                self.strings.append(literal)
+            self.literals.append(index)
+        self.first.append(len(self.children))
+        self.counts.append(count)
+        self.children.extend([-1] * count)
+        return row
+
+    def walk(self, root=0):
+        """Yield (row, depth) for root and every row below it, in pre-order."""
+        children = self.children
+        first = self.first
+        counts = self.counts
+        stack = [(root, 0)]
+        while stack:
+            row, depth = stack.pop()
+            yield row, depth
+            start = first[row]
+            for n in range(start + counts[row] - 1, start - 1, -1):
+                child = children[n]
+                if child >= 0:
+                    stack.append((child, depth + 1))
+
+    def fold(self, func, root=0):
+        """
+        Combine the tree bottom-up.  func(tree, row, values) is called for
+        every node row once the values of its children are known, in field
+        order, with None for a None field and a list for a LIST row.
+        Returns the value of root.
+        """
+        kinds = self.kinds
+        children = self.children
+        first = self.first
+        counts = self.counts
+        order = [row for row, _ in self.walk(root)]
+        results = {}
+        for row in reversed(order):
+            start = first[row]
+            values = [
+                None if child < 0 else results.pop(child)
+                for child in children[start : start + counts[row]]
+            ]
+            results[row] = values if kinds[row] == LIST else func(self, row, values)
+        return results[root]
+
+    def to_tree(self, root=0, make=None) -> Node:
+        """
+        Build the model tree back from the table.  Nodes are created by
+        make(cls, *fields), which defaults to calling the class.
+        """
+        if make is None:
+            make = _make_node
+
+        def build(tree, row, values):
+            kind = tree.kinds[row]
+            position = _literal_fields[kind]
+            if position is not None:
+                values.insert(position, tree.strings[tree.literals[row]])
+            return make(node_classes[kind], *values)
+
+        return self.fold(build, root)
+
+
+def _make_node(cls, *fields):
+    return cls(*fields)
+
+
+def flatten(node: Node) -> FlatTree:
+    """Convert a model tree to a FlatTree, without recursing."""
+    tree = FlatTree()
+    # (value, slot in tree.children to point at it, or -1 for the root)
+    stack = [(node, -1)]
+    while stack:
+        value, slot = stack.pop()
+        if isinstance(value, list):
+            row = tree._add_row(LIST, None, len(value))
+            items = value
+        else:
+            kind = node_codes[type(value)]
+            position = _literal_fields[kind]
+            items = [getattr(value, name) for name in _field_names[kind]]
+            literal = None if position is None else items.pop(position)
+            row = tree._add_row(kind, literal, len(items))
+        if slot >= 0:
+            tree.children[slot] = row
+        start = tree.first[row]
+        for n in range(len(items) - 1, -1, -1):
+            if items[n] is not None:
+                stack.append((items[n], start + n))
+    return tree
+
+
+def unflatten(tree: FlatTree) -> Node:
+    return tree.to_tree()
+
+
+# ----------------------------------------------------------------------
+# Formatting on the flat table.  Gives the same text as format_wabbit(),
+# but each node is formatted from the text of its children, so nesting
+# depth is unlimited.  Nested blocks are indented after the fact.
+
+def _indent(code):
+    return "".join("    " + line for line in code.splitlines(keepends=True))
+
+
+def _format_row(tree, row, values):
+    cls = tree.node_class(row)
+    if cls in (Integer, Float, Bool, Char, Name, Typename, Op):
+        return tree.literal(row)
+    elif cls is Unary:
+        op, operand = values
+        return f"{op}{operand}"
+    elif cls is BinOp:
+        op, lhs, rhs = values
+        return f"{lhs} {op} {rhs}"
+    elif cls is PrintStatement:
+        return f"print {values[0]};\n"
+    elif cls is BreakStatement:
+        return "break;\n"
+    elif cls is ContinueStatement:
+        return "continue;\n"
+    elif cls is Grouping:
+        return f"({values[0]})"
+    elif cls is ConstDeclaration:
+        name, type, value = values
+        code = f"const {name}"
+        if type:
+            code += f" {type}"
+        return code + f" = {value};\n"
+    elif cls is VarDeclaration:
+        name, type, value = values
+        code = f"var {name}"
+        if type:
+            code += f" {type}"
+        if value:
+            code += f" = {value}"
+        return code + ";\n"
+    elif cls is Assignment:
+        lhs, rhs = values
+        return f"{lhs} = {rhs};\n"
+    elif cls is IfStatement:
+        test, consequence, alternative = values
+        code = f"if {test} " + "{\n" + _indent(consequence) + "}"
+        if alternative is not None:
+            code += " else {\n" + _indent(alternative) + "}"
+        return code + "\n"
+    elif cls is WhileStatement:
+        test, body = values
+        return f"while {test} " + "{\n" + _indent(body) + "}\n"
+    elif cls is ExpressionStatement:
+        return f"{values[0]};\n"
+    elif cls is ReturnStatement:
+        return f"return {values[0]};\n"
+    elif cls is Parameter:
+        name, type = values
+        return f"{name} {type}"
+    elif cls is FuncDeclaration:
+        name, parameters, return_type, body = values
+        code = f"func {name}({', '.join(parameters)}) {return_type} " + "{\n"
+        return code + _indent(body) + "}\n"
+    elif cls is FunctionCall:
+        name, arguments = values
+        return f"{name}({', '.join(arguments)})"
+    elif cls is Statements:
+        return "".join(values[0])
+    else:
+        raise RuntimeError(f"Node type not recognized: {cls.__name__}")
+
+
+def format_flat(tree: FlatTree, root=0) -> str:
+    return tree.fold(_format_row, root)
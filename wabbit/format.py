@@ -1,9 +1,10 @@
 # Format the program data structure
 from model import *
+from visitor import NodeVisitor
 
 
 def format_wabbit(node: Node):
-    return _format(node, Context())
+    return _formatter.visit(node, Context())
 
 
 class Context:
@@ -14,83 +15,104 @@ class Context:
         return Context(self.indent + "    ")
 
 
-def _format(node: Node, ctx: Context) -> str:
-    if isinstance(node, Integer):
-        return node.value
-    elif isinstance(node, Float):
-        return node.value
-    elif isinstance(node, Bool):
+class Formatter(NodeVisitor):
+    def generic_visit(self, node, ctx):
+        raise RuntimeError(f"Node type not recognized: {node}")
+
+    def visit_Integer(self, node, ctx):
         return node.value
-    elif isinstance(node, Name):
-        return node.text
-    elif isinstance(node, Typename):
+
+    visit_Float = visit_Bool = visit_Char = visit_Integer
+
+    def visit_Name(self, node, ctx):
         return node.text
-    elif isinstance(node, Op):
+
+    visit_Typename = visit_Name
+
+    def visit_Op(self, node, ctx):
         return node.symbol
-    elif isinstance(node, Unary):
-        return f"{_format(node.op, ctx)}{_format(node.operand, ctx)}"
-    elif isinstance(node, BinOp):
+
+    def visit_Unary(self, node, ctx):
+        return f"{self.visit(node.op, ctx)}{self.visit(node.operand, ctx)}"
+
+    def visit_BinOp(self, node, ctx):
         return (
-            f"{_format(node.lhs, ctx)} {_format(node.op, ctx)} {_format(node.rhs, ctx)}"
+            f"{self.visit(node.lhs, ctx)} {self.visit(node.op, ctx)} {self.visit(node.rhs, ctx)}"
         )
-    elif isinstance(node, PrintStatement):
-        return f"print {_format(node.value, ctx)};\n"
-    elif isinstance(node, BreakStatement):
+
+    def visit_PrintStatement(self, node, ctx):
+        return f"print {self.visit(node.value, ctx)};\n"
+
+    def visit_BreakStatement(self, node, ctx):
         return "break;\n"
-    elif isinstance(node, ContinueStatement):
+
+    def visit_ContinueStatement(self, node, ctx):
         return "continue;\n"
-    elif isinstance(node, Grouping):
-        return f"({_format(node.value, ctx)})"
-    elif isinstance(node, ConstDeclaration):
-        code = f"const {_format(node.name, ctx)}"
+
+    def visit_Grouping(self, node, ctx):
+        return f"({self.visit(node.value, ctx)})"
+
+    def visit_ConstDeclaration(self, node, ctx):
+        code = f"const {self.visit(node.name, ctx)}"
         if node.type:
-            code += f" {_format(node.type, ctx)}"
-        code += " = " + _format(node.value, ctx) + ";\n"
+            code += f" {self.visit(node.type, ctx)}"
+        code += " = " + self.visit(node.value, ctx) + ";\n"
         return code
-    elif isinstance(node, VarDeclaration):
-        code = f"var {_format(node.name, ctx)}"
+
+    def visit_VarDeclaration(self, node, ctx):
+        code = f"var {self.visit(node.name, ctx)}"
         if node.type:
-            code += f" {_format(node.type, ctx)}"
+            code += f" {self.visit(node.type, ctx)}"
         if node.value:
-            code += " = " + _format(node.value, ctx)
+            code += " = " + self.visit(node.value, ctx)
         return code + ";\n"
-    elif isinstance(node, Assignment):
-        return f"{_format(node.lhs, ctx)} = {_format(node.rhs, ctx)};\n"
-    elif isinstance(node, IfStatement):
-        code = f"if {_format(node.test, ctx)} " + "{\n"
-        code += _format(node.consequence, ctx.new()) + ctx.indent + "}"
+
+    def visit_Assignment(self, node, ctx):
+        return f"{self.visit(node.lhs, ctx)} = {self.visit(node.rhs, ctx)};\n"
+
+    def visit_IfStatement(self, node, ctx):
+        code = f"if {self.visit(node.test, ctx)} " + "{\n"
+        code += self.visit(node.consequence, ctx.new()) + ctx.indent + "}"
         if node.alternative:
             code += " else {\n"
-            code += _format(node.alternative, ctx.new()) + ctx.indent + "}"
+            code += self.visit(node.alternative, ctx.new()) + ctx.indent + "}"
         return code + "\n"
-    elif isinstance(node, WhileStatement):
-        code = f"while {_format(node.test, ctx)} " + "{\n"
-        code += _format(node.body, ctx.new()) + "}"
+
+    def visit_WhileStatement(self, node, ctx):
+        code = f"while {self.visit(node.test, ctx)} " + "{\n"
+        code += self.visit(node.body, ctx.new()) + ctx.indent + "}"
         return code + "\n"
-    elif isinstance(node, ReturnStatement):
-        code = f"return {_format(node.value, ctx)};\n"
-        return code
-    elif isinstance(node, FuncDeclaration):
-        code = f"func {_format(node.name, ctx)}("
+
+    def visit_ExpressionStatement(self, node, ctx):
+        return f"{self.visit(node.value, ctx)};\n"
+
+    def visit_ReturnStatement(self, node, ctx):
+        return f"return {self.visit(node.value, ctx)};\n"
+
+    def visit_FuncDeclaration(self, node, ctx):
+        code = f"func {self.visit(node.name, ctx)}("
         param_str = []
         for param in node.parameters:
-            param_str.append(f"{_format(param.name, ctx)}: {_format(param.type, ctx)}")
+            param_str.append(f"{self.visit(param.name, ctx)} {self.visit(param.type, ctx)}")
         code += ", ".join(param_str)
-        code += f") {_format(node.return_type, ctx)} " + "{\n"
-        code += _format(node.body, ctx.new()) + ctx.indent + "}\n"
+        code += f") {self.visit(node.return_type, ctx)} " + "{\n"
+        code += self.visit(node.body, ctx.new()) + ctx.indent + "}\n"
         return code
-    elif isinstance(node, FunctionCall):
-        code = f"{_format(node.name, ctx)}("
+
+    def visit_FunctionCall(self, node, ctx):
+        code = f"{self.visit(node.name, ctx)}("
         arg_str = []
         for arg in node.arguments:
-            arg_str.append(f"{_format(arg, ctx)}")
+            arg_str.append(f"{self.visit(arg, ctx)}")
         code += ", ".join(arg_str)
         code += ")"
         return code
-    elif isinstance(node, Statements):
+
+    def visit_Statements(self, node, ctx):
         code = ""
         for statement in node.statements:
-            code += ctx.indent + _format(statement, ctx)
+            code += ctx.indent + self.visit(statement, ctx)
         return code
-    else:
-        raise RuntimeError(f"Node type not recognized: {node}")
+
+
+_formatter = Formatter()
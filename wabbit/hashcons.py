@@ -0,0 +1,90 @@
+# hashcons.py
+#
+# Hash-consing of model nodes.  An Interner hands out one shared object for
+# every structurally identical subtree, so a generated program that says
+# Integer("1") or n - 1 ten thousand times holds each of them once.
+#
+# A node is looked up by its class and its fields, with child nodes taken
+# by identity: children are interned before their parents, so two equal
+# subtrees are always the same object and the key never needs to look
+# further down than one level.  The table holds its nodes weakly; when the
+# last tree using a node goes away, so does the entry.
+#
+# Shared nodes must not be changed in place.  Running with
+# WABBIT_FROZEN_NODES=1 (see model.py) enforces that for node fields.
+import weakref
+
+from flatast import flatten
+from model import *
+
+
+def _field_key(value):
+    if isinstance(value, Node):
+        return id(value)
+    elif isinstance(value, list):
+        return tuple(map(id, value))
+    else:
+        return value
+
+
+class Interner:
+    def __init__(self):
+        self.table = weakref.WeakValueDictionary()
+        self.requests = 0
+        self.created = 0
+
+    def make(self, cls, *fields) -> Node:
+        """
+        Return cls(*fields), or the node already made with the same class
+        and fields.  Child nodes among fields must come from this Interner.
+        """
+        self.requests += 1
+        key = (cls, *map(_field_key, fields))
+        node = self.table.get(key)
+        if node is None:
+            node = self.table[key] = cls(*fields)
+            self.created += 1
+        return node
+
+    def intern(self, tree: Node) -> Node:
+        """Return the shared equivalent of an existing tree."""
+        return flatten(tree).to_tree(make=self.make)
+
+    @property
+    def dedup_ratio(self):
+        """Nodes asked for per node actually created."""
+        return self.requests / self.created if self.created else 1.0
+
+    def report(self):
+        return (
+            f"{self.requests} nodes requested, {self.created} created, "
+            f"{len(self.table)} live; dedup ratio {self.dedup_ratio:.2f}x"
+        )
+
+
+class IdentityCache:
+    """
+    Per-node results of a pass, keyed by node identity.  With interned
+    trees every occurrence of a subtree is the same object, so a result is
+    computed once per distinct subtree.  Entries keep their node alive so
+    that its id can't be reused by a different node.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def __contains__(self, node):
+        return id(node) in self.entries
+
+    def __getitem__(self, node):
+        return self.entries[id(node)][1]
+
+    def __setitem__(self, node, value):
+        self.entries[id(node)] = (node, value)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, node, default=None):
+        entry = self.entries.get(id(node))
+        return default if entry is None else entry[1]
@@ -0,0 +1,128 @@
+# incremental.py
+#
+# Incremental parsing for editors.  A ParsedSource keeps the tokens and
+# the top-level statements of a program together with the token span of
+# each statement.  After an edit only the statements whose tokens changed
+# are parsed again; every other FuncDeclaration or top-level statement is
+# kept as the very same object.
+import bisect
+from dataclasses import dataclass
+
+from cparser import statement
+from model import *
+from tokenizer import retokenize_span, tokenize_regex
+
+
+@dataclass
+class Reparse:
+    """
+    The top-level statements replaced by an edit: removed used to be
+    tree.statements[start:start + len(removed)] and added is there now.
+    """
+
+    start: int
+    removed: list[Statement]
+    added: list[Statement]
+
+
+def _span_start(span):
+    return span[0]
+
+
+def _parse_item(tokens, n):
+    match = statement(tokens, n)
+    if match is None:
+        tok = tokens[n]
+        raise SyntaxError(f"{tok.lineno}: Syntax error at {tok.value!r}")
+    return match
+
+
+class ParsedSource:
+    """
+    A program's source, tokens and parse tree, updated in step by edit().
+
+    tree.statements[i] was parsed from tokens[spans[i][0]:spans[i][1]].
+    The spans are contiguous since statements follow each other directly.
+    While the source doesn't parse, error holds the SyntaxError.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.tokens = tokenize_regex(source)
+        self.tree = Statements([])
+        self.spans = []
+        self.error = None
+        try:
+            self._parse_all()
+        except SyntaxError:
+            pass
+
+    def _parse_all(self):
+        self.spans = []
+        self.error = None
+        removed = self.tree.statements
+        self.tree = Statements([])
+        try:
+            reparse = self._parse_from(0, 0, 0, 0)
+        except SyntaxError as e:
+            self.error = e
+            raise
+        reparse.removed = removed
+        return reparse
+
+    def _parse_from(self, item, n, old_stop, delta) -> Reparse:
+        """
+        Parse statements from tokens[n] in place of the old statements from
+        index item on.  Stops once a statement ends where an old statement
+        that started at or past old_stop began (shifted by delta tokens),
+        since from there on the tokens are the same as before.
+        """
+        tokens = self.tokens
+        spans = self.spans
+        resync = bisect.bisect_left(spans, old_stop, lo=item, key=_span_start)
+        added = []
+        added_spans = []
+        while n < len(tokens):
+            while resync < len(spans) and spans[resync][0] + delta < n:
+                resync += 1
+            if resync < len(spans) and spans[resync][0] + delta == n:
+                break
+            node, end = _parse_item(tokens, n)
+            added.append(node)
+            added_spans.append((n, end))
+            n = end
+        else:
+            resync = len(spans)
+        if delta:
+            for k in range(resync, len(spans)):
+                start, stop = spans[k]
+                spans[k] = (start + delta, stop + delta)
+        spans[item:resync] = added_spans
+        removed = self.tree.statements[item:resync]
+        self.tree.statements[item:resync] = added
+        return Reparse(item, removed, added)
+
+    def edit(self, offset, deleted, inserted) -> Reparse:
+        """
+        Replace source[offset:offset + deleted] with inserted and update the
+        tokens and tree.  Returns which top-level statements were replaced.
+
+        Raises SyntaxError if the edited program doesn't parse; the next
+        edit then reparses the whole program.
+        """
+        self.source, first, old_stop, new_stop = retokenize_span(
+            self.source, self.tokens, offset, deleted, inserted
+        )
+        if self.error is not None:
+            return self._parse_all()
+
+        # The statement holding the token just before the damage is parsed
+        # again too: it may end differently now (an "else" added after an
+        # "if", say).
+        item = max(bisect.bisect_right(self.spans, first - 1, key=_span_start) - 1, 0)
+        start = self.spans[item][0] if self.spans else 0
+        try:
+            return self._parse_from(item, start, old_stop, new_stop - old_stop)
+        except SyntaxError as e:
+            self.error = e
+            raise
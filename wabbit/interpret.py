@@ -1,4 +1,13 @@
+import operator
+from time import perf_counter
+
+from budget import CHECK_INTERVAL, Budget, BudgetExceeded, BudgetStats
 from model import *
+from output import OutputSink, StreamSink
+from profiler import Profile, Profiling
+from purity import ResultCache, pure_functions
+from resolve import LocalName, resolve
+from visitor import NodeVisitor
 
 
 # formal type system mapping
@@ -51,91 +60,250 @@ class WVoid(WType):
         return f'WVoid()'
 
 
+# What statements evaluate to.  One instance serves them all.
+VOID = WVoid()
+
+
 @dataclass
 class WFunc(WType):
     name: Name
-    parameters: list[Parameter]
+    parameters: list[LocalName]
     return_type: Type
     body: Statements
+    frame_size: int
+    # The globals the function sees, and frames left by earlier calls,
+    # ready for the next ones
+    globals: list
+    frames: list = field(default_factory=list)
+    # Where results are kept if the function is memoized
+    memo: ResultCache | None = None
 
 
-class WUndefined:
-    pass
+class WEnvironment:
+    """
+    The variables of a function call, or of the top-level code, in a list
+    indexed by the slots resolve() gave them.  globals is the list of the
+    top-level code, which is also slots there.
+    """
 
+    def __init__(self, size, globals=None):
+        self.slots = [None] * size
+        self.globals = self.slots if globals is None else globals
 
-class WEnvironment:
-    def __init__(self, parent=None):
-        self.data = {}
-        self.parent = parent
-
-    def define(self, name, val):
-        # what if it already exists?
-        self.data[name] = val
-
-    def lookup(self, name: str) -> WType | WUndefined:
-        if name not in self.data:
-            if self.parent:
-                return self.parent.lookup(name)
-            else:
-                return WUndefined()
-        else:
-            return self.data[name]
+    def load(self, name):
+        if type(name) is LocalName:
+            return self.slots[name.slot]
+        return self.globals[name.slot]
 
     def store(self, name, value):
-        # what if it doesn't exist?
-        self.data[name] = value
+        if type(name) is LocalName:
+            self.slots[name.slot] = value
+        else:
+            self.globals[name.slot] = value
 
 
-class WBreak(Exception):
+# How a statement completed.  Statements return VOID when they completed
+# normally, so that execution goes on with the next one; BREAK or CONTINUE
+# when a break or continue statement ran; or a WReturn carrying the value
+# of a return statement.  Blocks hand anything but VOID up to the loop or
+# the call that deals with it.
+class WBreak:
     pass
 
 
-class WContinue(Exception):
+class WContinue:
     pass
 
 
-class WReturn(Exception):
+class WReturn:
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
 
-def interpret_wabbit(node: Node):
-    environ = WEnvironment()
-    return interpret(node, environ)
+BREAK = WBreak()
+CONTINUE = WContinue()
 
 
-# Interprets a node of Wabbit code and returns a value from Wabbit
-def interpret(node: Node, environ: WEnvironment) -> WType:
+def check_completed(status):
     """
-    Interpret each node
-    :param environ:
-    :param node:
-    :return:
+    Raise RuntimeError, as machine.py does, if a program's top-level code
+    ran a break, continue or return: there is no loop or function there
+    for it to leave.
     """
-    if node is None:
-        return WVoid()
-    if isinstance(node, Expression):
-        return interpret_expression(node, environ)
-    elif isinstance(node, Statement):
-        interpret_statement(node, environ)
-        return WVoid()
-    elif isinstance(node, Statements):
-        for statement in node.statements:
-            interpret_statement(statement, environ)
-        return WVoid()
+    if status is BREAK:
+        raise RuntimeError(f'{BreakStatement()} outside a loop')
+    if status is CONTINUE:
+        raise RuntimeError(f'{ContinueStatement()} outside a loop')
+    if type(status) is WReturn:
+        raise RuntimeError('return outside a function')
+
+
+# Operations on the Python values inside WInt, WFloat, WBool and WChar,
+# shared with the other engines
+arithmetic = {'+': operator.add, '-': operator.sub, '*': operator.mul}
+relations = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+
+def int_divide(a, b):
+    """Integer division, truncating towards zero as the spec requires."""
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def is_chained(node):
+    """Is node a relation whose left side is a relation, as in a < b < c?"""
+    return (
+        isinstance(node, BinOp)
+        and node.op.symbol in relations
+        and isinstance(node.lhs, BinOp)
+        and node.lhs.op.symbol in relations
+    )
+
+
+def _to_int(value):
+    return ord(value) if isinstance(value, str) else int(value)
+
+
+_MISSING = object()
+
+
+# Type conversions, which are written like calls: int(x), float(x), ...
+conversions = {'int': _to_int, 'float': float, 'char': chr, 'bool': bool}
+
+
+def box(value):
+    """The WType for a native value, as NativeInterpreter uses them."""
+    if type(value) is bool:
+        return WBool(value)
+    elif type(value) is int:
+        return WInt(value)
+    elif type(value) is float:
+        return WFloat(value)
+    elif type(value) is str:
+        return WChar(value)
+    return WVoid()
+
+
+def format_value(value):
+    """What print writes for a native value."""
+    # bool first: it is a subclass of int
+    if type(value) is bool:
+        return 'true\n' if value else 'false\n'
+    elif type(value) is str:
+        return value
+    elif value is None:
+        return ''
+    return f'{value}\n'
+
+
+def interpret_wabbit(
+    node: Node,
+    native=False,
+    memo: ResultCache | None = None,
+    out: OutputSink | None = None,
+    profile: Profile | None = None,
+    budget: Budget | None = None,
+):
+    """
+    Run a program.  With native=True it runs on NativeInterpreter, which is
+    faster; the result is a WType either way.  Given a ResultCache as memo,
+    calls to pure functions keep their results there for the run and reuse
+    them.  What the program prints goes to out, sys.stdout by default.
+    Given a Profile, the run is profiled into it.  Given a Budget, the run
+    stops with BudgetExceeded when it goes over one of its limits.
+    """
+    if profile is not None and budget is not None:
+        raise ValueError('a run can be profiled or budgeted, not both')
+    resolution = resolve(node)
+    environ = WEnvironment(len(resolution.globals))
+    if memo is not None:
+        # Results are kept by global slot, which only names the same
+        # function within one run
+        memo.clear()
+        pure = pure_functions(resolution.tree)
+    else:
+        pure = ()
+    out = StreamSink() if out is None else out
+    if budget is not None:
+        interpreter = (BudgetedNativeInterpreter if native else BudgetedInterpreter)(
+            budget, memo, pure, out
+        )
+        run = interpreter.run
+    elif profile is None:
+        interpreter = (NativeInterpreter if native else Interpreter)(memo, pure, out)
+        run = interpreter.visit
     else:
+        profile.bind(node, resolution.tree)
+        interpreter = (ProfilingNativeInterpreter if native else ProfilingInterpreter)(
+            profile, memo, pure, out
+        )
+        run = interpreter.run
+    with out:
+        result = run(resolution.tree, environ)
+    check_completed(result)
+    return box(result) if native else result
+
+
+class Interpreter(NodeVisitor):
+    """
+    Interprets a node of Wabbit code and returns a value from Wabbit.
+    There is one visit_ method per node class.  Statements return how they
+    completed: VOID, BREAK, CONTINUE or a WReturn.
+    """
+
+    def __init__(self, memo=None, pure=(), out=None):
+        # The function called at each call site, keyed by the id of the
+        # FunctionCall node
+        self.call_sites = {}
+        # Functions whose results go in memo, by global slot
+        self.memo = memo
+        self.pure = pure
+        self.out = StreamSink() if out is None else out
+
+    def visit_NoneType(self, node, environ):
+        return VOID
+
+    def truth(self, value):
+        """The Python bool for a Wabbit bool."""
+        return value.value
+
+    def convert(self, typename, value):
+        return typemap[typename](conversions[typename](value.value))
+
+    def generic_visit(self, node, environ):
         raise RuntimeError(f"Interpreter failure on node: {node}")
 
+    def visit_Expression(self, node, environ):
+        raise RuntimeError(f'Interpreter error: unsupported expression type on node: {node}')
+
+    def visit_Statement(self, node, environ):
+        raise RuntimeError(f'Interpreter failure: unexpected statement type on node: {node}')
+
+    # Expressions
+
+    def visit_Integer(self, node, environ):
+        return WInt(node.decoded)
+
+    def visit_Float(self, node, environ):
+        return WFloat(node.decoded)
+
+    def visit_Bool(self, node, environ):
+        return WBool(node.decoded)
+
+    def visit_Char(self, node, environ):
+        return WChar(node.decoded)
 
-def interpret_expression(node: Node, environ: WEnvironment) -> WType:
-    if isinstance(node, Integer):
-        return WInt(node.value)
-    elif isinstance(node, Float):
-        return WFloat(node.value)
-    elif isinstance(node, Bool):
-        return WBool(node.value)
-    elif isinstance(node, Unary):
-        opval = interpret_expression(node.operand, environ)
+    def visit_Unary(self, node, environ):
+        opval = self.visit(node.operand, environ)
         op = node.op
         if isinstance(opval, WInt):
             match op.symbol:
@@ -152,146 +320,384 @@ def interpret_expression(node: Node, environ: WEnvironment) -> WType:
         elif isinstance(opval, WBool):
             if op.symbol == '!':
                 return WBool(not opval.value)
-    elif isinstance(node, BinOp):
-        left = interpret_expression(node.lhs, environ)
-        right = interpret_expression(node.rhs, environ)
-        op = node.op
-        if type(left) == WInt:
-            match op.symbol:
-                case '+':
-                    result = WInt(left.value + right.value)
-                case '-':
-                    result = WInt(left.value - right.value)
-                case '*':
-                    result = WInt(left.value * right.value)
-                case '/':
-                    result = WInt(left.value / right.value)
-                case '==':
-                    result = WBool(left.value == right.value)
-                case '<':
-                    result = WBool(left.value < right.value)
-                case '>':
-                    result = WBool(left.value > right.value)
-                case _:
-                    raise RuntimeError(f'unsupported integer operator {op.symbol} on node {node}')
-            return result
-        elif type(left) == WFloat:
-            match op.symbol:
-                case '+':
-                    result = WFloat(left.value + right.value)
-                case '-':
-                    result = WFloat(left.value - right.value)
-                case '*':
-                    result = WFloat(left.value * right.value)
-                case '/':
-                    result = WFloat(left.value / right.value)
-                case '==':
-                    result = WBool(left.value == right.value)
-                case '<':
-                    result = WBool(left.value < right.value)
-                case '>':
-                    result = WBool(left.value > right.value)
-                case _:
-                    raise RuntimeError(f'unsupported float operator {op.symbol} on node {node}')
-            return result
 
-    elif isinstance(node, Grouping):
-        return interpret_expression(node.value, environ)
-    elif isinstance(node, Op):
-        pass
-    elif isinstance(node, FunctionCall):
-        func = interpret_expression(node.name, environ)
-        if func is not WUndefined():
-            args = [interpret_expression(arg, environ) for arg in node.arguments]
-            # match arguments with parameters by order, name, or both
-            global_parent = environ
-            while global_parent.parent:
-                global_parent = global_parent.parent
-            func_env = WEnvironment(parent=global_parent)
-
-            # add args to function environment
-            for (pname, arg) in zip(func.parameters, args):
-                func_env.define(pname.text, arg)
-            # evaluate statements
-            try:
-                interpret(func.body, func_env)
-            except WReturn as e:
-                return e.value
+    def visit_BinOp(self, node, environ):
+        symbol = node.op.symbol
+        # && and || only evaluate their right side when they need it
+        if symbol == '&&':
+            left = self.visit(node.lhs, environ)
+            return self.visit(node.rhs, environ) if self.truth(left) else left
+        elif symbol == '||':
+            left = self.visit(node.lhs, environ)
+            return left if self.truth(left) else self.visit(node.rhs, environ)
+        elif is_chained(node):
+            return self._compare(node, environ)[0]
+        left = self.visit(node.lhs, environ)
+        right = self.visit(node.rhs, environ)
+        return self._binary(node, left, right)
+
+    def _compare(self, node, environ):
+        """
+        Evaluate a relation that may be chained, as in a < b < c, which
+        means a < b && b < c with b evaluated once.  Returns the result and
+        the value of the right operand (None once the chain is false).
+        """
+        if is_chained(node):
+            result, left = self._compare(node.lhs, environ)
+            if not self.truth(result):
+                return result, None
         else:
-            raise RuntimeError(f'Undefined function {node.name}')
-    elif isinstance(node, Name):
-        val = environ.lookup(node.text)
-        if isinstance(val, WUndefined):
-            raise RuntimeError(f'Undefined name: {node.text}')
-        return val
-    else:
-        raise RuntimeError(f'Interpreter error: unsupported expression type on node: {node}')
-
-
-def interpret_statement(node: Node, environ: WEnvironment):
-    if isinstance(node, Assignment):
-        val = interpret_expression(node.rhs, environ)
-        environ.define(node.lhs.text, val)
-        return WVoid()
-    elif isinstance(node, PrintStatement):
-        val = interpret(node.value, environ)
+            left = self.visit(node.lhs, environ)
+        right = self.visit(node.rhs, environ)
+        return self._binary(node, left, right), right
+
+    def _binary(self, node, left, right):
+        symbol = node.op.symbol
+        kind = type(left)
+        if symbol in relations and (kind in (WInt, WFloat, WChar) or symbol in ('==', '!=')):
+            return WBool(relations[symbol](left.value, right.value))
+        elif kind == WInt:
+            if symbol == '/':
+                return WInt(int_divide(left.value, right.value))
+            elif symbol in arithmetic:
+                return WInt(arithmetic[symbol](left.value, right.value))
+            raise RuntimeError(f'unsupported integer operator {symbol} on node {node}')
+        elif kind == WFloat:
+            if symbol == '/':
+                return WFloat(left.value / right.value)
+            elif symbol in arithmetic:
+                return WFloat(arithmetic[symbol](left.value, right.value))
+            raise RuntimeError(f'unsupported float operator {symbol} on node {node}')
+        raise RuntimeError(f'unsupported operator {symbol} on node {node}')
+
+    def visit_Grouping(self, node, environ):
+        return self.visit(node.value, environ)
+
+    def visit_FunctionCall(self, node, environ):
+        if node.name.text in conversions:
+            (arg,) = node.arguments
+            return self.convert(node.name.text, self.visit(arg, environ))
+        site = self.call_sites.get(id(node))
+        if site is None:
+            site = self._call_site(node, environ)
+        func = site[0]
+        frames = func.frames
+        func_env = frames.pop() if frames else WEnvironment(func.frame_size, func.globals)
+        # The parameters are the first slots.  Whatever else an earlier call
+        # left in the frame is declared again before it is read.
+        slots = func_env.slots
+        visit = self.visit
+        for slot, arg in enumerate(node.arguments):
+            slots[slot] = visit(arg, environ)
+        try:
+            if func.memo is not None:
+                return self._memoized_call(func, func_env, len(node.arguments))
+            # The body runs here rather than through visit_Statements
+            for statement in func.body.statements:
+                status = visit(statement, func_env)
+                if status is not VOID:
+                    if type(status) is WReturn:
+                        return status.value
+                    # A break or continue with no loop around it
+                    check_completed(status)
+        finally:
+            frames.append(func_env)
+
+    def memo_key(self, value):
+        # With the type, since 1 == 1.0 == True in Python
+        return type(value), value.value
+
+    def _memoized_call(self, func, func_env, arity):
+        key = (func.name.slot, *map(self.memo_key, func_env.slots[:arity]))
+        result = func.memo.get(key, _MISSING)
+        if result is not _MISSING:
+            return result
+        status = self.visit(func.body, func_env)
+        if type(status) is WReturn:
+            result = status.value
+        else:
+            check_completed(status)
+            result = None
+        func.memo[key] = result
+        return result
+
+    def _call_site(self, node, environ):
+        """
+        Look up the function a call site calls and check the number of
+        arguments, once: only a function's declaration writes its global,
+        and declaring a function again forgets every call site.
+        """
+        func = self.visit(node.name, environ)
+        if not isinstance(func, WFunc):
+            raise RuntimeError(f'{node.name.text} is not a function')
+        if len(node.arguments) != len(func.parameters):
+            raise RuntimeError(
+                f'{node.name.text} takes {len(func.parameters)} arguments, '
+                f'{len(node.arguments)} given'
+            )
+        # The node is kept so that its id is not reused
+        site = self.call_sites[id(node)] = (func, node)
+        return site
+
+    def visit_LocalName(self, node, environ):
+        return environ.slots[node.slot]
+
+    def visit_GlobalName(self, node, environ):
+        return environ.globals[node.slot]
+
+    # Statements
+
+    def visit_Assignment(self, node, environ):
+        val = self.visit(node.rhs, environ)
+        environ.store(node.lhs, val)
+        return VOID
+
+    def visit_PrintStatement(self, node, environ):
+        val = self.visit(node.value, environ)
         if type(val) in {WFloat, WInt}:
-            print(val.value)
+            self.out.write(f'{val.value}\n')
         elif type(val) == WBool:
-            print('true' if val.value else 'false')
+            self.out.write('true\n' if val.value else 'false\n')
         elif type(val) == WChar:
-            print(val.value, end='')
-        return WVoid()
-    elif isinstance(node, VarDeclaration):
+            self.out.write(val.value)
+        return VOID
+
+    def visit_VarDeclaration(self, node, environ):
         # what if there is no value?
         if node.value:
-            val = interpret(node.value, environ)
+            val = self.visit(node.value, environ)
         else:
             val = None
-        environ.define(node.name.text, val)
-        return WVoid()
-    elif isinstance(node, ConstDeclaration):
+        environ.store(node.name, val)
+        return VOID
+
+    def visit_ConstDeclaration(self, node, environ):
         if node.value:
-            val = interpret_expression(node.value, environ)
+            val = self.visit(node.value, environ)
         else:
             val = None
-        environ.define(node.name.text, val)
-        return WVoid()
-    elif isinstance(node, IfStatement):
-        test = interpret_expression(node.test, environ)
-        if test.value:
-            interpret(node.consequence, environ)
-        else:
-            interpret(node.alternative, environ)
-    elif isinstance(node, WhileStatement):
+        environ.store(node.name, val)
+        return VOID
+
+    def visit_IfStatement(self, node, environ):
+        test = self.visit(node.test, environ)
+        if self.truth(test):
+            return self.visit(node.consequence, environ)
+        return self.visit(node.alternative, environ)
+
+    def visit_WhileStatement(self, node, environ):
         while True:
-            testval = interpret_expression(node.test, environ)
-            if not testval.value:
-                break
-            try:
-                interpret(node.body, environ)
-            except WBreak:
+            testval = self.visit(node.test, environ)
+            if not self.truth(testval):
                 break
-            except WContinue:
-                pass
-    elif isinstance(node, BreakStatement):
-        raise WBreak()
-    elif isinstance(node, ContinueStatement):
-        raise WContinue()
-    elif isinstance(node, FuncDeclaration):
+            status = self.visit(node.body, environ)
+            if status is not VOID:
+                if status is BREAK:
+                    break
+                elif status is not CONTINUE:
+                    return status
+        return VOID
+
+    def visit_BreakStatement(self, node, environ):
+        return BREAK
+
+    def visit_ContinueStatement(self, node, environ):
+        return CONTINUE
+
+    def visit_FuncDeclaration(self, node, environ):
         return_type = interpret_type(node.return_type, environ)
         parameters = [p.name for p in node.parameters]
-        environ.define(node.name.text, WFunc(node.name, parameters, return_type, node.body))
-    elif isinstance(node, ReturnStatement):
-        value = interpret_expression(node.value, environ)
-        raise WReturn(value)
-    elif isinstance(node, Statements):
-        return_val = WVoid
+        func = WFunc(
+            node.name, parameters, return_type, node.body, node.frame_size, environ.globals
+        )
+        if node.name.slot in self.pure:
+            func.memo = self.memo
+        if environ.load(node.name) is not None:
+            # A redeclaration: call sites may hold the old function
+            self.call_sites.clear()
+        environ.store(node.name, func)
+        return VOID
+
+    def visit_ReturnStatement(self, node, environ):
+        return WReturn(self.visit(node.value, environ))
+
+    def visit_ExpressionStatement(self, node, environ):
+        self.visit(node.value, environ)
+        return VOID
+
+    def visit_Statements(self, node, environ):
         for statement in node.statements:
-            return_val = interpret(statement, environ)
-        return return_val
-    else:
-        raise RuntimeError(f'Interpreter failure: unexpected statement type on node: {node}')
+            status = self.visit(statement, environ)
+            if status is not VOID:
+                return status
+        return VOID
+
+
+class NativeInterpreter(Interpreter):
+    """
+    An Interpreter whose values are plain Python ints, floats, bools and
+    one-character strs instead of WInt, WFloat, WBool and WChar, so that
+    no operation allocates a wrapper just for the next one to unwrap it.
+    The types need no tag: a literal's decoded value already has the
+    Python type of its Wabbit type, and the operations keep it.  Only
+    interpret_wabbit() boxes the final result.
+    """
+
+    def truth(self, value):
+        return value
+
+    def memo_key(self, value):
+        return type(value), value
+
+    def convert(self, typename, value):
+        return conversions[typename](value)
+
+    def visit_Integer(self, node, environ):
+        return node.decoded
+
+    visit_Float = visit_Bool = visit_Char = visit_Integer
+
+    def visit_Unary(self, node, environ):
+        value = self.visit(node.operand, environ)
+        match node.op.symbol:
+            case '-':
+                return -value
+            case '+':
+                return value
+            case '!':
+                return not value
+
+    def _binary(self, node, left, right):
+        symbol = node.op.symbol
+        if symbol in relations:
+            return relations[symbol](left, right)
+        elif symbol == '/':
+            # type(), not isinstance(): a bool is an int to Python
+            if type(left) is int:
+                return int_divide(left, right)
+            return left / right
+        elif symbol in arithmetic:
+            return arithmetic[symbol](left, right)
+        raise RuntimeError(f'unsupported operator {symbol} on node {node}')
+
+    def visit_PrintStatement(self, node, environ):
+        self.out.write(format_value(self.visit(node.value, environ)))
+        return VOID
+
+
+class BudgetedInterpreter(Interpreter):
+    """
+    An Interpreter that counts a step for every loop iteration and every
+    call, and the calls and variables in progress, against a Budget.
+    """
+
+    def __init__(self, budget, *args):
+        super().__init__(*args)
+        self.budget = budget
+        self.stats = budget.stats = BudgetStats()
+        # The step at which the step limit and the clock are checked next
+        self.next_check = 0
+        self.start = perf_counter()
+        self.deadline = None
+
+    def run(self, node, environ):
+        self.start = perf_counter()
+        if self.budget.seconds is not None:
+            self.deadline = self.start + self.budget.seconds
+        self._check_steps()
+        self._add_slots(len(environ.slots))
+        try:
+            return self.visit(node, environ)
+        finally:
+            self.stats.elapsed = perf_counter() - self.start
+
+    def _check_steps(self):
+        stats = self.stats
+        budget = self.budget
+        if budget.steps is not None and stats.steps > budget.steps:
+            raise self._exceeded('steps', budget.steps)
+        if self.deadline is not None and perf_counter() > self.deadline:
+            raise self._exceeded('seconds', budget.seconds)
+        self.next_check = stats.steps + CHECK_INTERVAL
+        if budget.steps is not None:
+            self.next_check = min(self.next_check, budget.steps + 1)
+
+    def _add_slots(self, count):
+        stats = self.stats
+        stats.slots += count
+        if stats.slots > stats.max_slots:
+            stats.max_slots = stats.slots
+            if self.budget.slots is not None and stats.slots > self.budget.slots:
+                raise self._exceeded('slots', self.budget.slots)
+
+    def _exceeded(self, limit, allowed):
+        self.stats.elapsed = perf_counter() - self.start
+        return BudgetExceeded(limit, allowed, self.stats.copy())
+
+    def visit_WhileStatement(self, node, environ):
+        stats = self.stats
+        while True:
+            testval = self.visit(node.test, environ)
+            if not self.truth(testval):
+                break
+            stats.steps += 1
+            if stats.steps >= self.next_check:
+                self._check_steps()
+            status = self.visit(node.body, environ)
+            if status is not VOID:
+                if status is BREAK:
+                    break
+                elif status is not CONTINUE:
+                    return status
+        return VOID
+
+    def visit_FunctionCall(self, node, environ):
+        if node.name.text in conversions:
+            return super().visit_FunctionCall(node, environ)
+        stats = self.stats
+        stats.steps += 1
+        if stats.steps >= self.next_check:
+            self._check_steps()
+        stats.calls += 1
+        site = self.call_sites.get(id(node))
+        if site is None:
+            site = self._call_site(node, environ)
+        size = site[0].frame_size
+        stats.depth += 1
+        try:
+            if stats.depth > stats.max_depth:
+                stats.max_depth = stats.depth
+            self._add_slots(size)
+            if self.budget.depth is not None and stats.depth > self.budget.depth:
+                raise self._exceeded('depth', self.budget.depth)
+            return super().visit_FunctionCall(node, environ)
+        finally:
+            stats.depth -= 1
+            stats.slots -= size
+
+
+class BudgetedNativeInterpreter(BudgetedInterpreter, NativeInterpreter):
+    pass
+
+
+class ProfilingInterpreter(Profiling, Interpreter):
+    pass
+
+
+class ProfilingNativeInterpreter(Profiling, NativeInterpreter):
+    pass
+
+
+def interpret(node: Node) -> WType:
+    """
+    Interpret a program, statement or expression on its own.  Its names are
+    resolved first and it runs with globals of its own.  Returns what the
+    node evaluates to: a WType for an expression, how it completed for a
+    statement.
+    """
+    resolution = resolve(node)
+    environ = WEnvironment(len(resolution.globals))
+    return Interpreter().visit(resolution.tree, environ)
 
 
 typemap = {
@@ -0,0 +1,415 @@
+# machine.py
+#
+# A third execution engine, which never recurses.  assemble() turns a
+# resolved tree into code for a stack machine: a list of (opcode, argument)
+# pairs, with jumps for control flow.  run() executes it in one loop, with
+# the operands on a value stack and, for every Wabbit call in progress, the
+# code, position and frame to go back to on a call stack.  Both are Python
+# lists, so the depth of Wabbit calls and the nesting of expressions are
+# limited by memory and max_depth, not by Python's recursion limit.
+#
+# The assembler doesn't recurse either: visit methods schedule the parts
+# of a node on a work list instead of visiting them, as nodes to assemble,
+# instructions to emit and labels to place.  Function bodies are
+# assembled on their own, one level down.
+#
+# Values are native, as in NativeInterpreter and closures.py.
+from interpret import (
+    WType,
+    WVoid,
+    arithmetic,
+    box,
+    conversions,
+    int_divide,
+    format_value,
+    is_chained,
+    relations,
+)
+from model import *
+from output import OutputSink, StreamSink
+from resolve import LocalName, resolve
+from visitor import NodeVisitor
+
+# Deepest Wabbit call stack allowed by default
+MAX_DEPTH = 100_000
+
+# Opcodes
+LOAD_LOCAL = 0  # push frame[slot]
+LOAD_GLOBAL = 1  # push globals[slot]
+CONST = 2  # push value
+BINARY = 3  # pop b, a; push function(a, b)
+STORE_LOCAL = 4  # pop into frame[slot]
+STORE_GLOBAL = 5  # pop into globals[slot]
+JUMP_IF_FALSE = 6  # pop; jump to position if false
+JUMP = 7  # jump to position
+CALL = 8  # (count, name): call the function under count arguments
+RETURN = 9  # return the value on top of the stack
+DIVIDE = 10  # pop b, a; push a / b, truncated for ints
+JUMP_IF_FALSE_OR_POP = 11  # for &&: jump if false, keeping it, or pop
+JUMP_IF_TRUE_OR_POP = 12  # for ||
+CHAIN_TEST = 13  # one relation of a < b < c; see visit_BinOp
+NEGATE = 14
+NOT = 15
+CONVERT = 16  # pop; push function(value)
+PRINT = 17
+POP = 18
+HALT = 19
+FAIL = 20  # raise RuntimeError(message)
+
+opnames = {
+    globals()[name]: name
+    for name in """
+        LOAD_LOCAL LOAD_GLOBAL CONST BINARY STORE_LOCAL STORE_GLOBAL
+        JUMP_IF_FALSE JUMP CALL RETURN DIVIDE JUMP_IF_FALSE_OR_POP
+        JUMP_IF_TRUE_OR_POP CHAIN_TEST NEGATE NOT CONVERT PRINT POP HALT FAIL
+    """.split()
+}
+
+
+class CallDepthError(RuntimeError):
+    def __init__(self, depth):
+        super().__init__(f"Wabbit calls nested deeper than {depth}")
+        self.depth = depth
+
+
+class Label:
+    """A position in the code, known once the assembler gets to it."""
+
+    __slots__ = ("position",)
+
+    def __init__(self):
+        self.position = None
+
+
+class _Loop:
+    """Where break and continue go inside a while loop."""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+
+_END_LOOP = object()
+
+
+class MachineFunction:
+    __slots__ = ("name", "arity", "padding", "code")
+
+    def __init__(self, name, arity, frame_size, code):
+        self.name = name
+        self.arity = arity
+        # Appended to the arguments to make up a frame
+        self.padding = [None] * (frame_size - arity)
+        self.code = code
+
+
+class Assembler(NodeVisitor):
+    def assemble(self, node, end=((HALT, None),)):
+        """The code for a resolved node, followed by the instructions end."""
+        self.code = []
+        self.loops = []
+        self.work = [node]
+        while self.work:
+            item = self.work.pop()
+            if type(item) is tuple:
+                self.code.append(item)
+            elif type(item) is Label:
+                item.position = len(self.code)
+            elif type(item) is _Loop:
+                self.loops.append(item)
+            elif item is _END_LOOP:
+                self.loops.pop()
+            else:
+                self.visit(item)
+        self.code.extend(end)
+        return [
+            (op, arg.position if type(arg) is Label else arg) for op, arg in self.code
+        ]
+
+    def then(self, *items):
+        """Schedule items to be assembled next, in order.  None is skipped."""
+        self.work.extend(item for item in reversed(items) if item is not None)
+
+    def generic_visit(self, node):
+        raise RuntimeError(f"Can't assemble node: {node}")
+
+    def _store(self, name):
+        return (STORE_LOCAL if type(name) is LocalName else STORE_GLOBAL), name.slot
+
+    # Expressions
+
+    def visit_Integer(self, node):
+        self.then((CONST, node.decoded))
+
+    visit_Float = visit_Bool = visit_Char = visit_Integer
+
+    def visit_LocalName(self, node):
+        self.then((LOAD_LOCAL, node.slot))
+
+    def visit_GlobalName(self, node):
+        self.then((LOAD_GLOBAL, node.slot))
+
+    def visit_Grouping(self, node):
+        self.then(node.value)
+
+    def visit_Unary(self, node):
+        symbol = node.op.symbol
+        if symbol == '-':
+            self.then(node.operand, (NEGATE, None))
+        elif symbol == '+':
+            self.then(node.operand)
+        elif symbol == '!':
+            self.then(node.operand, (NOT, None))
+        else:
+            raise RuntimeError(f'unsupported unary operator {symbol} on node {node}')
+
+    def visit_BinOp(self, node):
+        symbol = node.op.symbol
+        if symbol == '&&':
+            end = Label()
+            self.then(node.lhs, (JUMP_IF_FALSE_OR_POP, end), node.rhs, end)
+        elif symbol == '||':
+            end = Label()
+            self.then(node.lhs, (JUMP_IF_TRUE_OR_POP, end), node.rhs, end)
+        elif is_chained(node):
+            self._chain(node)
+        elif symbol == '/':
+            self.then(node.lhs, node.rhs, (DIVIDE, None))
+        elif symbol in arithmetic:
+            self.then(node.lhs, node.rhs, (BINARY, arithmetic[symbol]))
+        elif symbol in relations:
+            self.then(node.lhs, node.rhs, (BINARY, relations[symbol]))
+        else:
+            raise RuntimeError(f'unsupported operator {symbol} on node {node}')
+
+    def _chain(self, node):
+        # a < b < c: operands [a, b, c] and tests [<, <].  Every test but
+        # the last leaves its right operand for the next one if it passes
+        # and False, which ends the chain, if it fails.
+        tests = []
+        operands = []
+        while is_chained(node):
+            tests.append(relations[node.op.symbol])
+            operands.append(node.rhs)
+            node = node.lhs
+        tests.append(relations[node.op.symbol])
+        operands.extend([node.rhs, node.lhs])
+        tests.reverse()
+        operands.reverse()
+        end = Label()
+        items = [operands[0]]
+        for test, operand in zip(tests[:-1], operands[1:-1]):
+            items += [operand, (CHAIN_TEST, test), (JUMP_IF_FALSE_OR_POP, end)]
+        items += [operands[-1], (BINARY, tests[-1]), end]
+        self.then(*items)
+
+    def visit_FunctionCall(self, node):
+        name = node.name.text
+        if name in conversions:
+            (arg,) = node.arguments
+            self.then(arg, (CONVERT, conversions[name]))
+        else:
+            self.then(node.name, *node.arguments, (CALL, (len(node.arguments), name)))
+
+    # Statements
+
+    def visit_Statements(self, node):
+        self.then(*node.statements)
+
+    def visit_PrintStatement(self, node):
+        self.then(node.value, (PRINT, None))
+
+    def _declare(self, node):
+        value = node.value if node.value else (CONST, None)
+        self.then(value, self._store(node.name))
+
+    visit_VarDeclaration = visit_ConstDeclaration = _declare
+
+    def visit_Assignment(self, node):
+        self.then(node.rhs, self._store(node.lhs))
+
+    def visit_ExpressionStatement(self, node):
+        self.then(node.value, (POP, None))
+
+    def visit_IfStatement(self, node):
+        alternative = Label()
+        end = Label()
+        self.then(
+            node.test,
+            (JUMP_IF_FALSE, alternative),
+            node.consequence,
+            (JUMP, end),
+            alternative,
+            node.alternative,
+            end,
+        )
+
+    def visit_WhileStatement(self, node):
+        start = Label()
+        end = Label()
+        self.then(
+            start,
+            node.test,
+            (JUMP_IF_FALSE, end),
+            _Loop(start, end),
+            node.body,
+            _END_LOOP,
+            (JUMP, start),
+            end,
+        )
+
+    # Outside a loop, break and continue fail when they run, as they do
+    # on the other engines, with check_completed()'s message
+
+    def visit_BreakStatement(self, node):
+        if self.loops:
+            self.then((JUMP, self.loops[-1].end))
+        else:
+            self.then((FAIL, f'{node} outside a loop'))
+
+    def visit_ContinueStatement(self, node):
+        if self.loops:
+            self.then((JUMP, self.loops[-1].start))
+        else:
+            self.then((FAIL, f'{node} outside a loop'))
+
+    def visit_ReturnStatement(self, node):
+        self.then(node.value, (RETURN, None))
+
+    def visit_FuncDeclaration(self, node):
+        # A function that runs off its end returns nothing
+        code = Assembler().assemble(node.body, end=((CONST, None), (RETURN, None)))
+        function = MachineFunction(
+            node.name.text, len(node.parameters), node.frame_size, code
+        )
+        self.then((CONST, function), self._store(node.name))
+
+
+def run(code, globals_, out, max_depth=MAX_DEPTH):
+    """Run top-level code to its HALT and return the value left on the stack."""
+    write = out.write
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    # (code, position, frame) to return to, for every call in progress
+    calls = []
+    # The top-level code keeps its variables in the globals
+    frame = globals_
+    pc = 0
+    while True:
+        op, arg = code[pc]
+        pc += 1
+        if op == LOAD_LOCAL:
+            push(frame[arg])
+        elif op == LOAD_GLOBAL:
+            push(globals_[arg])
+        elif op == CONST:
+            push(arg)
+        elif op == BINARY:
+            b = pop()
+            stack[-1] = arg(stack[-1], b)
+        elif op == STORE_LOCAL:
+            frame[arg] = pop()
+        elif op == STORE_GLOBAL:
+            globals_[arg] = pop()
+        elif op == JUMP_IF_FALSE:
+            if not pop():
+                pc = arg
+        elif op == JUMP:
+            pc = arg
+        elif op == CALL:
+            arg, name = arg
+            function = stack[-arg - 1]
+            if type(function) is not MachineFunction:
+                raise RuntimeError(f'{name} is not a function')
+            if arg != function.arity:
+                raise RuntimeError(f'{name} takes {function.arity} arguments, {arg} given')
+            if len(calls) >= max_depth:
+                raise CallDepthError(max_depth)
+            calls.append((code, pc, frame))
+            frame = stack[len(stack) - arg :]
+            frame += function.padding
+            del stack[len(stack) - arg - 1 :]
+            code = function.code
+            pc = 0
+        elif op == RETURN:
+            # The return value stays on the stack for the caller
+            if not calls:
+                raise RuntimeError('return outside a function')
+            code, pc, frame = calls.pop()
+        elif op == DIVIDE:
+            b = pop()
+            a = stack[-1]
+            stack[-1] = int_divide(a, b) if type(a) is int else a / b
+        elif op == JUMP_IF_FALSE_OR_POP:
+            if stack[-1]:
+                pop()
+            else:
+                pc = arg
+        elif op == JUMP_IF_TRUE_OR_POP:
+            if stack[-1]:
+                pc = arg
+            else:
+                pop()
+        elif op == CHAIN_TEST:
+            b = pop()
+            if arg(stack[-1], b):
+                stack[-1] = b
+                push(True)
+            else:
+                stack[-1] = False
+        elif op == NEGATE:
+            stack[-1] = -stack[-1]
+        elif op == NOT:
+            stack[-1] = not stack[-1]
+        elif op == CONVERT:
+            stack[-1] = arg(stack[-1])
+        elif op == PRINT:
+            write(format_value(pop()))
+        elif op == POP:
+            pop()
+        elif op == HALT:
+            return stack[-1] if stack else None
+        elif op == FAIL:
+            raise RuntimeError(arg)
+        else:
+            raise RuntimeError(f'bad opcode {op}')
+
+
+def disassemble(code):
+    """The code as text, one instruction per line."""
+    lines = []
+    for position, (op, arg) in enumerate(code):
+        if type(arg) is MachineFunction:
+            arg = f'<function {arg.name}>'
+        elif callable(arg):
+            arg = getattr(arg, '__name__', arg)
+        lines.append(f'{position:5} {opnames[op]:22} {"" if arg is None else arg}')
+    return '\n'.join(lines)
+
+
+class MachineProgram:
+    """
+    The stack machine code for a tree.  run() executes it against a fresh
+    set of globals and returns what interpret_wabbit() would.
+    """
+
+    def __init__(self, node: Node, max_depth=MAX_DEPTH):
+        resolution = resolve(node)
+        self.globals_size = len(resolution.globals)
+        self.code = Assembler().assemble(resolution.tree)
+        self.expression = isinstance(node, Expression)
+        self.max_depth = max_depth
+
+    def run(self, out: OutputSink | None = None) -> WType:
+        out = StreamSink() if out is None else out
+        with out:
+            result = run(self.code, [None] * self.globals_size, out, self.max_depth)
+        return box(result) if self.expression else WVoid()
+
+
+def execute_machine(
+    node: Node, max_depth=MAX_DEPTH, out: OutputSink | None = None
+) -> WType:
+    """Like interpret_wabbit(), on the stack machine."""
+    return MachineProgram(node, max_depth).run(out)
@@ -1,82 +1,148 @@
 # model.py
-from dataclasses import dataclass
+import dataclasses
+import math
+import os
+from ast import literal_eval
+from dataclasses import dataclass, field
 
 
 # Defines the data structures that represent the different program
 # elements (literals, expressions, statements, loops, etc.)
+#
+# Nodes use __slots__ rather than a per-instance __dict__, which matters for
+# big generated programs.  With WABBIT_FROZEN_NODES=1 in the environment
+# they are also immutable (and hashable when their fields are).  It is read
+# once, when this module is imported, so all the nodes in a process are of
+# one kind.  Frozen nodes take about twice as long to build, since every
+# field is set through object.__setattr__.  The __weakref__ slot lets
+# hashcons.py keep nodes in a weak table.
+FROZEN_NODES = os.environ.get("WABBIT_FROZEN_NODES", "0") != "0"
+
+_node = dataclass(slots=True, weakref_slot=True, frozen=FROZEN_NODES)
 
 
 class Node:
-    pass
+    __slots__ = ()
 
 
 class Expression(Node):
-    pass
+    __slots__ = ()
 
 
 class Statement(Node):
-    pass
+    __slots__ = ()
 
 
 class Declaration(Statement):
-    pass
+    __slots__ = ()
 
 
 class Type(Node):
-    pass
+    __slots__ = ()
 
 
-@dataclass
+@_node
 class Typename(Type):
     text: str
 
 
-@dataclass
+@_node
 class Statements(Node):
     statements: list[Statement]
 
 
-@dataclass
+@_node
 class Name(Expression):
     text: str
 
 
-@dataclass
+@_node
 class Parameter(Expression):
     type: str
 
 
-@dataclass
+# Literals keep their source text in value, for the formatter, and the
+# decoded Python value in decoded.  Decoding happens when the node is made,
+# so a literal is converted and range checked once and not every time it is
+# evaluated.  A bad literal raises ValueError.
+#
+# An Integer may hold INT_MAX + 1, since that is how INT_MIN is written:
+# -2147483648 is a minus applied to 2147483648.  The parser rejects the
+# literal anywhere else.
+INT_MIN = -(2**31)
+INT_MAX = 2**31 - 1
+
+
+def _decoded():
+    return field(init=False, repr=False, compare=False)
+
+
+def _set_decoded(node, value):
+    # object.__setattr__ so that it works on frozen nodes too
+    object.__setattr__(node, "decoded", value)
+
+
+@_node
 class Integer(Expression):
     value: str
+    decoded: int = _decoded()
 
+    def __post_init__(self):
+        value = int(self.value)
+        if not INT_MIN <= value <= INT_MAX + 1:
+            raise ValueError(f"Integer {self.value} out of range")
+        _set_decoded(self, value)
 
-@dataclass
+
+@_node
 class Float(Expression):
     value: str
+    decoded: float = _decoded()
+
+    def __post_init__(self):
+        value = float(self.value)
+        if math.isinf(value):
+            raise ValueError(f"Float {self.value} out of range")
+        _set_decoded(self, value)
 
 
-@dataclass
+@_node
 class Bool(Expression):
     value: str
+    decoded: bool = _decoded()
+
+    def __post_init__(self):
+        if self.value not in ("true", "false"):
+            raise ValueError(f"Bad bool {self.value!r}")
+        _set_decoded(self, self.value == "true")
+
+
+@_node
+class Char(Expression):
+    value: str
+    decoded: str = _decoded()
 
+    def __post_init__(self):
+        # Escapes in character literals follow Python's
+        _set_decoded(self, literal_eval(self.value))
 
-@dataclass
+
+@_node
 class BreakStatement(Statement):
     pass
 
 
-@dataclass
+@_node
 class ContinueStatement(Statement):
     pass
 
 
-@dataclass
+@_node
 class PrintStatement(Statement):
     value: Expression
 
 
-@dataclass
+@_node
 class Function(Node):
     name: Name
     parameters: list[Parameter]
@@ -84,75 +150,75 @@ class Function(Node):
     body: Statements
 
 
-@dataclass
+@_node
 class Op(Node):
     symbol: str
 
 
-@dataclass
+@_node
 class BinOp(Expression):
     op: Op
     lhs: Expression
     rhs: Expression
 
 
-@dataclass
+@_node
 class Unary(Expression):
     op: Op
     operand: Expression
 
 
-@dataclass
+@_node
 class FunctionCall(Expression):
     name: Expression
     arguments: list[Expression]
 
 
-@dataclass
+@_node
 class Grouping(Expression):
     value: Expression
 
 
-@dataclass
+@_node
 class ConstDeclaration(Declaration):
     name: Name
     type: Type | None
     value: Expression | None
 
 
-@dataclass
+@_node
 class VarDeclaration(Declaration):
     name: Name
     type: Type | None
     value: Expression | None
 
 
-@dataclass
+@_node
 class Assignment(Statement):
     lhs: Name
     rhs: Expression
 
 
-@dataclass
+@_node
 class IfStatement(Statement):
     test: Expression
     consequence: Statements
     alternative: Statements | None
 
 
-@dataclass
+@_node
 class WhileStatement(Statement):
     test: Expression
     body: Statements
 
 
-@dataclass
+@_node
 class Parameter(Declaration):
     name: Name
     type: Type
 
 
-@dataclass
+@_node
 class FuncDeclaration(Declaration):
     name: Name
     parameters: list[Parameter]
@@ -160,6 +226,48 @@ class FuncDeclaration(Declaration):
     body: Statements
 
 
-@dataclass
+@_node
 class ReturnStatement(Statement):
     value: Expression
+
+
+@_node
+class ExpressionStatement(Statement):
+    value: Expression
+
+
+def node_fields(cls):
+    """The fields of a node class that are passed to its constructor."""
+    return [f for f in dataclasses.fields(cls) if f.init]
+
+
+# Node classes by type code, for the compact encodings in astcache.py and
+# flatast.py.  Only append to this list.
+node_classes = [
+    Typename,
+    Statements,
+    Name,
+    Parameter,
+    Integer,
+    Float,
+    Bool,
+    Char,
+    BreakStatement,
+    ContinueStatement,
+    PrintStatement,
+    Function,
+    Op,
+    BinOp,
+    Unary,
+    FunctionCall,
+    Grouping,
+    ConstDeclaration,
+    VarDeclaration,
+    Assignment,
+    IfStatement,
+    WhileStatement,
+    FuncDeclaration,
+    ReturnStatement,
+    ExpressionStatement,
+]
+node_codes = {cls: code for code, cls in enumerate(node_classes)}
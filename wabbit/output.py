@@ -0,0 +1,96 @@
+# output.py
+#
+# Where the print statements of a running program write.  Every engine
+# takes an out= sink and writes the text of each print to it; without one
+# it writes straight to sys.stdout, as print() does.
+#
+#     StreamSink    each print goes to the stream as it happens
+#     BufferedSink  prints are collected and written in large pieces, when
+#                   enough text has built up or, with lines=True, at the
+#                   end of every line
+#     CaptureSink   prints are kept in memory, for tests
+#     NullSink      prints are thrown away, for benchmarks
+#
+# A sink is a context manager that flushes on exit.  The engines run
+# programs inside one, so what a program printed is written out when it
+# finishes, and also when it fails.
+import sys
+from abc import ABC, abstractmethod
+
+
+class OutputSink(ABC):
+    @abstractmethod
+    def write(self, text: str):
+        ...
+
+    def flush(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+class StreamSink(OutputSink):
+    """Writes to stream, or to whatever sys.stdout is at the time."""
+
+    def __init__(self, stream=None):
+        self._stream = stream
+
+    @property
+    def stream(self):
+        return sys.stdout if self._stream is None else self._stream
+
+    def write(self, text):
+        self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class BufferedSink(StreamSink):
+    def __init__(self, stream=None, size=8192, lines=False):
+        super().__init__(stream)
+        self.size = size
+        self.lines = lines
+        self.parts = []
+        self.buffered = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.size or (self.lines and '\n' in text):
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.stream.write(''.join(self.parts))
+            self.parts.clear()
+            self.buffered = 0
+        self.stream.flush()
+
+
+class CaptureSink(OutputSink):
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def getvalue(self) -> str:
+        return ''.join(self.parts)
+
+
+class NullSink(OutputSink):
+    def write(self, text):
+        pass
+
+
+sinks = {
+    'stdout': StreamSink,
+    'buffered': BufferedSink,
+    'lines': lambda: BufferedSink(lines=True),
+    'null': NullSink,
+}
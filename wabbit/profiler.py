@@ -0,0 +1,232 @@
+# profiler.py
+#
+# Where a Wabbit program spends its time.  Pass a Profile to
+# interpret_wabbit() and the program runs on a profiling subclass of the
+# interpreter, which counts every node it executes and times it:
+#
+#     lines = IdentityCache()
+#     tree = parse_file("fib.wb", lines=lines)
+#     profile = Profile(lines, source)
+#     interpret_wabbit(tree, profile=profile)
+#     print(profile.report())
+#     profile.write_collapsed("fib.collapsed")
+#
+# Times are self times: a node's time leaves out the nodes below it, and a
+# function's self time leaves out the functions it calls, so that times add
+# up.  Nodes get the line of the statement they are part of, as recorded by
+# the parser.  Each declaration of a function is counted on its own; when a
+# name is declared more than once, its line is added to the name.
+#
+# The collapsed file has one line per call stack, "<program>;run;fib 1234",
+# with the microseconds spent in the innermost function of that stack, as
+# flamegraph.pl and speedscope read it.
+#
+# Without a Profile, interpret_wabbit() runs the plain interpreter, which
+# has none of this code in it.
+import collections
+from time import perf_counter
+
+from model import *
+from resolve import CONVERSIONS
+from visitor import NodeVisitor
+
+PROGRAM = "<program>"
+
+
+class FunctionStats:
+    __slots__ = ("name", "line", "calls", "total", "self_time")
+
+    def __init__(self, name, line):
+        self.name = name
+        self.line = line
+        self.calls = 0
+        # Time in calls to the function, counting recursive calls once
+        self.total = 0.0
+        # Time in its own body, not in the functions it calls
+        self.self_time = 0.0
+
+
+class Profile:
+    def __init__(self, lines=None, source=None):
+        """
+        lines is the IdentityCache of lines that the parser filled in, and
+        source the program's text, to quote lines in the report.
+        """
+        self.parsed_lines = lines
+        self.source_lines = source.splitlines() if source is not None else None
+        # id of each node run -> [node, line, count, self time]
+        self.nodes = {}
+        # By the id of the function's body, which is its own for each
+        # declaration, and PROGRAM for the top-level code
+        self.functions = {PROGRAM: FunctionStats(PROGRAM, None)}
+        # Microseconds of self time per call stack, as "a;b;c"
+        self.stacks = collections.Counter()
+        self.elapsed = 0.0
+
+    def bind(self, original: Node, resolved: Node):
+        """
+        Give the nodes of the resolved tree the lines of the nodes they
+        came from.  Resolution keeps the shape of the tree, so the two are
+        walked side by side; a node without a line of its own takes its
+        parent's.
+        """
+        declared = []
+        stack = [(original, resolved, None)]
+        while stack:
+            old, new, line = stack.pop()
+            if self.parsed_lines is not None:
+                line = self.parsed_lines.get(old, line)
+            self.nodes[id(new)] = [new, line, 0, 0.0]
+            if isinstance(new, FuncDeclaration):
+                stats = self.functions[id(new.body)] = FunctionStats(new.name.text, line)
+                declared.append(stats)
+            for f in node_fields(type(old)):
+                before = getattr(old, f.name)
+                after = getattr(new, f.name)
+                if isinstance(before, list):
+                    pairs = zip(before, after)
+                else:
+                    pairs = [(before, after)]
+                for child, new_child in pairs:
+                    if isinstance(child, Node):
+                        stack.append((child, new_child, line))
+        names = collections.Counter(f.name for f in declared)
+        for f in declared:
+            if names[f.name] > 1:
+                f.name = f"{f.name}:{f.line}"
+
+    def report(self, top=20) -> str:
+        """The functions, and the lines and nodes taking the most time."""
+        out = [f"Profile: {self.elapsed:.3f}s"]
+        out.append("")
+        out.append(f"  {'calls':>9} {'total':>9} {'self':>9}  {'line':>5}  function")
+        functions = sorted(self.functions.values(), key=lambda f: -f.self_time)
+        for f in functions:
+            line = "" if f.line is None else f.line
+            out.append(
+                f"  {f.calls:9} {f.total:8.3f}s {f.self_time:8.3f}s  {line:>5}  {f.name}"
+            )
+
+        lines = {}
+        for node, line, count, self_time in self.nodes.values():
+            if count and line is not None:
+                entry = lines.setdefault(line, [0, 0.0])
+                entry[0] = max(entry[0], count)
+                entry[1] += self_time
+        total = sum(self_time for _, self_time in lines.values()) or 1.0
+        out.append("")
+        out.append(f"  {'line':>5} {'count':>9} {'self':>9} {'%':>6}  source")
+        for line, (count, self_time) in sorted(lines.items(), key=lambda i: -i[1][1])[:top]:
+            text = ""
+            if self.source_lines is not None:
+                text = self.source_lines[line - 1].strip()
+            out.append(
+                f"  {line:>5} {count:9} {self_time:8.3f}s "
+                f"{100 * self_time / total:5.1f}%  {text}"
+            )
+
+        out.append("")
+        out.append(f"  {'line':>5} {'count':>9} {'self':>9}  node")
+        nodes = sorted(self.nodes.values(), key=lambda n: -n[3])[:top]
+        for node, line, count, self_time in nodes:
+            out.append(
+                f"  {'?' if line is None else line:>5} {count:9} {self_time:8.3f}s  "
+                f"{_describe(node)}"
+            )
+        return "\n".join(out) + "\n"
+
+    def write_report(self, filename, top=20):
+        with open(filename, "w") as file:
+            file.write(self.report(top))
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {round(micros)}\n"
+            for stack, micros in sorted(self.stacks.items())
+            if round(micros)
+        )
+
+    def write_collapsed(self, filename):
+        with open(filename, "w") as file:
+            file.write(self.collapsed())
+
+
+def _describe(node):
+    name = type(node).__name__
+    if isinstance(node, BinOp):
+        return f"{name} {node.op.symbol}"
+    elif isinstance(node, FunctionCall):
+        return f"{name} {node.name.text}"
+    return name
+
+
+class Profiling:
+    """
+    Mixed in ahead of an interpreter class, times every visit and every
+    call.  Only interpret_wabbit() puts it in, when given a Profile.
+    """
+
+    def __init__(self, profile, *args):
+        super().__init__(*args)
+        self.profile = profile
+        # Time spent in the children of each visit in progress
+        self.child_times = [0.0]
+        # [name, start, time in callees] for each call in progress
+        self.call_stack = []
+        self.active = collections.Counter()
+
+    def run(self, node, environ):
+        self._enter(PROGRAM)
+        start = perf_counter()
+        try:
+            return self.visit(node, environ)
+        finally:
+            self._leave()
+            self.profile.elapsed += perf_counter() - start
+
+    def visit(self, node, *args):
+        child_times = self.child_times
+        child_times.append(0.0)
+        start = perf_counter()
+        try:
+            return NodeVisitor.visit(self, node, *args)
+        finally:
+            elapsed = perf_counter() - start
+            children = child_times.pop()
+            child_times[-1] += elapsed
+            stats = self.profile.nodes.get(id(node))
+            if stats is not None:
+                stats[2] += 1
+                stats[3] += elapsed - children
+
+    def visit_FunctionCall(self, node, environ):
+        if node.name.text in CONVERSIONS:
+            return super().visit_FunctionCall(node, environ)
+        key = id(getattr(environ.load(node.name), "body", None))
+        if key not in self.profile.functions:
+            # Not a function; the call fails
+            return super().visit_FunctionCall(node, environ)
+        self._enter(key)
+        try:
+            return super().visit_FunctionCall(node, environ)
+        finally:
+            self._leave()
+
+    def _enter(self, key):
+        self.call_stack.append([key, perf_counter(), 0.0])
+        self.active[key] += 1
+
+    def _leave(self):
+        key, start, callees = self.call_stack.pop()
+        elapsed = perf_counter() - start
+        self.active[key] -= 1
+        functions = self.profile.functions
+        stats = functions[key]
+        stats.calls += 1
+        stats.self_time += elapsed - callees
+        if not self.active[key]:
+            stats.total += elapsed
+        stack = ";".join([functions[call[0]].name for call in self.call_stack] + [stats.name])
+        self.profile.stacks[stack] += (elapsed - callees) * 1e6
+        if self.call_stack:
+            self.call_stack[-1][2] += elapsed
@@ -0,0 +1,114 @@
+# purity.py
+#
+# Memoization of pure functions.  A function is pure when what it returns
+# depends only on its arguments and calling it does nothing else: its body
+# reads and writes only its parameters and locals, prints nothing, and
+# calls only conversions and other pure functions.  Calling such a function
+# twice with the same arguments can return the first result again, which
+# turns the exponential recursion of a function like fib into a linear one.
+#
+# pure_functions() finds them in a resolved tree.  A ResultCache holds
+# their results, least recently used first, up to a fixed number.
+from collections import OrderedDict
+
+from model import *
+from resolve import GlobalName
+from visitor import NodeVisitor
+
+
+class _BodyChecker(NodeVisitor):
+    """Walks one function body, noting what makes it impure."""
+
+    def __init__(self, functions):
+        self.functions = functions
+        self.pure = True
+        self.callees = set()
+
+    def visit_PrintStatement(self, node):
+        self.pure = False
+
+    def visit_GlobalName(self, node):
+        # Reading or writing a variable outside the function
+        if node.slot not in self.functions:
+            self.pure = False
+
+    def visit_FunctionCall(self, node):
+        if type(node.name) is GlobalName and node.name.slot in self.functions:
+            self.callees.add(node.name.slot)
+        self.generic_visit(node)
+
+
+def pure_functions(tree: Node) -> set[int]:
+    """
+    The global slots of the pure top-level functions of a resolved tree.
+    A slot declared more than once holds different functions at different
+    times, so it is never counted as pure.
+    """
+    statements = tree.statements if isinstance(tree, Statements) else [tree]
+    declarations = [s for s in statements if isinstance(s, FuncDeclaration)]
+    slots = [d.name.slot for d in declarations]
+    functions = set(slots)
+    redeclared = {slot for slot in functions if slots.count(slot) > 1}
+    callees = {}
+    pure = set()
+    for declaration in declarations:
+        checker = _BodyChecker(functions)
+        checker.visit(declaration.body)
+        if checker.pure and declaration.name.slot not in redeclared:
+            pure.add(declaration.name.slot)
+            callees[declaration.name.slot] = checker.callees
+    # A function that calls an impure one is impure too
+    changed = True
+    while changed:
+        changed = False
+        for slot in list(pure):
+            if not callees[slot] <= pure:
+                pure.discard(slot)
+                changed = True
+    return pure
+
+
+class ResultCache:
+    """
+    Results of calls to pure functions, keyed by the function's global slot
+    and its arguments.  interpret_wabbit() clears it at the start of each
+    run, since slots mean something else in another program.  Holds at
+    most maxsize results, dropping the least recently used one to make
+    room.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.clear()
+
+    def clear(self):
+        """Drop every result and reset the counters."""
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def report(self):
+        return (
+            f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions; "
+            f"{len(self.entries)} of {self.maxsize} entries"
+        )
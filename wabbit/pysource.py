@@ -0,0 +1,495 @@
+# pysource.py
+#
+# An execution engine that compiles ahead of time.  python_source()
+# translates a tree into the text of a Python module, which is compiled
+# with compile() and run with exec(), so that the program runs as CPython
+# bytecode: every Wabbit function becomes a Python function, while and if
+# become Python's own, and variables become Python variables.  For
+# 22_fib.wb:
+#
+#     LAST_g1 = None
+#     fib_g0 = _Undeclared('fib')
+#
+#     def fib_g0d1(n_0):
+#         if n_0 < 2:
+#             return 1
+#         else:
+#             return fib_g0(n_0 - 1) + fib_g0(n_0 - 2)
+#         return 0
+#     ...
+#     def _main():
+#         global LAST_g1, fib_g0
+#         fib_g0 = fib_g0d1
+#         LAST_g1 = 30
+#         run_g2 = run_g2d1
+#         run_g2()
+#
+# Variables are named after the slots resolve() gave them, "n_0" for a
+# local and "LAST_g1" for a global, so that names which shadow each other
+# in Wabbit are different names in Python.  Top-level code is the body of
+# _main(), where the globals that no function uses are Python locals; the
+# others start out as None, as in the walker.  Each declaration of a
+# function is a def of its own, f_g0d1, f_g0d2 and so on, and _main()
+# assigns it to f_g0 where it is declared, so calling a function before
+# its declaration has run fails.
+# The generated module refers to a few helpers, such as _write for print
+# and _int_divide, which run() passes in; the text itself depends on
+# nothing but the tree, so it can be cached (see cached_python_source()).
+#
+# Values are plain Python ints, floats, bools and one-character strs, as in
+# closures.py, and types are worked out the same way, to pick what / and
+# print become; where a type is not known they are checked at run time.
+# && and || are Python's and and or, which only evaluate their right side
+# when they need it, and a < b < c is Python's chained comparison, with b
+# evaluated once.
+import collections
+import hashlib
+import math
+import os
+from types import FunctionType
+
+from astcache import encode_tree
+from interpret import (
+    WType,
+    WVoid,
+    arithmetic,
+    box,
+    conversions,
+    format_value,
+    int_divide,
+    is_chained,
+    relations,
+)
+from model import *
+from output import OutputSink, StreamSink
+from resolve import GlobalName, LocalName, resolve
+from visitor import NodeVisitor
+
+# Bump when the generated code changes, to invalidate cached sources
+GENERATOR_VERSION = 3
+
+DEFAULT_CACHE_DIR = ".wabbit_cache"
+
+# Python's operator precedences, from or (lowest) to atoms.  An operand
+# with a lower precedence than its operator needs parentheses.
+OR, AND, NOT, COMPARISON, SUM, PRODUCT, SIGN, ATOM = range(8)
+
+_precedences = {'+': SUM, '-': SUM, '*': PRODUCT, '/': PRODUCT, '&&': AND, '||': OR}
+_python_ops = {'&&': 'and', '||': 'or'}
+
+
+def _divide(a, b):
+    if type(a) is int:
+        return int_divide(a, b)
+    return a / b
+
+
+class _Undeclared:
+    """What a function's variable holds until its declaration runs."""
+
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, *args):
+        raise RuntimeError(f'{self.name} is not a function')
+
+
+def _fail(message):
+    raise RuntimeError(message)
+
+
+def _checked_call(function, name, *args):
+    """
+    A call whose function is only known at run time, checked as
+    Interpreter._call_site() checks it.
+    """
+    if type(function) is not FunctionType:
+        raise RuntimeError(f'{name} is not a function')
+    arity = function.__code__.co_argcount
+    if arity != len(args):
+        raise RuntimeError(f'{name} takes {arity} arguments, {len(args)} given')
+    return function(*args)
+
+
+# What the generated code refers to besides its own functions and variables
+_helpers = {
+    '_int_divide': int_divide,
+    '_divide': _divide,
+    '_format': format_value,
+    '_Undeclared': _Undeclared,
+    '_fail': _fail,
+    '_checked_call': _checked_call,
+    **{f'_{name}': convert for name, convert in conversions.items()},
+}
+
+
+class _SharedGlobals(NodeVisitor):
+    """Collects the globals that functions use, by variable name."""
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.names = {}
+
+    def visit_GlobalName(self, node):
+        self.names[self.generator.variable(node)] = node
+
+
+def _parenthesize(operand, precedence):
+    text, _, operand_precedence = operand
+    return f'({text})' if operand_precedence < precedence else text
+
+
+class PythonGenerator(NodeVisitor):
+    """
+    Expressions generate (text, type, precedence), where type is a Wabbit
+    type name or None if unknown; statements append lines to self.lines.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.indent = 0
+        # Types of the variables in each slot, and return types of the
+        # functions in global slots
+        self.global_types = {}
+        self.local_types = {}
+        self.return_types = {}
+        # Globals that the function being generated assigns to, and those
+        # that any function uses
+        self.assigned = set()
+        self.shared = set()
+        # Loops around the statement being generated, and whether it is in
+        # a function rather than the top-level code
+        self.loops = 0
+        self.in_function = False
+        # How many times each global slot is declared as a function, and
+        # how many of those declarations have been generated so far
+        self.declarations = collections.Counter()
+        self.declared = collections.Counter()
+        # The numbers of parameters of the functions in each global slot
+        self.arities = collections.defaultdict(set)
+
+    def generic_visit(self, node):
+        raise RuntimeError(f"Can't generate Python for node: {node}")
+
+    def emit(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def block(self, node):
+        self.indent += 1
+        start = len(self.lines)
+        self.visit(node)
+        if len(self.lines) == start:
+            self.emit('pass')
+        self.indent -= 1
+
+    def types_for(self, name):
+        return self.local_types if type(name) is LocalName else self.global_types
+
+    def variable(self, name):
+        if type(name) is LocalName:
+            return f'{name.text}_{name.slot}'
+        return f'{name.text}_g{name.slot}'
+
+    def function(self, name, parameters, body, in_function=True):
+        """Generate def name(parameters): with body, declaring its globals."""
+        outer = self.lines, self.indent, self.assigned, self.loops, self.in_function
+        self.lines, self.indent, self.assigned = [], 0, set()
+        self.loops, self.in_function = 0, in_function
+        try:
+            self.block(body)
+            lines = self.lines
+            if self.assigned:
+                lines.insert(0, '    global ' + ', '.join(sorted(self.assigned)))
+        finally:
+            self.lines, self.indent, self.assigned, self.loops, self.in_function = outer
+        return [f"def {name}({', '.join(parameters)}):", *lines, '']
+
+    # Expressions
+
+    def visit_Integer(self, node):
+        return repr(node.decoded), 'int', ATOM
+
+    def visit_Float(self, node):
+        value = node.decoded
+        if math.isfinite(value):
+            return repr(value), 'float', ATOM
+        # repr() gives inf or nan, which are not Python literals
+        return f"_float('{value}')", 'float', ATOM
+
+    def visit_Bool(self, node):
+        return repr(node.decoded), 'bool', ATOM
+
+    def visit_Char(self, node):
+        return repr(node.decoded), 'char', ATOM
+
+    def visit_LocalName(self, node):
+        return self.variable(node), self.local_types.get(node.slot), ATOM
+
+    def visit_GlobalName(self, node):
+        return self.variable(node), self.global_types.get(node.slot), ATOM
+
+    def visit_Grouping(self, node):
+        return self.visit(node.value)
+
+    def visit_Unary(self, node):
+        operand = self.visit(node.operand)
+        symbol = node.op.symbol
+        if symbol in ('-', '+'):
+            return f'{symbol}{_parenthesize(operand, SIGN)}', operand[1], SIGN
+        elif symbol == '!':
+            return f'not {_parenthesize(operand, NOT)}', 'bool', NOT
+        raise RuntimeError(f'unsupported unary operator {symbol} on node {node}')
+
+    def visit_BinOp(self, node):
+        symbol = node.op.symbol
+        if symbol in relations:
+            return self._comparison(node), 'bool', COMPARISON
+        left = self.visit(node.lhs)
+        right = self.visit(node.rhs)
+        type = left[1] or right[1]
+        if symbol == '/' and type != 'float':
+            # Integer division truncates, where Python's // floors
+            divide = '_int_divide' if type == 'int' else '_divide'
+            return f'{divide}({left[0]}, {right[0]})', type, ATOM
+        precedence = _precedences[symbol]
+        if symbol not in arithmetic and symbol != '/':
+            type = 'bool'
+        # Left associative: an equal precedence on the right needs parentheses
+        text = (
+            f'{_parenthesize(left, precedence)} {_python_ops.get(symbol, symbol)} '
+            f'{_parenthesize(right, precedence + 1)}'
+        )
+        return text, type, precedence
+
+    def _comparison(self, node):
+        # a < b < c: flatten to operands [a, b, c] and symbols [<, <], for
+        # Python's own chaining.  A comparison in any other position needs
+        # parentheses, or Python would chain it too.
+        symbols = []
+        operands = []
+        while is_chained(node):
+            symbols.append(node.op.symbol)
+            operands.append(self.visit(node.rhs))
+            node = node.lhs
+        symbols.append(node.op.symbol)
+        operands.append(self.visit(node.rhs))
+        operands.append(self.visit(node.lhs))
+        parts = [_parenthesize(operands.pop(), COMPARISON + 1)]
+        for symbol in reversed(symbols):
+            parts.append(symbol)
+            parts.append(_parenthesize(operands.pop(), COMPARISON + 1))
+        return ' '.join(parts)
+
+    def visit_FunctionCall(self, node):
+        name = node.name.text
+        args = ', '.join(self.visit(arg)[0] for arg in node.arguments)
+        if name in conversions:
+            return f'_{name}({args})', name, ATOM
+        function = self.visit(node.name)[0]
+        arities = self.arities.get(node.name.slot) if type(node.name) is not LocalName else None
+        if not arities or len(arities) > 1:
+            # Not a function's own variable, or its declarations differ
+            return f"_checked_call({', '.join([function, repr(name), args])})", None, ATOM
+        (arity,) = arities
+        if arity != len(node.arguments):
+            message = f'{name} takes {arity} arguments, {len(node.arguments)} given'
+            return f'_fail({message!r})', None, ATOM
+        return f'{function}({args})', self.return_types.get(node.name.slot), ATOM
+
+    # Statements
+
+    def visit_PrintStatement(self, node):
+        value, type, _ = self.visit(node.value)
+        expression = node.value
+        while isinstance(expression, Grouping):
+            expression = expression.value
+        if isinstance(expression, (LocalName, GlobalName)) or (
+            isinstance(expression, FunctionCall) and expression.name.text not in conversions
+        ):
+            # A variable or a call can hold None whatever its type, and
+            # _format() prints nothing for it
+            type = None
+        if type in ('int', 'float'):
+            self.emit(f"_write(str({value}) + '\\n')")
+        elif type == 'bool':
+            self.emit(f"_write('true\\n' if {value} else 'false\\n')")
+        elif type == 'char':
+            self.emit(f'_write({value})')
+        else:
+            self.emit(f'_write(_format({value}))')
+
+    def _store(self, name, value):
+        if type(name) is not LocalName and self.variable(name) in self.shared:
+            self.assigned.add(self.variable(name))
+        self.emit(f'{self.variable(name)} = {value}')
+
+    def _declare(self, node):
+        if node.value:
+            value, type, _ = self.visit(node.value)
+            if node.type:
+                type = node.type.text
+        else:
+            # Its type is unknown while it holds None, which prints nothing
+            value, type = 'None', None
+        self.types_for(node.name)[node.name.slot] = type
+        self._store(node.name, value)
+
+    visit_VarDeclaration = visit_ConstDeclaration = _declare
+
+    def visit_Assignment(self, node):
+        self._store(node.lhs, self.visit(node.rhs)[0])
+
+    def visit_ExpressionStatement(self, node):
+        self.emit(self.visit(node.value)[0])
+
+    def visit_IfStatement(self, node):
+        self.emit(f'if {self.visit(node.test)[0]}:')
+        self.block(node.consequence)
+        if node.alternative is not None:
+            self.emit('else:')
+            self.block(node.alternative)
+
+    def visit_WhileStatement(self, node):
+        self.emit(f'while {self.visit(node.test)[0]}:')
+        self.loops += 1
+        self.block(node.body)
+        self.loops -= 1
+
+    # A break, continue or return with nothing to leave raises the error
+    # check_completed() raises for the other engines, when it runs
+
+    def visit_BreakStatement(self, node):
+        if self.loops:
+            self.emit('break')
+        else:
+            self.emit(f"raise RuntimeError('{node} outside a loop')")
+
+    def visit_ContinueStatement(self, node):
+        if self.loops:
+            self.emit('continue')
+        else:
+            self.emit(f"raise RuntimeError('{node} outside a loop')")
+
+    def visit_ReturnStatement(self, node):
+        value = self.visit(node.value)[0]
+        if self.in_function:
+            self.emit(f'return {value}')
+        else:
+            self.emit(value)
+            self.emit("raise RuntimeError('return outside a function')")
+
+    def visit_FuncDeclaration(self, node):
+        # The def goes ahead of _main(), which assigns it where it is declared
+        slot = node.name.slot
+        name = self.variable(node.name)
+        statements = node.body.statements
+        if self.declarations[slot] > 1:
+            # Which function the slot holds depends on when it is called
+            self.return_types[slot] = None
+        elif statements and isinstance(statements[-1], ReturnStatement):
+            self.return_types[slot] = node.return_type.text
+        else:
+            # It may run off its end, returning None, which prints as nothing
+            self.return_types[slot] = None
+        self.local_types = {p.name.slot: p.type.text for p in node.parameters}
+        parameters = [self.variable(p.name) for p in node.parameters]
+        self.declared[slot] += 1
+        function = f'{name}d{self.declared[slot]}'
+        self._store(node.name, function)
+        self.functions.extend(self.function(function, parameters, node.body))
+
+    def visit_Statements(self, node):
+        for statement in node.statements:
+            self.visit(statement)
+
+    def generate(self, tree) -> str:
+        """The module for a resolved tree."""
+        self.functions = []
+        # Globals that no function uses are locals of _main(), which
+        # Python reads and writes faster
+        shared = _SharedGlobals(self)
+        for statement in tree.statements if isinstance(tree, Statements) else []:
+            if isinstance(statement, FuncDeclaration):
+                shared.visit(statement.body)
+                self.declarations[statement.name.slot] += 1
+                self.arities[statement.name.slot].add(len(statement.parameters))
+        self.shared = set(shared.names)
+        start = []
+        for variable, name in sorted(shared.names.items()):
+            if self.declarations[name.slot]:
+                start.append(f'{variable} = _Undeclared({name.text!r})')
+            else:
+                start.append(f'{variable} = None')
+        if start:
+            start.append('')
+        if isinstance(tree, Expression):
+            main = ['def _main():', f'    return {self.visit(tree)[0]}', '']
+        else:
+            main = self.function('_main', [], tree, in_function=False)
+        return '\n'.join(start + self.functions + main)
+
+
+def python_source(node: Node) -> str:
+    """The Python module for a program."""
+    return PythonGenerator().generate(resolve(node).tree)
+
+
+def source_key(node: Node) -> str:
+    digest = hashlib.sha256(f'{GENERATOR_VERSION}\0'.encode())
+    digest.update(encode_tree(node))
+    return digest.hexdigest()
+
+
+def cached_python_source(node: Node, cache_dir=DEFAULT_CACHE_DIR) -> tuple[str, str]:
+    """
+    The Python module for a program and the file it is cached in, which
+    is generated and stored there unless an earlier call did so.
+    """
+    path = os.path.join(cache_dir, source_key(node) + '.py')
+    try:
+        with open(path) as file:
+            return file.read(), path
+    except OSError:
+        pass
+    source = python_source(node)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp = f'{path}.{os.getpid()}.tmp'
+    with open(temp, 'w') as file:
+        file.write(source)
+    os.replace(temp, path)
+    return source, path
+
+
+class PythonProgram:
+    """
+    A program compiled to Python bytecode.  run() executes it in a fresh
+    namespace and returns what interpret_wabbit() would.  With a cache_dir,
+    the generated source is kept there and reused.
+    """
+
+    def __init__(self, node: Node, out: OutputSink | None = None, cache_dir=None):
+        if cache_dir is None:
+            self.source, filename = python_source(node), '<wabbit>'
+        else:
+            self.source, filename = cached_python_source(node, cache_dir)
+        self.code = compile(self.source, filename, 'exec')
+        self.out = StreamSink() if out is None else out
+        self.expression = isinstance(node, Expression)
+
+    def run(self) -> WType:
+        namespace = dict(_helpers, _write=self.out.write)
+        exec(self.code, namespace)
+        with self.out:
+            result = namespace['_main']()
+        return box(result) if self.expression else WVoid()
+
+
+def compile_python(node: Node, out: OutputSink | None = None, cache_dir=None) -> PythonProgram:
+    return PythonProgram(node, out, cache_dir)
+
+
+def execute_python(node: Node, out: OutputSink | None = None, cache_dir=None) -> WType:
+    """Like interpret_wabbit(), as Python bytecode."""
+    return compile_python(node, out, cache_dir).run()
@@ -0,0 +1,224 @@
+# resolve.py
+#
+# Name resolution.  resolve() works out, once and before the program runs,
+# which variable every name refers to, following the scoping rules of the
+# spec (section 6): globals are visible everywhere, function parameters and
+# locals only in their function, and a variable declared in a block only
+# in that block.
+#
+# Every variable gets a slot, either in the list of globals or in the frame
+# (a list too) of its function, and every use of a name is replaced by a
+# LocalName or GlobalName holding that slot.  The engines then read and
+# write variables by index, without hashing names.  A variable declared in
+# a block gets a slot of its own in the enclosing frame, so blocks need no
+# frames of their own.  Blocks in top-level code take their slots from the
+# globals.
+#
+# Names that are never declared are reported here, statically, with a
+# ResolveError, as are globals that top-level code uses before their
+# declaration.  Functions may use globals declared after them, since they
+# only run once called.
+#
+# Expressions are resolved on their flat form (see flatast.py), so that
+# long chains such as 1 + 2 + ... + n don't recurse.
+from dataclasses import dataclass, replace
+
+from flatast import flatten
+from model import *
+from model import _node
+from visitor import NodeTransformer
+
+# Type conversions are called like functions but are not variables
+CONVERSIONS = ("int", "float", "char", "bool")
+
+
+@_node
+class LocalName(Expression):
+    text: str
+    slot: int
+
+
+@_node
+class GlobalName(Expression):
+    text: str
+    slot: int
+
+
+@_node
+class ResolvedFuncDeclaration(FuncDeclaration):
+    """A FuncDeclaration with the size of the frame its calls need."""
+
+    frame_size: int
+
+
+@dataclass
+class Resolution:
+    tree: Node
+    # Name of the variable in each global slot
+    globals: list[str]
+
+
+class ResolveError(Exception):
+    def __init__(self, errors):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+class Scope:
+    def __init__(self, parent=None):
+        self.names = {}
+        self.parent = parent
+
+    def lookup(self, name):
+        scope = self
+        while scope is not None:
+            if name in scope.names:
+                return scope.names[name]
+            scope = scope.parent
+        return None
+
+
+class Frame:
+    """Slot allocation for the globals or for one function."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.names = []
+
+    def allocate(self, name):
+        self.names.append(name)
+        return self.kind(name, len(self.names) - 1)
+
+
+class Resolver(NodeTransformer):
+    def __init__(self):
+        self.globals = Frame(GlobalName)
+        self.global_scope = Scope()
+        self.frame = self.globals
+        self.scope = self.global_scope
+        self.errors = []
+        # Global slots of the functions.  Nothing else may write to them,
+        # so a call can keep the function it finds there.
+        self.functions = set()
+        # Global slots whose top-level declaration hasn't been reached yet
+        self.undeclared = set()
+
+    def declare(self, name):
+        """The slot for a declaration of name in the current scope."""
+        # A second declaration in the same scope reuses the variable
+        if name.text not in self.scope.names:
+            self.scope.names[name.text] = self.frame.allocate(name.text)
+        return self.scope.names[name.text]
+
+    def lookup(self, name):
+        address = self.scope.lookup(name.text)
+        if address is None:
+            self.errors.append(f"Undefined name: {name.text}")
+            return name
+        if self.frame is self.globals and address.slot in self.undeclared:
+            self.errors.append(f"Name used before its declaration: {name.text}")
+        # A copy, so that no two uses of a name share a node
+        return replace(address)
+
+    def resolve(self, tree):
+        # Globals declared anywhere at the top level are visible
+        # everywhere, including in functions declared before them
+        statements = tree.statements if isinstance(tree, Statements) else [tree]
+        for statement in statements:
+            if isinstance(statement, (VarDeclaration, ConstDeclaration)):
+                self.declare(statement.name)
+            elif isinstance(statement, FuncDeclaration):
+                self.functions.add(self.declare(statement.name).slot)
+        self.undeclared = set(range(len(self.globals.names)))
+        if isinstance(tree, Statements):
+            tree = replace(tree, statements=[self.visit(s) for s in tree.statements])
+        else:
+            tree = self.visit(tree)
+        if self.errors:
+            raise ResolveError(self.errors)
+        return Resolution(tree, self.globals.names)
+
+    def visit_Name(self, node):
+        return self.lookup(node)
+
+    def visit_Expression(self, node):
+        return flatten(node).to_tree(make=self._make_resolved)
+
+    def _make_resolved(self, cls, *fields):
+        """make() for FlatTree.to_tree(), resolving the names among fields."""
+        if cls is Name:
+            # Resolved by the node that holds it
+            return cls(*fields)
+        values = []
+        for n, value in enumerate(fields):
+            if type(value) is list:
+                value = [self.lookup(v) if type(v) is Name else v for v in value]
+            elif type(value) is Name:
+                # The name of a conversion is not a variable
+                if not (cls is FunctionCall and value.text in CONVERSIONS):
+                    value = self.lookup(value)
+            values.append(value)
+        return cls(*values)
+
+    def visit_Statements(self, node):
+        # A nested block
+        outer = self.scope
+        self.scope = Scope(outer)
+        try:
+            return self.generic_visit(node)
+        finally:
+            self.scope = outer
+
+    def check_writable(self, address):
+        if type(address) is GlobalName and address.slot in self.functions:
+            self.errors.append(f"Can't assign to function {address.text}")
+
+    def _visit_declaration(self, node):
+        value = self.visit(node.value)
+        address = self.declare(node.name)
+        self.check_writable(address)
+        if self.scope is self.global_scope:
+            self.undeclared.discard(address.slot)
+        return replace(node, name=address, value=value)
+
+    visit_VarDeclaration = visit_ConstDeclaration = _visit_declaration
+
+    def visit_Assignment(self, node):
+        rhs = self.visit(node.rhs)
+        lhs = self.lookup(node.lhs)
+        self.check_writable(lhs)
+        return replace(node, lhs=lhs, rhs=rhs)
+
+    def visit_FuncDeclaration(self, node):
+        if self.scope is not self.global_scope:
+            self.errors.append(
+                f"Function {node.name.text} must be declared at the top level"
+            )
+            return node
+        self.frame = Frame(LocalName)
+        self.scope = Scope(self.global_scope)
+        # Parameters take the first slots of the frame, in order
+        names = [p.name.text for p in node.parameters]
+        for name in sorted({n for n in names if names.count(n) > 1}):
+            self.errors.append(f"Duplicate parameter {name} in function {node.name.text}")
+        try:
+            parameters = [
+                replace(p, name=self.declare(p.name)) for p in node.parameters
+            ]
+            body = replace(
+                node.body, statements=[self.visit(s) for s in node.body.statements]
+            )
+            frame_size = len(self.frame.names)
+        finally:
+            self.frame = self.globals
+            self.scope = self.global_scope
+        address = self.declare(node.name)
+        self.undeclared.discard(address.slot)
+        return ResolvedFuncDeclaration(
+            address, parameters, node.return_type, body, frame_size
+        )
+
+
+def resolve(tree: Node) -> Resolution:
+    """Resolve the names in tree.  Raises ResolveError for undefined names."""
+    return Resolver().resolve(tree)
@@ -0,0 +1,146 @@
+# run.py
+#
+# Run Wabbit programs on any of the execution engines:
+#
+#     python run.py [-e engine] [-o sink] [-p prefix] file.wb ...
+#
+# Every engine takes a tree and an optional output sink (see output.py)
+# and behaves like interpret_wabbit().  With -p, each program is profiled
+# (see profiler.py) and the report and collapsed stacks are written to
+# prefix.txt and prefix.collapsed.  Given several files, each program's
+# are written to prefix-name.txt and prefix-name.collapsed, after the
+# name of its file.
+import os
+from functools import partial
+
+from closures import execute_wabbit
+from cparser import parse_file, parse_source
+from hashcons import IdentityCache
+from interpret import interpret_wabbit
+from machine import execute_machine
+from output import CaptureSink, sinks
+from profiler import Profile
+from purity import ResultCache
+from pysource import execute_python
+from resolve import ResolveError
+
+engines = {
+    "interpret": interpret_wabbit,
+    "native": partial(interpret_wabbit, native=True),
+    # Memoizes pure functions; see purity.py
+    "memo": lambda tree, out=None: interpret_wabbit(
+        tree, native=True, memo=ResultCache(), out=out
+    ),
+    "closures": execute_wabbit,
+    "machine": execute_machine,
+    # Compiled to Python bytecode; see pysource.py
+    "python": execute_python,
+}
+
+
+# The engines that can profile
+profiling_engines = {"interpret": False, "native": True}
+
+
+def run_file(filename, engine="interpret", out=None):
+    return engines[engine](parse_file(filename), out=out)
+
+
+def profile_file(filename, engine="interpret", out=None) -> Profile:
+    with open(filename) as file:
+        source = file.read()
+    lines = IdentityCache()
+    tree = parse_source(source, lines)
+    profile = Profile(lines, source)
+    interpret_wabbit(tree, native=profiling_engines[engine], out=out, profile=profile)
+    return profile
+
+
+def test_engines():
+    def run(source):
+        """What each engine prints, and the error it stops with."""
+        results = {}
+        for name, engine in engines.items():
+            out = CaptureSink()
+            try:
+                engine(parse_source(source), out=out)
+                error = None
+            except (RuntimeError, ResolveError) as e:
+                error = f"{type(e).__name__}: {e}"
+            results[name] = (out.getvalue(), error)
+        return results
+
+    def agree(source, output, error=None):
+        results = run(source)
+        for name, result in results.items():
+            assert result == (output, error), (source, name, result)
+
+    # Arity
+    agree("func f(a int) int { return a; } print f(1);", "1\n")
+    agree(
+        "func f(a int) int { return a; } print 1; print f(1, 2);",
+        "1\n",
+        "RuntimeError: f takes 1 arguments, 2 given",
+    )
+    agree(
+        "func f(a int) int { return a; } print f();",
+        "",
+        "RuntimeError: f takes 1 arguments, 0 given",
+    )
+    agree("var x int = 1; print x(2);", "", "RuntimeError: x is not a function")
+
+    # A break or continue can't leave a function body
+    agree(
+        "func f(x int) int { break; } print 1; print f(1);",
+        "1\n",
+        "RuntimeError: BreakStatement() outside a loop",
+    )
+    agree(
+        "func f(x int) int { if x > 0 { continue; } return 2; } print f(0); print f(1);",
+        "2\n",
+        "RuntimeError: ContinueStatement() outside a loop",
+    )
+
+    # Nothing is printed for an uninitialized variable, or a function
+    # that returned nothing
+    agree("var x int; print x; var c char; print c; var b bool; print b;", "")
+    agree("func f() int { if false { return 1; } } print f(); print 2;", "2\n")
+
+    # Use before declaration
+    agree("print x; var x = 1;", "", "ResolveError: Name used before its declaration: x")
+    agree(
+        "print g(); func g() int { return 2; }",
+        "",
+        "ResolveError: Name used before its declaration: g",
+    )
+    agree("func f() int { return y; } print f(); var y = 1; print f();", "1\n")
+    agree(
+        "func f() int { return g(); } print f(); func g() int { return 2; }",
+        "",
+        "RuntimeError: g is not a function",
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run Wabbit programs")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-e", "--engine", choices=list(engines), default="interpret")
+    parser.add_argument("-o", "--output", choices=list(sinks), default="buffered")
+    parser.add_argument("-p", "--profile", metavar="PREFIX")
+    args = parser.parse_args()
+    if args.profile and args.engine not in profiling_engines:
+        parser.error(f"can only profile on {', '.join(profiling_engines)}")
+    out = sinks[args.output]()
+    for filename in args.files:
+        if args.profile:
+            profile = profile_file(filename, args.engine, out)
+            prefix = args.profile
+            if len(args.files) > 1:
+                name = os.path.splitext(os.path.basename(filename))[0]
+                prefix = f"{prefix}-{name}"
+            profile.write_report(f"{prefix}.txt")
+            profile.write_collapsed(f"{prefix}.collapsed")
+        else:
+            run_file(filename, args.engine, out)
@@ -1,4 +1,14 @@
 # tokenizer.py
+import bisect
+import io
+import itertools
+import os
+import re
+from array import array
+
+# Bump whenever the token stream for some source could change, so that
+# cached token streams (see batch.py) are invalidated.
+TOKENIZER_VERSION = 2
 
 
 class Token:
@@ -58,6 +68,14 @@ keywords = {
     "false": "FALSE",
 }
 
+# Character literals, with the escapes Python allows for a single character
+_char_literal = re.compile(r"""'(?:[^'\\\n]|\\[\\'"abfnrtv0]|\\x[0-9A-Fa-f]{2})'""")
+
+# How far past its end a token's text may have been examined to decide it
+# ("'\x4" is only found to be ILLEGAL at the sixth character).  Incremental
+# re-tokenization rescans tokens this close to an edit.
+_LOOKAHEAD = 5
+
 
 def tokenize_file(filename: str) -> list[Token]:
     with open(filename) as file:
@@ -90,6 +108,7 @@ def tokenize(source) -> list[Token]:
                 continue
             else:
                 tokens.append(Token("UNTERMCOMMENT", source[start:], lineno, start))
+                break
         elif source[n : n + 2] == "//":
             end = source.find("\n", n)
             if end > 0:
@@ -100,7 +119,7 @@ def tokenize(source) -> list[Token]:
         # Recognize name
         elif source[n].isalpha() or source[n] == "_":
             start = n
-            while n < len(source) and (source[n].isalpha() or source[n] == "_"):
+            while n < len(source) and (source[n].isalnum() or source[n] == "_"):
                 n += 1
             name = source[start:n]
             if name in keywords:
@@ -113,8 +132,8 @@ def tokenize(source) -> list[Token]:
             start = n
             while n < len(source) and source[n].isdigit():
                 n += 1
-            # Floats
-            # TODO check if the float is in range
+            # Floats.  Range checks happen once the value is decoded, in
+            # the literal nodes of model.py.
             if n < len(source) and source[n] == ".":
                 n += 1
                 while n < len(source) and source[n].isdigit():
@@ -135,6 +154,11 @@ def tokenize(source) -> list[Token]:
             else:
                 tokens.append(Token("FLOAT", value, lineno, start))
 
+        # Character literal such as 'a' or '\n'
+        elif source[n] == "'" and (m := _char_literal.match(source, n)):
+            tokens.append(Token("CHAR", m.group(), lineno, n))
+            n = m.end()
+
         elif source[n : n + 2] in literals:
             tokens.append(
                 Token(literals[source[n : n + 2]], source[n : n + 2], lineno, n)
@@ -151,6 +175,313 @@ def tokenize(source) -> list[Token]:
     return tokens
 
 
+# Master pattern for tokenize_regex().  Every alternative is built from the
+# tables above or from the character classes the loop in tokenize() tests, so
+# the two engines agree token for token on ASCII source.
+_space = "".join(chr(c) for c in range(128) if chr(c).isspace())
+_literal_pattern = "|".join(
+    re.escape(lit) for lit in sorted(literals, key=len, reverse=True)
+)
+_master = re.compile(
+    rf"(?P<SKIP>[{re.escape(_space)}]+|/\*(?:/|.*?\*/)|//[^\n]*)"
+    r"|(?P<UNTERMCOMMENT>/\*)"
+    r"|(?P<NAME>[A-Za-z_][A-Za-z0-9_]*)"
+    r"|(?P<NUMBER>[0-9]+(?:\.[0-9]*)?|\.[0-9]*)"
+    rf"|(?P<LITERAL>{_literal_pattern})"
+    rf"|(?P<CHAR>{_char_literal.pattern})"
+    r"|(?P<ILLEGAL>.)",
+    re.DOTALL,
+)
+
+
+def tokenize_regex(source) -> list[Token]:
+    """Parse source string into list of tokens using one compiled pattern.
+
+    Produces exactly the same tokens as tokenize().  Non-ASCII source is
+    handed to tokenize() since str.isalpha()/isdigit() accept far more
+    characters than a regex character class can cheaply express.
+    """
+    if not source.isascii():
+        return tokenize(source)
+    return [
+        Token(toktype, source[start:end], lineno, start)
+        for toktype, start, end, lineno in _spans(source)
+    ]
+
+
+def _spans(source, lineno=1, final=True, pos=0):
+    """
+    Generate (toktype, start, end, lineno) for the tokens of an ASCII
+    source, found with the master pattern.  start and end are offsets in
+    source.
+
+    Scanning starts at source[pos], which must be a point where a new token
+    may start, and lineno is the line number there.
+
+    When final is False, source is only a prefix of the program: scanning
+    stops at the first match that text past the end could still change (a
+    name or number running into the end, an unclosed comment, a lone quote,
+    ...) and the offset and line number of that match are returned so the
+    caller can rescan from there once more text is available.
+    """
+    count = source.count
+    size = len(source)
+    last = pos
+    for m in _master.finditer(source, pos):
+        kind = m.lastgroup
+        if not final and (size - m.end() <= _LOOKAHEAD or kind == "UNTERMCOMMENT"):
+            start = m.start()
+            return start, lineno + count("\n", last, start)
+        if kind == "SKIP":
+            continue
+        start, end = m.span()
+        lineno += count("\n", last, start)
+        last = start
+        if kind == "NAME":
+            yield keywords.get(m.group(), "NAME"), start, end, lineno
+        elif kind == "NUMBER":
+            value = m.group()
+            if value == ".":
+                yield "DOT", start, end, lineno
+            elif "." in value:
+                yield "FLOAT", start, end, lineno
+            else:
+                yield "INTEGER", start, end, lineno
+        elif kind == "LITERAL":
+            yield literals[m.group()], start, end, lineno
+        elif kind == "UNTERMCOMMENT":
+            yield kind, start, size, lineno
+            break
+        else:
+            yield kind, start, end, lineno
+    return size, lineno + count("\n", last, size)
+
+
+def _scan(source, base=0, lineno=1, final=True, pos=0):
+    """
+    Generate the Tokens that _spans() finds, returning what it returns.
+    base is the position of source[0] in the whole program.
+    """
+    spans = _spans(source, lineno, final, pos)
+    while True:
+        try:
+            toktype, start, end, line = next(spans)
+        except StopIteration as stop:
+            return stop.value
+        yield Token(toktype, source[start:end], line, base + start)
+
+
+def iter_tokens(source, chunksize=1 << 16):
+    """
+    Lazily generate the tokens of a file, reading it chunksize characters
+    at a time.
+
+    source is a filename or an open text file.  Tokens are identical to
+    those of tokenize_file(), but only the current chunk and the token being
+    yielded are held in memory.  Names, numbers and comments that straddle a
+    chunk boundary are carried over and rescanned with the next chunk.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source) as file:
+            yield from iter_tokens(file, chunksize)
+        return
+
+    buffer = ""
+    base = 0
+    lineno = 1
+    while True:
+        chunk = source.read(chunksize)
+        buffer += chunk
+        final = not chunk
+        if not buffer.isascii():
+            # Give up on streaming and let tokenize() handle the rest.  The
+            # buffer always starts where a fresh token may start, so this
+            # is the same as having tokenized the whole file in one go.
+            for tok in tokenize(buffer + source.read()):
+                tok.lineno += lineno - 1
+                tok.index += base
+                yield tok
+            return
+        used, lineno = yield from _scan(buffer, base, lineno, final)
+        if final:
+            return
+        buffer = buffer[used:]
+        base += used
+
+
+def _token_start(tok):
+    return tok.index
+
+
+def _token_end(tok):
+    return tok.index + len(tok.value)
+
+
+def retokenize(source, tokens, offset, deleted, inserted):
+    """
+    Update tokens, the result of tokenize(source), for an edit replacing
+    source[offset:offset + deleted] with the text inserted.
+
+    Only the damaged region is rescanned: scanning restarts after the last
+    token that ends (with its lookahead) before the edit and stops as soon
+    as a new token starts exactly where an old token after the edit
+    (shifted by the size change) started, since from there on both sources
+    are the same text.  The old
+    tokens from that point are reused with their index and lineno shifted.
+    An edit that opens or closes a /* comment simply rescans until the
+    streams agree again, or to the end of the source.
+
+    tokens is updated in place, so that it equals tokenize() of the new
+    source.  Returns the new source.
+    """
+    return retokenize_span(source, tokens, offset, deleted, inserted)[0]
+
+
+def retokenize_span(source, tokens, offset, deleted, inserted):
+    """
+    retokenize() that also tells which tokens it replaced.  Returns
+    (new_source, first, old_stop, new_stop): the old tokens[first:old_stop]
+    are now tokens[first:new_stop] and everything else was kept.
+    """
+    new_source = source[:offset] + inserted + source[offset + deleted :]
+    if not new_source.isascii():
+        old_stop = len(tokens)
+        tokens[:] = tokenize(new_source)
+        return new_source, 0, old_stop, len(tokens)
+
+    first = bisect.bisect_left(tokens, offset - _LOOKAHEAD, key=_token_end)
+    if first:
+        pos, lineno = _token_end(tokens[first - 1]), tokens[first - 1].lineno
+    else:
+        pos, lineno = 0, 1
+    delta = len(inserted) - deleted
+    edit_end = offset + len(inserted)
+    old = bisect.bisect_left(tokens, offset + deleted, lo=first, key=_token_start)
+    new = []
+    for tok in _scan(new_source, lineno=lineno, pos=pos):
+        if tok.index >= edit_end:
+            while old < len(tokens) and tokens[old].index + delta < tok.index:
+                old += 1
+            if old < len(tokens) and tokens[old].index + delta == tok.index:
+                lines = tok.lineno - tokens[old].lineno
+                if delta or lines:
+                    for t in itertools.islice(tokens, old, None):
+                        t.index += delta
+                        t.lineno += lines
+                tokens[first:old] = new
+                return new_source, first, old, first + len(new)
+        new.append(tok)
+    old_stop = len(tokens)
+    tokens[first:] = new
+    return new_source, first, old_stop, len(tokens)
+
+
+# Small-int codes for every token type, used by TokenBuffer.
+toktypes = [
+    "NAME",
+    "INTEGER",
+    "FLOAT",
+    "CHAR",
+    "DOT",
+    "ILLEGAL",
+    "UNTERMCOMMENT",
+    *literals.values(),
+    *keywords.values(),
+]
+toktype_codes = {toktype: code for code, toktype in enumerate(toktypes)}
+
+
+class TokenBuffer:
+    """
+    The tokens of one source string, stored column-wise.
+
+    Each token is a type code and the start offset, end offset and line of
+    its text in the source, kept in four arrays.  That is 13 bytes a token
+    (about 14 as measured, with the arrays' spare room) instead of a Token
+    object and its __dict__.  The columns are read one token at a time with
+    toktype_at(), value_at(), start_at(), end_at() and lineno_at(), which
+    build nothing but the value asked for.
+
+    Indexing returns an equivalent Token and slicing a TokenBuffer of the
+    tokens in the slice, so a TokenBuffer can also stand in wherever a list
+    of tokens is used.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.codes = array("B")
+        self.starts = array("I")
+        self.ends = array("I")
+        self.lines = array("I")
+
+    def append(self, toktype, start, end, lineno):
+        self.codes.append(toktype_codes[toktype])
+        self.starts.append(start)
+        self.ends.append(end)
+        self.lines.append(lineno)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            tokens = TokenBuffer(self.source)
+            tokens.codes = self.codes[n]
+            tokens.starts = self.starts[n]
+            tokens.ends = self.ends[n]
+            tokens.lines = self.lines[n]
+            return tokens
+        start = self.starts[n]
+        return Token(
+            toktypes[self.codes[n]],
+            self.source[start : self.ends[n]],
+            self.lines[n],
+            start,
+        )
+
+    def __iter__(self):
+        return (self[n] for n in range(len(self)))
+
+    def __repr__(self):
+        return f"TokenBuffer({len(self)} tokens)"
+
+    def toktype_at(self, n):
+        return toktypes[self.codes[n]]
+
+    def value_at(self, n):
+        return self.source[self.starts[n] : self.ends[n]]
+
+    def start_at(self, n):
+        return self.starts[n]
+
+    def end_at(self, n):
+        return self.ends[n]
+
+    def lineno_at(self, n):
+        return self.lines[n]
+
+
+def tokenize_buffer(source) -> TokenBuffer:
+    """Parse source string into a TokenBuffer holding the same tokens as tokenize()."""
+    buffer = TokenBuffer(source)
+    if not source.isascii():
+        for tok in tokenize(source):
+            buffer.append(tok.toktype, tok.index, tok.index + len(tok.value), tok.lineno)
+        return buffer
+
+    codes = buffer.codes.append
+    starts = buffer.starts.append
+    ends = buffer.ends.append
+    lines = buffer.lines.append
+    code_of = toktype_codes
+    for toktype, start, end, lineno in _spans(source):
+        codes(code_of[toktype])
+        starts(start)
+        ends(end)
+        lines(lineno)
+    return buffer
+
+
 def test_tokens():
     def extract(toks):
         return [(t.toktype, t.value) for t in toks]
@@ -213,6 +544,20 @@ def test_tokens():
         ("FALSE", "false"),
     ]
 
+    source = """/* header
+    comment */ var x1 int = 10;
+    var y = .5 + 2. * x1 / 3.25; // trailing
+    print 'a'; print '\\n'; print '\\x41' '\\'' ''' 'ab' '\\x4;
+    if x1 <= 4 && !(y >= 0) || x1 != 2 { print y; } /*/ $ @ . /* open"""
+    assert tokenize_regex(source) == tokenize(source)
+
+    assert list(iter_tokens(io.StringIO(source), chunksize=7)) == tokenize(source)
+    assert list(tokenize_buffer(source)) == tokenize(source)
+
+    tokens = tokenize(source)
+    edited = retokenize(source, tokens, source.index("10"), 2, "1 /*")
+    assert tokens == tokenize(edited)
+
 
 test_tokens()
 
@@ -0,0 +1,90 @@
+# visitor.py
+#
+# Base classes for passes over model trees, after the ones in Python's ast
+# module.  visit(node, *args) calls the method named visit_<Class> for the
+# node's class, trying the base classes in MRO order (so visit_Expression
+# catches every expression without a method of its own) and falling back
+# to generic_visit().  None is dispatched like any other value, to
+# visit_NoneType.
+#
+# Which method handles a class is worked out the first time a node of that
+# class is visited and then kept in a table on the visitor class, so every
+# later visit costs one dict lookup on type(node), however many node
+# classes the pass knows about.
+import dataclasses
+
+from model import *
+
+
+class NodeVisitor:
+    _dispatch = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._dispatch = {}
+
+    def visit(self, node, *args):
+        try:
+            method = self._dispatch[type(node)]
+        except KeyError:
+            method = self._resolve(type(node))
+        return method(self, node, *args)
+
+    @classmethod
+    def _resolve(cls, node_type):
+        for base in node_type.__mro__:
+            method = getattr(cls, f"visit_{base.__name__}", None)
+            if method is not None:
+                break
+        else:
+            method = cls.generic_visit
+        cls._dispatch[node_type] = method
+        return method
+
+    def generic_visit(self, node, *args):
+        """Visit the children of node."""
+        if isinstance(node, Node):
+            for f in node_fields(type(node)):
+                value = getattr(node, f.name)
+                if isinstance(value, list):
+                    for item in value:
+                        if isinstance(item, Node):
+                            self.visit(item, *args)
+                elif isinstance(value, Node):
+                    self.visit(value, *args)
+
+
+class NodeTransformer(NodeVisitor):
+    """
+    A NodeVisitor whose visit methods return the node to put in place of
+    the one visited.  generic_visit() transforms the children and returns
+    the node, or a copy of it if a child was replaced; nodes are not
+    changed in place, so this works on frozen and shared trees.  In a list
+    field, a visit that returns None drops the item and one that returns
+    a list splices its items in.
+    """
+
+    def generic_visit(self, node, *args):
+        if not isinstance(node, Node):
+            return node
+        changes = {}
+        for f in node_fields(type(node)):
+            old = getattr(node, f.name)
+            if isinstance(old, list):
+                new = []
+                for item in old:
+                    if isinstance(item, Node):
+                        item = self.visit(item, *args)
+                        if item is None:
+                            continue
+                        if isinstance(item, list):
+                            new.extend(item)
+                            continue
+                    new.append(item)
+                if len(new) != len(old) or any(a is not b for a, b in zip(new, old)):
+                    changes[f.name] = new
+            elif isinstance(old, Node):
+                new = self.visit(old, *args)
+                if new is not old:
+                    changes[f.name] = new
+        return dataclasses.replace(node, **changes) if changes else node